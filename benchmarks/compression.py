@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Weighs the CPU cost of each response compression coding and level against
+# the bytes it saves, on a collection payload of typical mongo records. Run
+# with `python benchmarks/compression.py`.
+
+from flask_slither.compression import ENCODINGS, compress
+from flask_slither.serializers import get_serializer
+from serializers import make_records
+
+import argparse
+import timeit
+
+LEVELS = {'br': [1, 4, 6, 9], 'gzip': [1, 6, 9], 'deflate': [1, 6, 9]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    payload = get_serializer('json').dumps(
+        {'records': make_records(args.records)}).encode('utf-8')
+    print("{} records, {} bytes, best of {} runs".format(
+        args.records, len(payload), args.repeat))
+    print("{:<10}{:>6}{:>12}{:>10}{:>10}{:>12}".format(
+        'coding', 'level', 'bytes', 'ratio', 'ms', 'MB/s'))
+    for name, (factory, available) in ENCODINGS.items():
+        if not available:
+            print("{:<10}{:>6}".format(name, 'n/a'))
+            continue
+        for level in LEVELS[name]:
+            size = len(compress(payload, name, level))
+            best = min(timeit.repeat(lambda: compress(payload, name, level),
+                                     number=1, repeat=args.repeat)) * 1000
+            print("{:<10}{:>6}{:>12}{:>9.1f}x{:>10.2f}{:>12.1f}".format(
+                name, level, size, len(payload) / size, best,
+                len(payload) / best / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Benchmarks the request pipeline of a `BaseResource`: GET, POST, PATCH and
+# DELETE through the Flask test client, and micro-benchmarks of the steps
+# each request goes through, on payloads of 1 to 100k records.
+#
+# The requests run against an in-memory stand-in of mongo (mongomock, which
+# must be installed) or a local mongod with `--backend mongod`. mongomock
+# scans the collection for every query, so instance requests on the larger
+# sizes are only meaningful against a mongod. Results can be saved as JSON
+# and compared with a stored baseline:
+#
+#   python benchmarks/pipeline.py --save baseline.json
+#   python benchmarks/pipeline.py --compare baseline.json
+#
+# The comparison exits with status 1 if any benchmark is slower than the
+# baseline by more than `--threshold`.
+
+from flask import Flask, json, make_response
+from flask_slither import register_resource
+from flask_slither.db import MongoDbQuery, get_serializer, logger
+from flask_slither.decorators import crossdomain
+from flask_slither.resources import BaseResource
+from serializers import make_records
+
+import argparse
+import copy
+import datetime
+import logging
+import platform
+import statistics
+import sys
+import timeit
+
+SIZES = [1, 100, 1000, 10000, 100000]
+DB_NAME = 'benchmark_slither'
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class MemoryDbQuery(MongoDbQuery):
+    """Queries a mongomock database shared by all requests in place of a
+       mongod"""
+    client = None
+
+    def __init__(self, **kwargs):
+        if MemoryDbQuery.client is None:
+            MemoryDbQuery.client = mongomock.MongoClient()
+        self.logger = kwargs.get('logger', logger)
+        self.collection = kwargs.get('collection', '')
+        self.client = MemoryDbQuery.client
+        self.db = self.client[kwargs.get('DB_NAME', DB_NAME)]
+        self.serializer = get_serializer(
+            kwargs.get('JSON_SERIALIZER', 'auto'))
+
+    @classmethod
+    def init_app(cls, app):
+        pass
+
+
+class BenchResource(BaseResource):
+    db_collection = 'benchmarks'
+    cors_enabled = True
+    # unvalidated writes log a warning per request
+    log_level = logging.ERROR
+
+
+def make_app(backend, host, port):
+    BenchResource.db_query = MemoryDbQuery if backend == 'memory' \
+        else MongoDbQuery
+    app = Flask('benchmark')
+    app.config.update({'DB_NAME': DB_NAME, 'DB_HOST': host,
+                       'DB_PORT': port})
+    register_resource(app, BenchResource, url='benchmarks')
+    return app
+
+
+def db_of(app):
+    with app.test_request_context('/benchmarks'):
+        return BenchResource().db_query.db
+
+
+def load(db, size):
+    """Replace the benchmark collection with `size` records"""
+    db[BenchResource.db_collection].drop()
+    records = make_records(size)
+    for i in range(0, size, 1000):
+        db[BenchResource.db_collection].insert_many(records[i:i + 1000])
+    return [r['_id'] for r in records]
+
+
+def time_it(f, repeat, number=1, setup=None):
+    """Returns the best and median ms of one call of `f`"""
+    runs = timeit.repeat(f, setup=setup or (lambda: None), number=number,
+                         repeat=repeat)
+    runs = [r / number * 1000 for r in runs]
+    return {'best_ms': min(runs), 'median_ms': statistics.median(runs)}
+
+
+def bench_requests(app, size, args):
+    """Time each method of the resource with `size` records stored"""
+    client = app.test_client()
+    ids = load(db_of(app), size)
+    n = min(size, args.requests)
+    body = json.dumps({'benchmarks': {'name': "New", 'score': 1}})
+    change = json.dumps({'benchmarks': {'score': 2}})
+
+    def check(r, status):
+        assert r.status_code == status, (r.status_code, r.data)
+
+    results = {}
+    results['GET collection'] = time_it(
+        lambda: check(client.get('/benchmarks'), 200), args.repeat)
+    results['GET instance'] = time_it(
+        lambda: [check(client.get('/benchmarks/{}'.format(i)), 200)
+                 for i in ids[:n]], args.repeat)
+    results['POST'] = time_it(
+        lambda: [check(client.post('/benchmarks', data=body,
+                                   content_type='application/json'), 201)
+                 for i in range(n)], args.repeat)
+    results['PATCH'] = time_it(
+        lambda: [check(client.patch('/benchmarks/{}'.format(i), data=change,
+                                    content_type='application/json'), 204)
+                 for i in ids[:n]], args.repeat)
+    # each record can only be deleted once, so they are put back between runs
+    results['DELETE'] = time_it(
+        lambda: [check(client.delete('/benchmarks/{}'.format(i)), 204)
+                 for i in ids[:n]], args.repeat,
+        setup=lambda: load(db_of(app), size))
+    # all but GET collection are timed per request
+    for name in ['GET instance', 'POST', 'PATCH', 'DELETE']:
+        results[name] = {k: v / n for k, v in results[name].items()}
+    return results
+
+
+def bench_steps(app, size, args):
+    """Time the steps of the pipeline on `size` records"""
+    records = make_records(size)
+    with app.test_request_context('/benchmarks', method='PATCH',
+                                  headers={'Origin': 'http://localhost'}):
+        resource = BenchResource()
+        results = {}
+        results['serialize'] = time_it(
+            lambda: resource.db_query.serialize('benchmarks', records),
+            args.repeat)
+
+        dirty = [dict(r, removed=None, address=dict(r['address'], zip=None))
+                 for r in records]
+        batches = []
+        results['_clean_record'] = time_it(
+            lambda: [resource.db_query._clean_record(r)
+                     for r in batches.pop()], args.repeat,
+            setup=lambda: batches.append(copy.deepcopy(dirty)))
+
+        changes = {'name': "Changed", 'score': 2}
+        results['merge_record_data'] = time_it(
+            lambda: [resource.merge_record_data(changes, r) for r in records],
+            args.repeat)
+
+        view = crossdomain(lambda self: make_response("", 200))
+        results['crossdomain'] = time_it(
+            lambda: [view(resource) for i in range(size)], args.repeat)
+    return results
+
+
+def run(args):
+    app = make_app(args.backend, args.host, args.port)
+    results = {}
+    for size in args.sizes:
+        print("{} records".format(size), file=sys.stderr)
+        for name, r in bench_steps(app, size, args).items():
+            results["{}[{}]".format(name, size)] = r
+        for name, r in bench_requests(app, size, args).items():
+            results["{}[{}]".format(name, size)] = r
+    db_of(app)[BenchResource.db_collection].drop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the results next to the `baseline` and return the names of
+       those that regressed"""
+    regressed = []
+    print("{:<28}{:>12}{:>12}{:>9}".format('benchmark', 'ms', 'baseline',
+                                           'ratio'))
+    for name, r in results.items():
+        base = baseline.get(name, None)
+        if base is None:
+            print("{:<28}{:>12.3f}{:>12}".format(name, r['best_ms'], 'n/a'))
+            continue
+        ratio = r['best_ms'] / base['best_ms'] if base['best_ms'] else 1
+        flag = ''
+        if ratio > threshold:
+            regressed.append(name)
+            flag = ' slower'
+        print("{:<28}{:>12.3f}{:>12.3f}{:>8.2f}x{}".format(
+            name, r['best_ms'], base['best_ms'], ratio, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backend', choices=['memory', 'mongod'],
+                        default='memory')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+                        help="comma separated numbers of records")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="most requests timed per method and size")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help="write the results to this file")
+    parser.add_argument('--compare', help="a results file to compare with")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="slowdown over the baseline that fails the run")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(',')]
+    if args.backend == 'memory' and mongomock is None:
+        parser.error("the memory backend needs mongomock installed")
+
+    results = run(args)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'backend': args.backend,
+                       'created': datetime.datetime.utcnow().isoformat(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.compare is None:
+        print("{:<28}{:>12}{:>12}".format('benchmark', 'best ms', 'median ms'))
+        for name, r in results.items():
+            print("{:<28}{:>12.3f}{:>12.3f}".format(
+                name, r['best_ms'], r['median_ms']))
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)['results']
+    return 1 if compare(results, baseline, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
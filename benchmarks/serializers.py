@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Compares the installed JSON serializer backends on documents shaped like
+# typical mongo records. Run with `python benchmarks/serializers.py`.
+
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+from flask_slither.serializers import SERIALIZERS, get_serializer
+from uuid import uuid4
+
+import argparse
+import json
+import timeit
+
+
+def make_records(count):
+    """Build `count` records with a mix of mongo and plain JSON types"""
+    now = datetime(2015, 6, 1, 12, 0, 0)
+    return [{
+        '_id': ObjectId(),
+        'name': "Record {}".format(i),
+        'owner': ObjectId(),
+        'token': uuid4(),
+        'created': now - timedelta(days=i),
+        'modified': now,
+        'active': i % 2 == 0,
+        'score': i * 1.5,
+        'tags': ['alpha', 'beta', 'gamma'],
+        'address': {'street': "{} Main Road".format(i), 'city': "Cape Town",
+                    'location': [18.4241, -33.9249]},
+        'history': [{'at': now, 'by': ObjectId(), 'note': "Updated"}
+                    for _ in range(3)],
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    payload = {'records': make_records(args.records)}
+    reference = json.loads(get_serializer('json').dumps(payload))
+    print("{} records, best of {} runs".format(args.records, args.repeat))
+    print("{:<12}{:>12}{:>12}".format('backend', 'ms', 'speedup'))
+    baseline = None
+    for name, (cls, available) in reversed(list(SERIALIZERS.items())):
+        if not available:
+            print("{:<12}{:>12}".format(name, 'n/a'))
+            continue
+        serializer = get_serializer(name)
+        assert json.loads(serializer.dumps(payload)) == reference, name
+        best = min(timeit.repeat(lambda: serializer.dumps(payload),
+                                 number=1, repeat=args.repeat)) * 1000
+        baseline = baseline or best
+        print("{:<12}{:>12.2f}{:>11.1f}x".format(name, best, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
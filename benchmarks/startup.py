@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Times registering many resources on an app, as a large API does at
+# startup, and the cost of building an inflect engine per registration as
+# `register_resource` used to. Run with `python benchmarks/startup.py`.
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.resources import BaseResource
+
+import argparse
+import inflect
+import timeit
+
+
+def make_resources(count):
+    """Build `count` resource classes with distinct names"""
+    return [type("Thing{}Resource".format(i), (BaseResource,),
+                 {'db_collection': "things{}".format(i)})
+            for i in range(count)]
+
+
+def register_all(resources):
+    app = Flask('startup')
+    for view in resources:
+        register_resource(app, view)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resources', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    resources = make_resources(args.resources)
+    print("{} resources, best of {} runs".format(args.resources, args.repeat))
+    best = min(timeit.repeat(lambda: register_all(resources),
+                             number=1, repeat=args.repeat)) * 1000
+    print("{:<24}{:>10.2f} ms{:>10.3f} ms/resource".format(
+        'register_resource', best, best / args.resources))
+    best = min(timeit.repeat(
+        lambda: [inflect.engine().plural(v.__name__.lower()[:-8])
+                 for v in resources],
+        number=1, repeat=args.repeat)) * 1000
+    print("{:<24}{:>10.2f} ms{:>10.3f} ms/resource".format(
+        'engine per resource', best, best / args.resources))
+
+
+if __name__ == '__main__':
+    main()
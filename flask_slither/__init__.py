@@ -8,7 +8,8 @@
     :copyright: (c) 2015 by Nico Gevers.
     :license: MIT, see LICENSE for more details.
 """
-import inflect
+from flask_slither import cors
+from flask_slither.meta import build_meta
 
 __author__ = 'Nico Gevers'
 __version__ = (1, 1, 7)
@@ -16,16 +17,29 @@ __version__ = (1, 1, 7)
 
 def register_resource(mod, view, **kwargs):
     """Register the resource on the resource name or a custom url"""
-    resource_name = view.__name__.lower()[:-8]
-    endpoint = kwargs.get('endpoint', "{}_api".format(resource_name))
-    plural_resource_name = inflect.engine().plural(resource_name)
-    path = kwargs.get('url', plural_resource_name).strip('/')
-    url = '/{}'.format(path)
+    # work out the settings that don't change between requests once
+    meta = build_meta(view, kwargs.get('url', None),
+                      kwargs.get('endpoint', None))
+    view._resource_meta = meta
+    url = meta.url
     setattr(view, '_url', url)  # need this for 201 location header
-    view_func = view.as_view(endpoint)
 
-    mod.add_url_rule(url, view_func=view_func,
-                     methods=['GET', 'POST', 'OPTIONS'])
+    # set up the db connection pool, and start the hooks left queued by a
+    # previous run, once per app rather than per request
+    for ext in [view.db_query, getattr(view, 'hook_runner', None)]:
+        init_app = getattr(ext, 'init_app', None)
+        if init_app is None:
+            continue
+        if hasattr(mod, 'record_once'):
+            mod.record_once(lambda state, f=init_app: f(state.app))
+        else:
+            init_app(mod)
+    view_func = cors.preflight(view, view.as_view(meta.endpoint), meta)
+
+    methods = ['GET', 'POST', 'OPTIONS']
+    if getattr(view, 'allow_bulk', False):
+        methods += ['PATCH', 'DELETE']
+    mod.add_url_rule(url, view_func=view_func, methods=methods)
     mod.add_url_rule('{}/<obj_id>'.format(url),
                      view_func=view_func,
                      methods=['GET', 'PATCH', 'PUT', 'DELETE', 'OPTIONS'])
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""An asyncio counterpart of the resource workflow, to be served by Quart on
+an ASGI server. Queries go through motor, so a worker keeps serving other
+requests while one waits on the database. Both are optional dependencies:
+
+    pip install flask-slither[async]
+
+`AsyncBaseResource` is configured like `BaseResource` and is registered with
+`register_resource` on a Quart app or blueprint. Authentication, validation
+and the `post_save`/`post_delete` hooks may be plain methods or coroutines.
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from quart import request, g, current_app, Response
+from quart.views import MethodView
+from flask_slither import formats
+from flask_slither.db import MongoDbQuery, get_serializer, timed, \
+    _client_key, logger
+from flask_slither.resources import Resource
+from functools import wraps
+
+import asyncio
+import inspect
+import json
+import weakref
+
+
+#: The motor clients of each event loop. A motor client belongs to the loop
+#: it was created on, so clients are pooled per loop rather than per process.
+_clients = weakref.WeakKeyDictionary()
+
+
+async def _resolve(value):
+    """Await `value` if it is awaitable, so hooks can be plain methods or
+       coroutines"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def get_async_client(**kwargs):
+    """Return the `AsyncIOMotorClient` of the running event loop for the DB_*
+       settings in `kwargs`, keyed like `db.get_client`"""
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+    key = _client_key(kwargs)
+    if key not in clients:
+        logger.info("Creating AsyncIOMotorClient for %s:%s", *key[:2])
+        clients[key] = AsyncIOMotorClient(key[0], key[1], io_loop=loop,
+                                          **dict(key[2]))
+    return clients[key]
+
+
+async def close_async_clients():
+    """Close the clients of the running event loop, e.g. after serving"""
+    for client in _clients.pop(asyncio.get_running_loop(), {}).values():
+        client.close()
+
+
+class AsyncMongoDbQuery(MongoDbQuery):
+    """The queries of `MongoDbQuery` as coroutines on a motor client. The
+       bulk writes `create_many`, `update_many` and `delete_many` return
+       coroutines too."""
+
+    def __init__(self, **kwargs):
+        self.logger = kwargs.get('logger', logger)
+        self.collection = kwargs.get('collection', '')
+        self.client = get_async_client(**kwargs)
+        self.db = self.client[kwargs.get('DB_NAME', 'testing_slither')]
+        self.serializer = get_serializer(kwargs.get('JSON_SERIALIZER', 'auto'))
+
+    @classmethod
+    def init_app(cls, app):
+        """Close the clients when `app` stops serving"""
+        if not app.extensions.get('slither_aio', False):
+            app.extensions['slither_aio'] = True
+            app.after_serving(close_async_clients)
+
+    @timed('db.find_one')
+    async def get_instance(self, collection, obj_id, **kwargs):
+        self.logger.info("Getting single record")
+        args = self._instance_query(obj_id, **kwargs)
+        if args is None:
+            return {}
+        return await self.db[collection].find_one(*args)
+
+    @timed('db.find')
+    async def get_collection(self, collection, **kwargs):
+        """See `MongoDbQuery.get_collection`. When streaming, the motor cursor
+           is returned to be iterated with `async for`."""
+        cursor = self._find(collection, **kwargs)
+        if kwargs.get('stream', False):
+            return cursor
+        records = await cursor.to_list(length=None)
+        if kwargs.get('before', None) is not None:
+            records.reverse()
+        self.logger.debug("Got %s results", len(records))
+        return records
+
+    @timed('db.find')
+    async def get_instances(self, collection, obj_ids, **kwargs):
+        self.logger.info("Getting %s records", len(obj_ids))
+        args = self._instances_query(obj_ids, **kwargs)
+        if args is None:
+            return {}
+        records = await self.db[collection].find(*args).to_list(length=None)
+        return {str(r['_id']): r for r in records}
+
+    @timed('db.bulk_write')
+    async def _bulk_write(self, collection, operations, ordered=True):
+        self.logger.debug("Bulk writing %s operations, ordered: %s",
+                          len(operations), ordered)
+        if len(operations) < 1:
+            return []
+        try:
+            await self.db[collection].bulk_write(operations, ordered=ordered)
+        except BulkWriteError as e:
+            self.logger.warning("Bulk write errors: %s",
+                                e.details.get('writeErrors', []))
+            return self._bulk_errors(len(operations), ordered, e)
+        return self._bulk_errors(len(operations), ordered)
+
+    @timed('db.count')
+    async def count(self, collection, query, estimated=False):
+        if estimated:
+            return await self.db[collection].estimated_document_count()
+        return await self.db[collection].count_documents(query)
+
+    @timed('db.delete')
+    async def delete(self, collection, record):
+        if record is not None and '_id' in record:
+            self.logger.info("Deleting record: %s", record['_id'])
+            await self.db[collection].delete_one({'_id': record['_id']})
+
+    @timed('db.insert')
+    async def create(self, collection, record):
+        self.logger.info("Creating new record")
+        result = await self.db[collection].insert_one(
+            self._clean_record(record))
+        return result.inserted_id
+
+    @timed('db.update')
+    async def update(self, collection, record, orig_record,
+                     full_update=False):
+        self.logger.info("Updating record.")
+        if '_id' not in record or len(record) < 1:
+            self.logger.warning("Not updating record without an id")
+            return
+        record.pop('_id', '')
+        _id = orig_record['_id']
+        if full_update:
+            return await self.db[collection].find_one_and_replace(
+                {'_id': _id}, self._clean_record(record),
+                return_document=ReturnDocument.AFTER)
+        return await self.db[collection].find_one_and_update(
+            {'_id': _id}, {'$set': record},
+            return_document=ReturnDocument.AFTER)
+
+
+def crossdomain(f):
+    """The `decorators.crossdomain` workflow for coroutine endpoints, with
+       the same compiled `cors.CorsPolicy`"""
+    @wraps(f)
+    async def decorator(self, *args, **kwargs):
+        with self.timings.phase('total'):
+            if not self._meta.cors_enabled and 'origin' in request.headers:
+                resp = self._make_response(405, "CORS request rejected")
+            else:
+                resp = await f(self, *args, **kwargs)
+                with self.timings.phase('cors'):
+                    refused = self._meta.cors.apply(resp.headers,
+                                                    request.headers)
+                if refused is not None:
+                    resp = self._make_response(405, refused)
+        if self.server_timing:
+            resp.headers['Server-Timing'] = self.timings.header()
+        return resp
+    return decorator
+
+
+async def is_authorized(self, record):
+    """Runs the `is_authorized` of the authorization class of the resource
+       `self` for `record`, which may be a coroutine"""
+    a = self._auth_instance('authorization' if hasattr(
+        self, 'authorization') else 'authentication')
+    if a is None or not hasattr(a, 'is_authorized'):
+        return True
+    version = None if self.version_field is None or record is None \
+        else record.get(self.version_field, None)
+    key = self._auth_key(
+        a, 'authorization', request.method,
+        None if record is None else record.get('_id', None), version)
+    error = self._auth_cached(key)
+    if error is None:
+        error = "" if await _resolve(a.is_authorized(record=record)) \
+            else "Unauthorized"
+        self._auth_store(key, error)
+    return not error
+
+
+def endpoint(f):
+    """The `decorators.endpoint` workflow for coroutine endpoints. Bulk
+       requests aren't supported."""
+
+    async def check_authentication(self, **kwargs):
+        a = self._auth_instance('authentication')
+        if a is None or not hasattr(a, 'is_authenticated'):
+            return
+        key = self._authentication_key(a, **kwargs)
+        error = self._auth_cached(key)
+        if error is None:
+            error = "" if await _resolve(a.is_authenticated(**kwargs)) else \
+                getattr(g, 'authentication_error', 'Authentication failed')
+            self._auth_store(key, error)
+        if error:
+            self.logger.warning("Authentication failed: %s", error)
+            return self._make_response(401, error, abort=True)
+
+    async def check_authorization(self):
+        if not await is_authorized(self, g._resource_instance):
+            self.logger.warning("Authorization failed")
+            return self._make_response(403, "Authorization failed", abort=True)
+
+    async def validate_request(self, **kwargs):
+        if getattr(self, 'validation', None) is None:
+            return
+        v = self.validation()
+        method = 'validate_{}'.format(request.method.lower())
+        if not hasattr(v, method):
+            return
+        errors = await _resolve(getattr(v, method)(**kwargs))
+        if errors is not None and len(errors) > 0:
+            self.logger.warning("Validation errors found")
+            self._make_response(400, errors, abort=True)
+
+    async def load_request_data(self):
+        try:
+            d = (await request.get_data()).decode('utf-8')
+            g._rq_data = {} if d.strip() == "" else json.loads(d)
+        except ValueError:
+            return self._make_response(400, "Malformed JSON in request body",
+                                       abort=True)
+        if not isinstance(g._rq_data, dict):
+            return self._make_response(
+                400, "Bulk requests are unavailable", abort=True)
+        if self.enforce_json_root and g._rq_data != {} and \
+                list(g._rq_data.keys()) != [self._payload_root()]:
+            return self._make_response(
+                400, "Invalid JSON root in request body", abort=True)
+        g._rq_data = g._rq_data.get(self._payload_root(), g._rq_data)
+
+    @wraps(f)
+    async def decorator(self, *args, **kwargs):
+        self.logger.info("Got %s request", request.method)
+        if request.method not in self._meta.allowed_methods:
+            msg = "Request method {} is unavailable".format(request.method)
+            return self._make_response(405, msg, abort=True)
+        if self._meta.missing_collection:
+            return Response("No DB collection defined", 424)
+
+        if request.method in ['POST', 'PUT', 'PATCH']:
+            await load_request_data(self)
+        with self.timings.phase('authentication'):
+            await check_authentication(self, **kwargs)
+        if not kwargs.get('obj_id', False) and \
+                request.method in ['PATCH', 'DELETE']:
+            return self._make_response(
+                400, "Bulk requests are unavailable", abort=True)
+
+        if kwargs.get('obj_id', False):
+            kwargs['obj_id'] = self.fiddle_id(kwargs['obj_id'])
+            with self.timings.phase('instance'):
+                await self._get_instance(**kwargs)
+        else:
+            g._resource_instance = {}
+
+        with self.timings.phase('authorization'):
+            await check_authorization(self)
+        with self.timings.phase('validation'):
+            if request.method in ['POST', 'PUT', 'PATCH']:
+                r = self.transform_record(g._rq_data)
+                g._saveable_record = dict(self.merge_record_data(
+                    r, dict(g._resource_instance or r)))
+                await validate_request(self, data=g._saveable_record)
+            else:
+                await validate_request(self)
+        return await f(self, *args, **kwargs)
+    return decorator
+
+
+class AsyncBaseResource(MethodView, Resource):
+    """A `Resource` whose endpoints are coroutines, for Quart apps. It
+       takes the settings of `BaseResource`, except for `allow_bulk`,
+       `stream_collections`, `compression`, `hook_runner`, `single_flight`,
+       `media_types`, `timeout`, `read_preference` and `read_your_writes`
+       which aren't supported. It only speaks JSON."""
+
+    #: This class is used for all database queries as well as serialization
+    #: of the final records
+    db_query = AsyncMongoDbQuery
+
+    response_class = Response
+    media_types = [formats.JSON]
+    compression = False
+
+    def __init__(self, **kwargs):
+        self.app = None
+        self._init(current_app, request)
+
+    async def _get_instance(self, **kwargs):
+        self.logger.info("Loading instance: %s", kwargs['obj_id'])
+        g._resource_instance = await self.db_query.get_instance(
+            self.db_collection, kwargs['obj_id'])
+        return g._resource_instance
+
+    def _make_response(self, status, data=None, **kwargs):
+        return self._build_response(request, status, data, **kwargs)
+
+    async def _included(self, records, tree):
+        if len(tree) < 1:
+            return
+        batches = self._include_batches(records, tree)
+        try:
+            resource, collection, batch, kwargs = next(batches)
+            while True:
+                found = await self.db_query.get_instances(collection, batch,
+                                                          **kwargs)
+                if resource is not None:
+                    found = {k: r for k, r in found.items()
+                             if await is_authorized(resource, r)}
+                resource, collection, batch, kwargs = batches.send(found)
+        except StopIteration as e:
+            return e.value
+
+    async def _total(self, query):
+        if self.count_mode is None:
+            return
+        estimated, key, total = self._count_key(query)
+        if total is None:
+            total = self._counted(key, await self.db_query.count(
+                self.db_collection, query, estimated=estimated))
+        return int(total)
+
+    async def _saved(self, record):
+        await _resolve(super()._saved(record))
+
+    async def _deleted(self, record):
+        await _resolve(super()._deleted(record))
+
+    @crossdomain
+    @endpoint
+    async def get(self, **kwargs):
+        params = self._get_params(request, **kwargs)
+        media_type = self._media_type(request)
+        try:
+            include = self._include_tree(request.args.get('include', ''))
+        except ValueError as e:
+            return self._make_response(400, str(e))
+
+        if 'obj_id' in kwargs:
+            etag, last_modified = \
+                self._record_validators(request, g._resource_instance)
+            response = self._not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+            key = self._cache_key(request, params, **kwargs)
+            payload = self._cached(key)
+            if payload is None:
+                record = await self.db_query.get_instance(
+                    self.db_collection, kwargs['obj_id'], **params)
+                if record in [{}, None]:
+                    return self._make_response(404)
+                included = await self._included([record], include)
+                payload = self._serialize(self.transform_payload(record),
+                                          key, media_type, included=included)
+            return self._make_response(200, payload, no_serialize=True,
+                                       etag=etag, last_modified=last_modified,
+                                       mimetype=media_type)
+
+        try:
+            params['query'] = self._filter_query(params['query'], request.args)
+            self._page_params(request, params)
+            key = self._cache_key(request, params, **kwargs)
+            payload, total = self._cached_total(key)
+            if payload is None:
+                total = await self._total(params['query'])
+                limit = self._look_ahead(params)
+                records = await self.db_query.get_collection(
+                    self.db_collection, **params)
+                links = self._page_links(request, records, limit, params)
+                payload, total = self._collection_payload(
+                    records, key, media_type, total, links=links,
+                    included=await self._included(records, include))
+            meta, headers = self._count_members(total)
+        except ValueError as e:
+            return self._make_response(400, str(e))
+
+        return self._make_response(200, payload, no_serialize=True,
+                                   headers=headers, mimetype=media_type)
+
+    @crossdomain
+    @endpoint
+    async def post(self, **kwargs):
+        record = g._saveable_record
+        record['_id'] = await self.db_query.create(self.db_collection, record)
+        await self._saved(record)
+        return self._written(request, record, created=True)
+
+    @crossdomain
+    @endpoint
+    async def put(self, **kwargs):
+        record = await self.db_query.update(
+            self.db_collection, g._saveable_record,
+            orig_record=g._resource_instance, full_update=True)
+        await self._saved(record)
+        return self._written(request, record)
+
+    @crossdomain
+    @endpoint
+    async def patch(self, **kwargs):
+        record = await self.db_query.update(
+            self.db_collection, g._saveable_record,
+            orig_record=g._resource_instance)
+        await self._saved(record)
+        return self._written(request, record)
+
+    @crossdomain
+    @endpoint
+    async def delete(self, **kwargs):
+        await self.db_query.delete(self.db_collection, g._resource_instance)
+        await self._deleted(g._resource_instance)
+        return self._make_response(204)
+
+    @crossdomain
+    async def options(self, **kwargs):
+        if self._meta.cors_enabled:
+            return self._make_response(200)
+        return self._make_response(405, "CORS request rejected")
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+from bson import json_util
+from collections import OrderedDict
+from flask_slither.deadlines import DeadlineExceeded
+
+import hashlib
+import math
+import threading
+import time
+
+
+class BaseCache():
+    """The interface of a cache backend. Keys are strings and entries expire
+       after their `ttl` in seconds, or never if it is None.
+
+       Entries are grouped into namespaces, e.g. one per db collection. Each
+       namespace has a generation which is part of its keys, so a whole
+       namespace is invalidated by bumping its generation, without having to
+       find its entries. Old entries simply expire or get evicted."""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Increment the integer at `key` and return the new value"""
+        raise NotImplementedError
+
+    def key(self, namespace, *parts):
+        """Build a key in `namespace` from any BSON serializable `parts`"""
+        digest = hashlib.sha1(
+            json_util.dumps(parts, sort_keys=True).encode('utf-8'))
+        return "{}:{}:{}".format(namespace, self.generation(namespace),
+                                 digest.hexdigest())
+
+    def generation(self, namespace):
+        return int(self.get('gen:{}'.format(namespace)) or 0)
+
+    def invalidate(self, namespace):
+        """Drop all entries in `namespace`"""
+        self.incr('gen:{}'.format(namespace))
+
+    def lookup(self, key):
+        """Get `key` and count the hit or miss"""
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class LRUCache(BaseCache):
+    """An in-process cache holding at most `max_size` entries. The least
+       recently used entry is evicted to make space for a new one."""
+
+    def __init__(self, max_size=1024, ttl=None):
+        BaseCache.__init__(self, ttl)
+        self.max_size = max_size
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, namespace):
+        # kept apart from the entries so they are never evicted
+        return self._generations.get(namespace, 0)
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._generations[namespace] = \
+                self._generations.get(namespace, 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._entries.get(key, (0, None))[0] + 1
+            self._entries[key] = (value, None)
+            self._entries.move_to_end(key)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        stats = BaseCache.stats(self)
+        stats.update({'size': len(self._entries),
+                      'evictions': self.evictions})
+        return stats
+
+
+class RedisCache(BaseCache):
+    """A cache shared between processes, stored in redis. `client` is a
+       `redis.StrictRedis` or anything else with the same get, set, delete
+       and incr methods."""
+
+    def __init__(self, client, prefix='slither:', ttl=None):
+        BaseCache.__init__(self, ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, value,
+                        ex=None if ttl is None else int(ttl))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+class _Call():
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    """Runs one call per key at a time. Callers asking for a key that is
+       already in flight wait for that call and share its result, or its
+       exception, instead of making their own. Each caller only waits as
+       long as its own deadline allows."""
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def key(self, *parts):
+        """Build a key from any BSON serializable `parts`"""
+        return hashlib.sha1(json_util.dumps(
+            parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def do(self, key, f, deadline=None):
+        """Returns the result of `f()`, or of the call of `key` in flight.
+           Waiting for the call in flight raises `DeadlineExceeded` when the
+           `deadlines.Deadline` is spent, and a call that ran out of its own
+           time is made again on the caller's budget."""
+        while True:
+            with self._lock:
+                call = self._flights.get(key, None)
+                if call is None:
+                    call = self._flights[key] = _Call()
+                    self.calls += 1
+                    break
+                self.shared += 1
+            if not call.done.wait(self._timeout(deadline)):
+                deadline.check()
+                continue
+            if isinstance(call.error, DeadlineExceeded):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = f()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            call.done.set()
+        return call.result
+
+    def _timeout(self, deadline):
+        if deadline is None:
+            return
+        remaining = deadline.remaining()
+        return max(0, remaining) if math.isfinite(remaining) else None
+
+    def stats(self):
+        return {'calls': self.calls, 'shared': self.shared}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _ZlibCompressor():
+    """Incremental gzip or deflate compression of a response body"""
+
+    def __init__(self, wbits, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        """Returns what has been compressed so far, so it can be sent as a
+           chunk of a streamed body"""
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor():
+    """Incremental brotli compression of a response body"""
+
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+#: The content codings in order of preference, with a factory taking the
+#: compression level and whether the coding is available.
+ENCODINGS = OrderedDict([
+    ('br', (_BrotliCompressor, brotli is not None)),
+    # gzip has a gzip header and trailer (wbits 16 + 15), while the http
+    # deflate coding is the zlib format (wbits 15)
+    ('gzip', (lambda level: _ZlibCompressor(31, level), True)),
+    ('deflate', (lambda level: _ZlibCompressor(15, level), True)),
+])
+
+#: The default compression level of each coding. Brotli's scale is 0-11 and
+#: its higher levels are too slow for responses built on the fly.
+LEVELS = {'br': 4, 'gzip': 6, 'deflate': 6}
+
+
+def available_encodings():
+    return [name for name, (f, available) in ENCODINGS.items() if available]
+
+
+def compressor(encoding, level=None):
+    """Returns an incremental compressor for `encoding`"""
+    factory, available = ENCODINGS[encoding]
+    if not available:
+        raise ValueError("{} compression is unavailable".format(encoding))
+    return factory(LEVELS[encoding] if level is None else level)
+
+
+def compress(data, encoding, level=None):
+    """Compress the bytes `data` in one go"""
+    c = compressor(encoding, level)
+    return c.compress(data) + c.finish()
+
+
+def compress_stream(chunks, encoding, level=None):
+    """Compress an iterable of str or bytes chunks as they are produced.
+       Each chunk is flushed so the client can decode the body
+       incrementally, as it could when it wasn't compressed."""
+    c = compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = c.compress(chunk) + c.flush()
+        if len(data) > 0:
+            yield data
+    yield c.finish()
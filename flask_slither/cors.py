@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from flask import make_response, request, current_app
+from flask_slither.cache import LRUCache
+from flask_slither.serializers import get_serializer
+from functools import wraps
+
+import fnmatch
+import re
+import time
+
+#: The origin decisions
+ALLOWED = 'allowed'
+BLACKLISTED = 'CORS request blacklisted'
+REFUSED = 'CORS request refused'
+
+
+def _compile_hosts(hosts):
+    """Split `hosts` into a frozenset of exact hostnames and a list of
+       compiled patterns. Hosts may be regular expressions, either compiled
+       or as strings starting with '^', or wildcards such as
+       '*.example.com'. Patterns have to match the whole hostname."""
+    exact, patterns = set(), []
+    for host in hosts:
+        if hasattr(host, 'match'):
+            patterns.append(host)
+        elif host.startswith('^'):
+            patterns.append(re.compile(host))
+        elif any(c in host for c in '*?['):
+            patterns.append(re.compile(fnmatch.translate(host)))
+        else:
+            exact.add(host)
+    return frozenset(exact), patterns
+
+
+class CorsPolicy():
+    """A resource's `cors_config`, compiled once when the resource is
+       registered. Origin decisions are memoized in an LRU cache of
+       `memo_size` origins."""
+
+    def __init__(self, config, memo_size=1024):
+        self.allow_methods = ", ".join(
+            list(config.get('methods', [])) + ["OPTIONS"])
+        self.max_age = str(config.get('max_age', 21600))
+        self.blacklist = _compile_hosts(config.get('blacklist', None) or [])
+        allowed = config.get('allowed', None)
+        self.allowed = None if allowed is None else _compile_hosts(allowed)
+        headers = config.get('headers', None)
+        self.headers = None if headers is None else \
+            {h.lower(): h for h in headers}
+        self._memo = LRUCache(max_size=memo_size)
+
+    def _matches(self, hostname, hosts):
+        exact, patterns = hosts
+        # a prefix match would let api.example.com.evil.io pass for
+        # ^api\.example\.com
+        return hostname in exact or \
+            any(p.fullmatch(hostname) is not None for p in patterns)
+
+    def check_origin(self, origin=None, host=None):
+        """Returns `ALLOWED`, or the reason the request from `origin`, or
+           from `host` if there is no origin, is refused"""
+        key = origin if origin is not None else '//' + host
+        decision = self._memo.get(key)
+        if decision is None:
+            # the netloc of scheme://hostname[:port]
+            hostname = key.partition('//')[2].partition('/')[0]
+            if self._matches(hostname, self.blacklist):
+                decision = BLACKLISTED
+            elif self.allowed is not None and \
+                    not self._matches(hostname, self.allowed):
+                decision = REFUSED
+            else:
+                decision = ALLOWED
+            self._memo.set(key, decision)
+        return decision
+
+    def allow_headers(self, requested):
+        """Returns the `Access-Control-Allow-Headers` value for the comma
+           separated `requested` headers"""
+        if self.headers is None:
+            return requested
+        names = (h.strip() for h in requested.split(','))
+        return ", ".join(self.headers[n.lower()] for n in names
+                         if n.lower() in self.headers)
+
+    def apply(self, headers, request_headers):
+        """Adds the CORS headers for a request with `request_headers` to the
+           response `headers`. Returns the reason the request is refused, if
+           it is. The request is passed in so Flask and Quart apps share the
+           policy."""
+        headers['Access-Control-Allow-Methods'] = self.allow_methods
+        headers['Access-Control-Max-Age'] = self.max_age
+        origin = request_headers.get('origin', None)
+        decision = self.check_origin(origin, request_headers.get('host', ''))
+        if decision != ALLOWED:
+            return decision
+        if origin is not None:
+            headers['Access-Control-Allow-Origin'] = origin
+        requested = request_headers.get('access-control-request-headers',
+                                        None)
+        if requested is not None:
+            headers['Access-Control-Allow-Headers'] = \
+                self.allow_headers(requested)
+
+
+def _preflight_response(status, msg=None):
+    if msg is None:
+        response = make_response("", status)
+        response.mimetype = 'text/plain'
+    else:
+        serializer = get_serializer(
+            current_app.config.get('JSON_SERIALIZER', 'auto'))
+        response = make_response(serializer.dumps({'errors': msg}), status)
+        response.mimetype = 'application/json'
+    response.headers.add('Cache-Control',
+                         'max-age={},must-revalidate'.format(30))
+    response.expires = time.time() + 30
+    return response
+
+
+def preflight(view, view_func, meta):
+    """Wraps the `view_func` of the resource class `view` so that OPTIONS
+       requests are answered from the CORS policy of its `meta`, without
+       instantiating the resource. Resources that override `options` are
+       left alone."""
+    if not getattr(view.options, 'answers_preflight', False):
+        return view_func
+    cors = meta.cors
+
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        if request.method != 'OPTIONS':
+            return view_func(*args, **kwargs)
+        if not meta.cors_enabled:
+            return _preflight_response(405, "CORS request rejected")
+        response = _preflight_response(200)
+        refused = cors.apply(response.headers, request.headers)
+        if refused is not None:
+            return _preflight_response(405, refused)
+        return response
+    return wrapper
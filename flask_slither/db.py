@@ -1,45 +1,281 @@
 # -*- coding: utf-8 -*-
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
-from pymongo import MongoClient
-from uuid import UUID
-from datetime import datetime
+from bson import json_util
+from pymongo import MongoClient, InsertOne, UpdateOne, DeleteOne, \
+    ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo.monitoring import ConnectionPoolListener
+from flask_slither import formats, slowlog
+from flask_slither.metrics import NULL_TIMINGS
+from flask_slither.serializers import JSONEncoder, get_serializer  # noqa
+from functools import wraps
 
-import json
+import base64
+import inspect
 import logging
+import os
+import threading
 
 
-class JSONEncoder(json.JSONEncoder):
-    """Encode all fancy mongo objects into normal strings. While it is useful
-       in some cases to use the mongo json_util class, generally we want to
-       hide complexity for the API client, and so don't return types. It is
-       up to the API to convert incoming types, and up to this class to
-       serialize all complex objects to standard JSON types"""
+logger = logging.getLogger(__name__)
 
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, UUID):
-            return str(obj).replace('-', '')
-        if isinstance(obj, datetime):
-            return int(obj.timestamp())
-        return json.JSONEncoder.default(self, obj)
+#: Maps app config keys onto the `MongoClient` connection pool options. Keys
+#: that aren't set in the config are left to the pymongo defaults.
+#: DB_WAIT_QUEUE_MULTIPLE is only known to pymongo 3.
+CLIENT_OPTIONS = {
+    'DB_MAX_POOL_SIZE': 'maxPoolSize',
+    'DB_MIN_POOL_SIZE': 'minPoolSize',
+    'DB_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'DB_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+    'DB_WAIT_QUEUE_MULTIPLE': 'waitQueueMultiple',
+    'DB_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'DB_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'DB_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'DB_REPLICA_SET': 'replicaSet',
+    'DB_READ_PREFERENCE': 'readPreference',
+    'DB_MAX_STALENESS_SECONDS': 'maxStalenessSeconds',
+}
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+class PoolStats(ConnectionPoolListener):
+    """Keeps running counters of the connection pool events of a client so
+       they can be scraped with `pool_stats`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            'created': 0,
+            'closed': 0,
+            'checked_out': 0,
+            'checked_in': 0,
+            'checkout_failed': 0,
+            'in_use': 0,
+            'cleared': 0,
+        }
+
+    def _incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['open'] = stats['created'] - stats['closed']
+        return stats
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._incr('cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._incr('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._incr('checked_out')
+        self._incr('in_use')
+
+    def connection_checked_in(self, event):
+        self._incr('checked_in')
+        self._incr('in_use', -1)
+
+
+def _client_key(config):
+    options = tuple(sorted(
+        (option, config[key]) for key, option in CLIENT_OPTIONS.items()
+        if config.get(key, None) is not None))
+    host = config.get('DB_HOST', 'localhost')
+    # the members of a replica set can be given as a list of hosts
+    return (host if isinstance(host, str) else tuple(host),
+            config.get('DB_PORT', 27017), options)
+
+
+def encode_position(record, sort):
+    """Return an opaque continuation token for the position of `record` in
+       the `sort` order"""
+    position = [[f for f, d in sort], [record.get(f, None) for f, d in sort]]
+    token = base64.urlsafe_b64encode(json_util.dumps(position).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_position(token, sort):
+    """Return the sort values in the continuation `token`. Raises a
+       `ValueError` if the token is malformed or belongs to another sort"""
+    try:
+        token = token + '=' * (-len(token) % 4)
+        fields, values = json_util.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except Exception:
+        # the token comes from the client, and extended JSON fails to load
+        # forged values in many ways, e.g. {"$oid": "zz"} or {"$date": "x"}
+        raise ValueError("Malformed continuation token")
+    if fields != [f for f, d in sort] or len(values) != len(fields):
+        raise ValueError("Continuation token doesn't match the sort order")
+    return values
+
+
+def timed(phase):
+    """Records the time spent in the decorated query as `phase` of the
+       request timings. Coroutines are timed until they complete."""
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def async_wrapper(self, *args, **kwargs):
+                with self.timings.phase(phase):
+                    return await f(self, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            with self.timings.phase(phase):
+                return f(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_client(**kwargs):
+    """Return the process wide `MongoClient` for the DB_* settings in
+       `kwargs`. Clients are keyed on the host, port and pool options, so
+       every `MongoDbQuery` with the same settings shares one connection
+       pool. After a fork the child builds its own clients rather than
+       reusing the sockets inherited from the parent."""
+    global _clients_pid
+    key = _client_key(kwargs)
+    if _clients_pid == os.getpid() and key in _clients:
+        return _clients[key][0]
+
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # never close these, the parent process still owns the sockets
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if key not in _clients:
+            logger.info("Creating MongoClient for %s:%s", *key[:2])
+            stats = PoolStats()
+            client = MongoClient(key[0], key[1], connect=False,
+                                 event_listeners=[stats], **dict(key[2]))
+            _clients[key] = (client, stats)
+        return _clients[key][0]
+
+
+def pool_stats():
+    """Return the connection pool counters for each client in this process"""
+    with _clients_lock:
+        clients = list(_clients.items()) \
+            if _clients_pid == os.getpid() else []
+    return [{'host': key[0], 'port': key[1], 'options': dict(key[2]),
+             'pool': stats.stats()} for key, (client, stats) in clients]
+
+
+def close_clients():
+    """Close all pooled clients, e.g. on application shutdown"""
+    with _clients_lock:
+        if _clients_pid == os.getpid():
+            for client, stats in _clients.values():
+                client.close()
+        _clients.clear()
 
 
 class MongoDbQuery():
     """This class encapsulates some method for querying the mongo database."""
 
+    #: Records the time spent in each query. Resources replace it with their
+    #: own `metrics.Timings` when instrumentation is on.
+    timings = NULL_TIMINGS
+
+    #: The `deadlines.Deadline` of the request. Queries are given the time
+    #: left as their `maxTimeMS`, and nothing is sent once it's spent.
+    deadline = None
+
+    #: The `pymongo.read_preferences` read preference of the request's
+    #: reads, or None to read with the client's DB_READ_PREFERENCE. Writes
+    #: always go to the primary, and resources read from it for them.
+    read_preference = None
+
+    #: The ms from which operations are logged as slow, from the app's
+    #: DB_SLOW_QUERY_MS, or None not to time them
+    slow_query_ms = None
+
+    #: Whether slow reads are explained, from the app's
+    #: DB_SLOW_QUERY_EXPLAIN. Explaining runs the query again.
+    explain_slow_queries = False
+
+    #: The `slowlog.SlowQueryLog` the slow operations are recorded in
+    slow_queries = slowlog.SLOW_QUERIES
+
     def __init__(self, **kwargs):
+        self.logger = kwargs.get('logger', logger)
+        self.slow_query_ms = kwargs.get('DB_SLOW_QUERY_MS', None)
+        self.explain_slow_queries = kwargs.get('DB_SLOW_QUERY_EXPLAIN', False)
         self.collection = kwargs.get('collection', '')
-        self.client = MongoClient(
-            kwargs.get('DB_HOST', 'localhost'),
-            kwargs.get('DB_PORT', 27017))
+        self.client = get_client(**kwargs)
         db_name = kwargs.get('DB_NAME', 'testing_slither')
         self.db = self.client[db_name]
+        self.serializer = get_serializer(kwargs.get('JSON_SERIALIZER', 'auto'))
+
+    @classmethod
+    def init_app(cls, app):
+        """Set up the pooled client for `app` ahead of the first request.
+           The client doesn't connect until it is used, so this is safe to
+           call before the server forks its workers."""
+        get_client(**app.config)
 
     def __exit__(self):
         self.db.close()
 
+    def _max_time_ms(self):
+        """Returns the `maxTimeMS` of the next query, or None without a
+           deadline. Raises `DeadlineExceeded` if the deadline has passed."""
+        if self.deadline is None:
+            return
+        return self.deadline.max_time_ms()
+
+    def _time_limit(self):
+        """Returns the `maxTimeMS` option of the next command"""
+        ms = self._max_time_ms()
+        return {} if ms is None else {'maxTimeMS': ms}
+
+    def _reads(self, collection):
+        """Returns `collection` to read from with the read preference"""
+        if self.read_preference is None:
+            return self.db[collection]
+        return self.db.get_collection(collection,
+                                      read_preference=self.read_preference)
+
+    def _watch(self, op, collection, query=None, projection=None,
+               explain=None):
+        """Returns the context manager timing the `op` run in its block,
+           which logs it if it's slow. Reads pass the callable that explains
+           them."""
+        if self.slow_query_ms is None:
+            return slowlog.NULL_WATCH
+        if not self.explain_slow_queries:
+            explain = None
+        return slowlog.Watch(self.slow_queries, self.slow_query_ms,
+                             self.logger, op, collection, query, projection,
+                             explain)
+
     def _clean_record(self, record):
         """Remove all fields with `None` values"""
         for k, v in dict(record).items():
@@ -49,80 +285,276 @@ class MongoDbQuery():
                 record.pop(k)
         return record
 
+    @timed('db.find_one')
     def get_instance(self, collection, obj_id, **kwargs):
         """Get a record from the database with the id field matching `obj_id`.
         """
-        logging.info("Getting single record")
+        self.logger.info("Getting single record")
+        args = self._instance_query(obj_id, **kwargs)
+        if args is None:
+            return {}
+        reads = self._reads(collection)
+        with self._watch('find_one', collection, *args,
+                         lambda: reads.find(*args).limit(1).explain()):
+            record = reads.find_one(*args, max_time_ms=self._max_time_ms())
+        return record
+
+    def _instance_query(self, obj_id, **kwargs):
+        """Returns the query and projection to find the record with `obj_id`,
+           or None if it isn't a valid id"""
         try:
             obj_id = ObjectId(obj_id)
         except InvalidId:
-            logging.error("Invalid ObjectId: {}".format(obj_id))
-            return {}
+            self.logger.error("Invalid ObjectId: %s", obj_id)
+            return
         projection = kwargs.get('projection', {})
         projection = None if len(projection) < 1 else projection
         query = kwargs.get('query', {})
         query.update({'_id': obj_id})
-        logging.debug("Query: {}".format(query))
-        logging.debug("Projection: {}".format(projection))
-        record = self.db[collection].find_one(query, projection)
-        return record
+        self.logger.debug("Query: %s", query)
+        self.logger.debug("Projection: %s", projection)
+        return query, projection
 
+    @timed('db.find')
     def get_collection(self, collection, **kwargs):
-        """Get a record from the database with the id field matching `obj_id`.
+        """Get the records from the database matching `query`. The records
+           can be ordered with `sort`, a list of (field, direction) tuples,
+           and paged with the `after` and `before` continuation tokens from
+           `encode_position`. Paging always walks the sort order forward, so
+           records before a token are returned in sort order too.
         """
+        cursor = self._find(collection, **kwargs)
+        if kwargs.get('stream', False):
+            self.logger.debug("Returning cursor for streaming")
+            return cursor
+        with self._watch('find', collection, kwargs.get('query', None),
+                         kwargs.get('projection', None),
+                         lambda: cursor.explain()):
+            records = list(cursor)
+        if kwargs.get('before', None) is not None:
+            records.reverse()
+        self.logger.debug("Got %s results", len(records))
+        return records
+
+    def _find(self, collection, **kwargs):
+        """Returns the cursor over the records `get_collection` asks for"""
         query = kwargs.get('query', {})
         projection = kwargs.get('projection', {})
         projection = None if len(projection) < 1 else projection
         limit = kwargs.get('limit', 0)  # no limit by default
-        # sort = kwargs.get('sort', {})
-        logging.info("About to get a collection from the database")
-        logging.debug("Collection: {}".format(collection))
-        logging.debug("Query: {}".format(query))
-        logging.debug("Projection: {}".format(projection))
-        logging.debug("Limit: {}".format(limit))
-        records = \
-            list(self.db[collection].find(query, projection).limit(limit))
-        logging.debug("Got {} results".format(len(records)))
-        return records
+        batch_size = kwargs.get('batch_size', 0)  # server default
+        sort = kwargs.get('sort', [])
+        after = kwargs.get('after', None)
+        before = kwargs.get('before', None)
+        self.logger.info("About to get a collection from the database")
+        self.logger.debug("Collection: %s", collection)
+        if after is not None:
+            query = self._keyset_query(
+                query, sort, decode_position(after, sort))
+        elif before is not None:
+            sort = [(f, -d) for f, d in sort]
+            query = self._keyset_query(
+                query, sort, decode_position(before, sort))
+        self.logger.debug("Query: %s", query)
+        self.logger.debug("Projection: %s", projection)
+        self.logger.debug("Sort: %s", sort)
+        self.logger.debug("Limit: %s", limit)
+        cursor = self._reads(collection).find(
+            query, projection, max_time_ms=self._max_time_ms()).limit(limit)
+        if len(sort) > 0:
+            cursor = cursor.sort(sort)
+        if batch_size > 0:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def _keyset_query(self, query, sort, values):
+        """Extend `query` to match only the records that come after `values`
+           in the `sort` order. Each sort field adds one branch to the `$or`,
+           which the index on the sort fields answers with a range scan."""
+        branches = []
+        for i, (field, direction) in enumerate(sort):
+            branch = {f: values[j] for j, (f, d) in enumerate(sort[:i])}
+            branch[field] = {'$gt' if direction > 0 else '$lt': values[i]}
+            branches.append(branch)
+        keyset = {'$or': branches}
+        return keyset if len(query) < 1 else {'$and': [query, keyset]}
+
+    @timed('db.find')
+    def get_instances(self, collection, obj_ids, **kwargs):
+        """Get the records with an id in `obj_ids` with a single query. The
+           records are returned keyed on their id as a string, and invalid
+           ids are skipped."""
+        self.logger.info("Getting %s records", len(obj_ids))
+        args = self._instances_query(obj_ids, **kwargs)
+        if args is None:
+            return {}
+        cursor = self._reads(collection).find(
+            *args, max_time_ms=self._max_time_ms())
+        with self._watch('find', collection, *args,
+                         lambda: cursor.explain()):
+            return {str(r['_id']): r for r in cursor}
 
+    def _instances_query(self, obj_ids, **kwargs):
+        """Returns the query and projection to find the records with an id in
+           `obj_ids`, or None if none of them are valid"""
+        ids = []
+        for obj_id in obj_ids:
+            try:
+                ids.append(ObjectId(obj_id))
+            except (InvalidId, TypeError):
+                self.logger.error("Invalid ObjectId: %s", obj_id)
+        if len(ids) < 1:
+            return
+        projection = kwargs.get('projection', {})
+        projection = None if len(projection) < 1 else projection
+        query = dict(kwargs.get('query', {}))
+        query['_id'] = {'$in': ids}
+        self.logger.debug("Query: %s", query)
+        return query, projection
+
+    @timed('db.count')
+    def count(self, collection, query, estimated=False):
+        """Count the records matching `query`. An estimated count is read
+           from the collection metadata, so it ignores the query and may be
+           off after an unclean shutdown, but doesn't scan anything."""
+        self.logger.info("Counting records, estimated: %s", estimated)
+        self.logger.debug("Query: %s", query)
+        reads = self._reads(collection)
+        if estimated:
+            with self._watch('estimated_count', collection):
+                return reads.estimated_document_count(**self._time_limit())
+        with self._watch('count', collection, query, None,
+                         lambda: reads.find(query).explain()):
+            return reads.count_documents(query, **self._time_limit())
+
+    def _bulk_errors(self, count, ordered, error=None):
+        """Returns the write error of each of the `count` operations of a
+           bulk write, or None for the operations that succeeded. Ordered
+           writes stop at the first error, so later operations are marked
+           as not written."""
+        results = [None] * count
+        if error is None:
+            return results
+        failed = {e['index']: e for e in error.details.get('writeErrors', [])}
+        for i in range(count):
+            if i in failed:
+                results[i] = {'code': failed[i].get('code', None),
+                              'message': failed[i].get('errmsg', '')}
+            elif ordered and len(failed) > 0 and i > min(failed):
+                results[i] = {'code': None,
+                              'message': "Not written after an earlier error"}
+        return results
+
+    @timed('db.bulk_write')
+    def _bulk_write(self, collection, operations, ordered=True):
+        self.logger.debug("Bulk writing %s operations, ordered: %s",
+                          len(operations), ordered)
+        if len(operations) < 1:
+            return []
+        # writes don't take a maxTimeMS, so they aren't started late
+        self._max_time_ms()
+        try:
+            with self._watch('bulk_write', collection):
+                self.db[collection].bulk_write(operations, ordered=ordered)
+        except BulkWriteError as e:
+            self.logger.warning("Bulk write errors: %s",
+                                e.details.get('writeErrors', []))
+            return self._bulk_errors(len(operations), ordered, e)
+        return self._bulk_errors(len(operations), ordered)
+
+    def create_many(self, collection, records, ordered=True):
+        """Insert `records` in one round trip. Each record gets its new
+           `_id`, and the write error of each record is returned."""
+        self.logger.info("Creating %s records", len(records))
+        operations = [InsertOne(self._clean_record(r)) for r in records]
+        return self._bulk_write(collection, operations, ordered)
+
+    def update_many(self, collection, records, ordered=True):
+        """Update the fields of each of `records` on its `_id` in one round
+           trip, and return the write error of each record."""
+        self.logger.info("Updating %s records", len(records))
+        operations = [
+            UpdateOne({'_id': r['_id']},
+                      {'$set': {k: v for k, v in r.items() if k != '_id'}})
+            for r in records]
+        return self._bulk_write(collection, operations, ordered)
+
+    def delete_many(self, collection, records, ordered=True):
+        """Delete `records` in one round trip, and return the write error of
+           each record."""
+        self.logger.info("Deleting %s records", len(records))
+        operations = [DeleteOne({'_id': r['_id']}) for r in records]
+        return self._bulk_write(collection, operations, ordered)
+
+    @timed('db.delete')
     def delete(self, collection, record):
         if record is not None and '_id' in record:
-            logging.info("Deleting record: {}".format(record['_id']))
-            self.db[collection].remove({'_id': record['_id']})
+            self.logger.info("Deleting record: %s", record['_id'])
+            self._max_time_ms()
+            with self._watch('delete', collection, {'_id': record['_id']}):
+                self.db[collection].delete_one({'_id': record['_id']})
 
+    @timed('db.insert')
     def create(self, collection, record):
-        logging.info("Creating new record")
-        return self.db[collection].insert(self._clean_record(record))
+        self.logger.info("Creating new record")
+        self._max_time_ms()
+        with self._watch('insert', collection):
+            return self.db[collection].insert_one(
+                self._clean_record(record)).inserted_id
 
+    @timed('db.update')
     def update(self, collection, record, orig_record, full_update=False):
-        logging.info("Updating record.")
-        logging.debug("Full update? {}".format(full_update))
+        """Update the record with the `_id` of `orig_record` and return the
+           updated record from the same round trip. A full update replaces
+           the record, otherwise only the fields in `record` are set."""
+        self.logger.info("Updating record.")
+        self.logger.debug("Full update? %s", full_update)
         if '_id' not in record:
-            logging.warning("No id in record. Cannot update")
-            logging.debug("Record: {}".format(record))
+            self.logger.warning("No id in record. Cannot update")
+            self.logger.debug("Record: %s", record)
             return
         if len(record) < 1:
-            logging.warning("Not updating empty record")
+            self.logger.warning("Not updating empty record")
             return
-        query = self._clean_record(record) if full_update else {'$set': record}
         record.pop('_id', '')
         _id = orig_record['_id']
-        logging.debug("_id: {}".format(_id))
-        logging.debug("Query: {}".format(query))
-        self.db[collection].update({'_id': _id}, query)
-        record['_id'] = _id
-        return record
+        self.logger.debug("_id: %s", _id)
+        if full_update:
+            query = self._clean_record(record)
+            self.logger.debug("Query: %s", query)
+            with self._watch('replace', collection, {'_id': _id}):
+                return self.db[collection].find_one_and_replace(
+                    {'_id': _id}, query, return_document=ReturnDocument.AFTER,
+                    **self._time_limit())
+        query = {'$set': record}
+        self.logger.debug("Query: %s", query)
+        with self._watch('update', collection, {'_id': _id}):
+            return self.db[collection].find_one_and_update(
+                {'_id': _id}, query, return_document=ReturnDocument.AFTER,
+                **self._time_limit())
 
-    def serialize(self, root, records):
-        """Serialize the payload into JSON"""
-        logging.info("Serializing record")
-        logging.debug("Root: {}".format(root))
-        logging.debug("Records: {}".format(records))
+    def serialize(self, root, records, **members):
+        """Serialize the payload into JSON. Any `members` that aren't None,
+           such as `links`, are added next to the root."""
+        self.logger.info("Serializing record")
+        self.logger.debug("Root: %s", root)
+        self.logger.debug("Records: %s", records)
         if records == {}:
             return '{}'
+        return self.serializer.dumps(self._envelope(root, records, members))
+
+    def pack(self, root, records, **members):
+        """Serialize the payload into MessagePack, in the same shape as
+           `serialize`"""
+        self.logger.info("Packing record")
+        return formats.pack(self._envelope(root, records, members))
+
+    def _envelope(self, root, records, members):
+        if records == {}:
+            return records
         if isinstance(records, dict):
             if list(records.keys())[0] == 'errors':
-                logging.warning("Found errors. Moving on".format(records))
+                self.logger.warning("Found errors. Moving on")
                 root = None
             elif '_id' in records:
                 records['id'] = records.pop('_id')
@@ -136,4 +568,47 @@ class MongoDbQuery():
 
         if root is not None:
             records = {root: records}
-        return json.dumps(records, cls=JSONEncoder)
+            records.update(
+                (k, v) for k, v in members.items() if v is not None)
+        return records
+
+    def serialize_stream(self, root, records, chunk_size=65536):
+        """Serialize an iterable of records into JSON chunks as the records
+           are read, so only the current record is held in memory. The joined
+           output is the same as that of `serialize` for a list of records."""
+        self.logger.info("Streaming serialized records")
+        dumps = self.serializer.dumps
+        chunk = ['[' if root is None else '{{{}:['.format(dumps(root))]
+        size = 0
+        for i, r in enumerate(records):
+            if '_id' in r:
+                r['id'] = r.pop('_id')
+            s = dumps(r)
+            chunk.append(s if i == 0 else ',' + s)
+            size += len(s)
+            if size >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        chunk.append(']' if root is None else ']}')
+        yield ''.join(chunk)
+
+    def serialize_lines(self, records, chunk_size=65536):
+        """Serialize an iterable of records into NDJSON chunks of whole
+           lines as the records are read"""
+        self.logger.info("Streaming serialized lines")
+        dumps = self.serializer.dumps
+        chunk = []
+        size = 0
+        for r in records:
+            if '_id' in r:
+                r['id'] = r.pop('_id')
+            s = dumps(r)
+            chunk.append(s + '\n')
+            size += len(s)
+            if size >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if len(chunk) > 0:
+            yield ''.join(chunk)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, \
+    NetworkTimeout
+
+import math
+import time
+
+
+class DeadlineExceeded(Exception):
+    """The time budget of the request was spent"""
+
+
+#: The errors of a request that ran out of time, or of a database that
+#: couldn't be reached in time
+TIMEOUTS = (DeadlineExceeded, ExecutionTimeout, ConnectionFailure)
+
+
+class Deadline():
+    """A budget of `seconds` for answering a request, starting now"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def check(self):
+        """Raises `DeadlineExceeded` if the budget is spent"""
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(
+                "Request took longer than {}s".format(self.seconds))
+
+    def max_time_ms(self):
+        """Returns the milliseconds left, for a query's `maxTimeMS`, or None
+           for a budget that isn't finite. Raises `DeadlineExceeded` if there
+           are none left."""
+        self.check()
+        remaining = self.remaining()
+        if not math.isfinite(remaining):
+            return
+        # maxTimeMS 0 means no limit, so there's always at least 1ms
+        return max(1, int(remaining * 1000))
+
+
+def status_of(error):
+    """Returns the response status and error code of one of the `TIMEOUTS`.
+       Running out of time is a 504, while a database that can't be reached
+       is a 503 as it is likely to be temporary."""
+    if isinstance(error, (DeadlineExceeded, ExecutionTimeout,
+                          NetworkTimeout)):
+        return 504, 'deadline_exceeded'
+    return 503, 'database_unavailable'
@@ -1,58 +1,63 @@
 # -*- coding: utf-8 -*-
-from flask import make_response, request, current_app, Response, g, json
+from flask import make_response, request, Response, g, json
+from flask_slither import formats
+from flask_slither.deadlines import TIMEOUTS
 from functools import wraps
-from urllib.parse import urlparse
 
 
 def crossdomain(f):
     """This decorator sets the rules for the crossdomain request per http
        method. The settings are taken from the actual resource itself, and
-       returned as per the CORS spec.
+       returned as per the CORS spec. The resource's `cors_config` is
+       compiled into the `cors.CorsPolicy` of its metadata once, when it is
+       registered.
 
        All CORS requests are rejected if the resource's `allow_methods`
        doesn't include the 'OPTIONS' method. """
     @wraps(f)
     def decorator(self, *args, **kwargs):
-        # TODO: if a non-cors request has the origin header, this will fail
-        if not self.cors_enabled and 'origin' in request.headers:
-            return self._make_response(405, "CORS request rejected")
-        resp = f(self, *args, **kwargs)
-
-        h = resp.headers
-        current_app.logger.debug("Request Headers: {}".format(request.headers))
-        allowed_methods = self.cors_config['methods'] + ["OPTIONS"]
-        h['Access-Control-Allow-Methods'] = ", ".join(allowed_methods)
-        h['Access-Control-Max-Age'] = self.cors_config.get('max_age', 21600)
-
-        # Request Origin checks
-        hostname = urlparse(request.headers['origin']).netloc \
-            if 'origin' in request.headers else request.headers['host']
-        if hostname in self.cors_config.get('blacklist', []):
-            return self._make_response(405, "CORS request blacklisted")
-        if self.cors_config.get('allowed', None) is not None and \
-                hostname not in self.cors_config.get('allowed', None):
-            return self._make_response(405, "CORS request refused")
-        if 'origin' in request.headers:
-            h['Access-Control-Allow-Origin'] = request.headers['origin']
-
-        # Request header checks
-        if 'access-control-request-headers' in request.headers:
-            if self.cors_config.get('headers', None) is None:
-                allowed_headers = \
-                    request.headers.get('access-control-request-headers', "*")
+        with self.timings.phase('total'):
+            # TODO: if a non-cors request has the origin header, this will fail
+            if not self._meta.cors_enabled and 'origin' in request.headers:
+                resp = self._make_response(405, "CORS request rejected")
             else:
-                allowed_headers = []
-                for k in request.headers.get(
-                        'access-control-request-headers', []):
-                    if k in self.cors_config.get('headers', []):
-                        allowed_headers.append(k)
-                allowed_headers = " ,".join(allowed_headers)
-            h['Access-Control-Allow-Headers'] = allowed_headers
-
+                resp = f(self, *args, **kwargs)
+                with self.timings.phase('cors'):
+                    refused = self._meta.cors.apply(resp.headers,
+                                                    request.headers)
+                if refused is not None:
+                    resp = self._make_response(405, refused)
+        if self.server_timing:
+            resp.headers['Server-Timing'] = self.timings.header()
         return resp
     return decorator
 
 
+def is_authorized(self, record):
+    """Runs the `is_authorized` method of the authorization class, if
+       there is one, for `record`"""
+    a = self._auth_instance('authorization' if hasattr(
+        self, 'authorization') else 'authentication')
+    if a is None:
+        self.logger.debug("No authorization class")
+        return True
+
+    if not hasattr(a, 'is_authorized'):
+        self.logger.debug("No is_authorized method")
+        return True
+
+    version = None if self.version_field is None or record is None \
+        else record.get(self.version_field, None)
+    key = self._auth_key(
+        a, 'authorization', request.method,
+        None if record is None else record.get('_id', None), version)
+    error = self._auth_cached(key)
+    if error is None:
+        error = "" if a.is_authorized(record=record) else "Unauthorized"
+        self._auth_store(key, error)
+    return not error
+
+
 def endpoint(f):
     """This decorator marks this method as an endpoint. It is responsible for
        the request workflow and will call each relevant method in turn."""
@@ -61,127 +66,237 @@ def endpoint(f):
         """If the `authentication` variable is defined and not None, the
            specified method will be run. On True the request will continue
            otherwise it will fail with a 401 authentication error"""
-        if getattr(self, 'authentication', None) is None:
-            current_app.logger.debug("No authentication method")
+        a = self._auth_instance('authentication')
+        if a is None:
+            self.logger.debug("No authentication method")
             return
 
-        a = self.authentication()
         if not hasattr(a, 'is_authenticated'):
-            current_app.logger.debug("No is_authenticated method")
+            self.logger.debug("No is_authenticated method")
             return
 
-        if not a.is_authenticated(**kwargs):
-            msg = getattr(g, 'authentication_error', 'Authentication failed')
-            current_app.logger.warning("Authentication failed: {}".format(msg))
-            return self._make_response(401, msg, abort=True)
-        current_app.logger.debug("Authentication successful")
+        key = self._authentication_key(a, **kwargs)
+        error = self._auth_cached(key)
+        if error is None:
+            error = "" if a.is_authenticated(**kwargs) else \
+                getattr(g, 'authentication_error', 'Authentication failed')
+            self._auth_store(key, error)
+        if error:
+            self.logger.warning("Authentication failed: %s", error)
+            return self._make_response(401, error, abort=True)
+        self.logger.debug("Authentication successful")
 
     def check_authorization(self):
         """If the `authorization` variable is defined and not None, the
            specified method will be run. On True the request will continue
            otherwise it will fail with a 403 authorization error"""
-        current_app.logger.info("Checking authentication/authorization")
-        auth_class = getattr(self, 'authorization',
-                             getattr(self, 'authentication', None))
-        if auth_class is None:
-            current_app.logger.debug("No authorization class")
-            return
-
-        a = auth_class()
-        if not hasattr(a, 'is_authorized'):
-            current_app.logger.debug("No is_authorized method")
-            return
-
-        if not a.is_authorized(record=g._resource_instance):
-            current_app.logger.warning("Authorization failed")
+        self.logger.info("Checking authentication/authorization")
+        if not is_authorized(self, g._resource_instance):
+            self.logger.warning("Authorization failed")
             return self._make_response(403, "Authorization failed", abort=True)
-        current_app.logger.debug("Authorization successful")
+        self.logger.debug("Authorization successful")
 
-    def validate_request(self, **kwargs):
-        """Call the validator class and validate the request_data. This method
-           returns True or False. On False, a 400 will be returned with the
-           reasons for the validation error. On True, the operation will
-           continue."""
-        current_app.logger.info(
-            "Checking {} validation".format(request.method))
+    def validation_errors(self, **kwargs):
+        """Returns the errors found by the `validate_<method>` method of the
+           validation class, if there is one"""
         if getattr(self, 'validation', None) is None:
-            current_app.logger.warning("No validation specified")
+            self.logger.warning("No validation specified")
             return
 
         v = self.validation()
         method = 'validate_{}'.format(request.method.lower())
 
         if not hasattr(v, method):
-            current_app.logger.warning("No validation method specified")
+            self.logger.warning("No validation method specified")
             return
         errors = getattr(v, method)(**kwargs)
-        current_app.logger.debug("Validation errors: {}".format(errors))
+        self.logger.debug("Validation errors: %s", errors)
+        return errors
 
+    def validate_request(self, **kwargs):
+        """Call the validator class and validate the request_data. This method
+           returns True or False. On False, a 400 will be returned with the
+           reasons for the validation error. On True, the operation will
+           continue."""
+        self.logger.info("Checking %s validation", request.method)
+        errors = validation_errors(self, **kwargs)
         if errors is not None and len(errors) > 0:
-            current_app.logger.warning("Validation errors found")
+            self.logger.warning("Validation errors found")
             self._make_response(400, errors, abort=True)
 
+    def prepare_bulk(self):
+        """Runs authorization, the record transforms and validation for each
+           item of a bulk request. An item that fails gets its error status
+           in `g._bulk` rather than failing the whole request, and the items
+           that pass get the `record` to write. The original records for
+           PATCH and DELETE are loaded with one query."""
+        self.logger.info("Preparing bulk %s", request.method)
+        if request.method == 'DELETE':
+            items = [{'id': i.strip()}
+                     for i in request.args.get('_ids', '').split(',')
+                     if i.strip() != '']
+        else:
+            items = g._rq_data
+        if not isinstance(items, list):
+            return self._make_response(
+                400, "Bulk requests need a list of records", abort=True)
+        if len(items) > self.bulk_max_items:
+            return self._make_response(
+                413, "Bulk requests are limited to {} records".format(
+                    self.bulk_max_items), abort=True)
+
+        originals = {}
+        if request.method != 'POST':
+            ids = [self.fiddle_id(str(i.get('id', ''))) for i in items
+                   if isinstance(i, dict)]
+            originals = self.db_query.get_instances(self.db_collection, ids)
+        if request.method == 'DELETE':
+            validate_request(self)
+
+        g._bulk = []
+        for index, item in enumerate(items):
+            result = {'index': index}
+            g._bulk.append(result)
+            if not isinstance(item, dict):
+                result.update({'status': 400, 'errors': "Invalid record"})
+                continue
+
+            orig = {}
+            if request.method != 'POST':
+                obj_id = self.fiddle_id(str(item.get('id', '')))
+                if obj_id not in originals:
+                    result.update({'status': 404, 'errors': "No record"})
+                    continue
+                orig = originals[obj_id]
+                result['id'] = orig['_id']
+            g._resource_instance = orig
+            if not is_authorized(self, orig):
+                result.update({'status': 403,
+                               'errors': "Authorization failed"})
+                continue
+            if request.method == 'DELETE':
+                result['record'] = orig
+                continue
+
+            changes = {k: v for k, v in item.items() if k != 'id'} \
+                if request.method == 'PATCH' else item
+            r = self.transform_record(changes)
+            record = dict(self.merge_record_data(r, dict(orig)))
+            errors = validation_errors(self, data=record)
+            if errors is not None and len(errors) > 0:
+                result.update({'status': 400, 'errors': errors})
+                continue
+            result['record'] = record
+        g._resource_instance = {}
+        self.logger.debug("Bulk items: %s", g._bulk)
+
+    def check_deadline(self):
+        """Stop before the next step if the request is out of time"""
+        if self.deadline is not None:
+            self.deadline.check()
+
     def load_request_data(self):
         if request.method in ['GET', 'DELETE']:
             return
-        current_app.logger.info("Saving json payload in memory")
-        # For now we assume JSON. Later in life we can make this more
-        # payload agnostic
+        self.logger.info("Saving request payload in memory")
+        media_type = request.mimetype
+        if media_type not in formats.available(self.media_types):
+            media_type = formats.JSON
         try:
-            d = request.data.decode('utf-8')
-            g._rq_data = {} if d.strip() == "" else json.loads(d)
+            if media_type == formats.MSGPACK:
+                g._rq_data = {} if len(request.data) == 0 else \
+                    formats.unpack(request.data)
+            else:
+                d = request.data.decode('utf-8')
+                if d.strip() == "":
+                    g._rq_data = {}
+                elif media_type == formats.NDJSON:
+                    g._rq_data = formats.load_lines(d)
+                else:
+                    g._rq_data = json.loads(d)
         except ValueError:
-            return self._make_response(400, "Malformed JSON in request body",
-                                       abort=True)
+            msg = "Malformed {} in request body".format(
+                {formats.MSGPACK: 'MessagePack',
+                 formats.NDJSON: 'NDJSON'}.get(media_type, 'JSON'))
+            return self._make_response(400, msg, abort=True)
+        if media_type == formats.NDJSON and g._rq_data != {}:
+            # the lines are records without the root, and one line is a
+            # single record rather than a bulk request
+            g._rq_data = {self._payload_root(): g._rq_data[0]
+                          if len(g._rq_data) == 1 else g._rq_data}
 
         if self.enforce_json_root and g._rq_data != {} and \
-                list(g._rq_data.keys()) != [self._payload_root()]:
+                (not isinstance(g._rq_data, dict) or
+                 list(g._rq_data.keys()) != [self._payload_root()]):
             msg = "Invalid JSON root in request body"
-            current_app.logger.error(msg)
-            current_app.logger.debug(
-                "Found {}, expecting {}".format(
-                    list(g._rq_data.keys()), self._payload_root()))
+            self.logger.error(msg)
+            self.logger.debug("Found %s, expecting %s",
+                              g._rq_data, self._payload_root())
             return self._make_response(400, msg, abort=True)
-        elif self._payload_root() in list(g._rq_data.keys()):
-                current_app.logger.debug("Removing JSON root from rq payload")
+        elif isinstance(g._rq_data, dict) and \
+                self._payload_root() in list(g._rq_data.keys()):
+                self.logger.debug("Removing JSON root from rq payload")
                 g._rq_data = g._rq_data[self._payload_root()]
-        current_app.logger.debug("g._rq_data: {}".format(g._rq_data))
+        self.logger.debug("g._rq_data: %s", g._rq_data)
         return g._rq_data
 
-    @wraps(f)
-    def decorator(self, *args, **kwargs):
-        current_app.logger.info("Got {} request".format(request.method))
-        current_app.logger.info("Endpoint: {}".format(request.url))
-        if request.method not in self.allowed_methods:
+    def workflow(self, *args, **kwargs):
+        self.logger.info("Got %s request", request.method)
+        self.logger.info("Endpoint: %s", request.url)
+        if request.method not in self._meta.allowed_methods:
             msg = "Request method {} is unavailable".format(request.method)
-            current_app.logger.error(msg)
+            self.logger.error(msg)
             return self._make_response(405, msg, abort=True)
 
-        current_app.logger.info("Checking db table/collection is defined")
-        if self.enforce_payload_collection and self.db_collection is None:
+        self.logger.info("Checking db table/collection is defined")
+        if self._meta.missing_collection:
             msg = "No DB collection defined"
-            current_app.logger.error(msg)
+            self.logger.error(msg)
             return make_response(Response(msg, 424))
 
         if request.method in ['POST', 'PUT', 'PATCH']:
             load_request_data(self)
 
-        check_authentication(self, **kwargs)
+        with self.timings.phase('authentication'):
+            check_authentication(self, **kwargs)
+        check_deadline(self)
+        bulk = not kwargs.get('obj_id', False) and \
+            (request.method in ['PATCH', 'DELETE'] or
+             isinstance(getattr(g, '_rq_data', None), list))
+        if bulk:
+            if not self.allow_bulk:
+                return self._make_response(
+                    400, "Bulk requests are unavailable", abort=True)
+            with self.timings.phase('validation'):
+                prepare_bulk(self)
+            check_deadline(self)
+            return f(self, *args, **kwargs)
+
         if kwargs.get('obj_id', False):
             kwargs['obj_id'] = self.fiddle_id(kwargs['obj_id'])
-            self._get_instance(**kwargs)
+            with self.timings.phase('instance'):
+                self._get_instance(**kwargs)
         else:
             g._resource_instance = {}
 
-        if request.method in ['POST', 'PUT', 'PATCH']:
+        with self.timings.phase('authorization'):
             check_authorization(self)
-            r = self.transform_record(g._rq_data.get(self._payload_root(),
-                                                     g._rq_data))
-            g._saveable_record = dict(self.merge_record_data(
-                r, dict(getattr(g, '_resource_instance', r))))
-            validate_request(self, data=g._saveable_record)
-        else:
-            check_authorization(self)
-            validate_request(self)
+        with self.timings.phase('validation'):
+            if request.method in ['POST', 'PUT', 'PATCH']:
+                r = self.transform_record(
+                    g._rq_data.get(self._payload_root(), g._rq_data))
+                g._saveable_record = dict(self.merge_record_data(
+                    r, dict(getattr(g, '_resource_instance', r))))
+                validate_request(self, data=g._saveable_record)
+            else:
+                validate_request(self)
+        check_deadline(self)
         return f(self, *args, **kwargs)
+
+    @wraps(f)
+    def decorator(self, *args, **kwargs):
+        try:
+            return workflow(self, *args, **kwargs)
+        except TIMEOUTS as e:
+            return self._timed_out(e)
     return decorator
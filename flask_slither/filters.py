@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from flask_slither.cache import LRUCache
+from datetime import datetime
+from uuid import UUID
+
+import re
+
+#: Matches `filter[field]` and `filter[field][op]` query parameters
+FILTER_ARG = re.compile(r'^filter\[([^\[\]]+)\](?:\[([a-z]+)\])?$')
+
+#: The filter operators and the mongo operators they compile to
+OPERATORS = {
+    'eq': '$eq',
+    'ne': '$ne',
+    'in': '$in',
+    'gt': '$gt',
+    'lt': '$lt',
+    'exists': '$exists',
+    'prefix': '$regex',
+}
+
+
+def _to_bool(value):
+    if value.lower() in ['true', '1', 'yes']:
+        return True
+    if value.lower() in ['false', '0', 'no']:
+        return False
+    raise ValueError("{} is not a boolean".format(value))
+
+
+def _to_datetime(value):
+    # the serializers render datetimes as timestamps
+    try:
+        return datetime.fromtimestamp(int(value))
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+#: Converts a query string value into each filterable type
+COERCIONS = {
+    str: str,
+    int: int,
+    float: float,
+    bool: _to_bool,
+    ObjectId: ObjectId,
+    datetime: _to_datetime,
+    UUID: UUID,
+}
+
+
+class Filters():
+    """The query string filters of a resource, compiled from its
+       `filterable_fields`. Parsed filters are memoized per query string in
+       an LRU cache of `memo_size` entries."""
+
+    def __init__(self, fields, memo_size=1024):
+        self.fields = dict(fields)
+        self._memo = LRUCache(max_size=memo_size)
+
+    def _coerce(self, field, value):
+        to_type = self.fields[field]
+        try:
+            return COERCIONS.get(to_type, to_type)(value)
+        except (InvalidId, TypeError, ValueError, OverflowError, OSError):
+            # timestamps out of the platform's range raise the last two
+            raise ValueError("Invalid value for {}: {}".format(field, value))
+
+    def _condition(self, field, op, value):
+        if op == 'in':
+            return [self._coerce(field, v) for v in value.split(',')]
+        if op == 'exists':
+            return _to_bool(value)
+        if op == 'prefix':
+            if self.fields[field] is not str:
+                raise ValueError("Cannot filter {} on a prefix".format(field))
+            # an anchored, case sensitive prefix can use the index
+            return '^' + re.escape(value)
+        return self._coerce(field, value)
+
+    def parse(self, args):
+        """Returns the mongo query of the `filter[field][op]=value` items of
+           the request `args`, or an empty query if there are none. Raises a
+           ValueError for unknown fields, operators or bad values."""
+        items = tuple(sorted((k, v) for k, v in args.items(multi=True)
+                             if k.startswith('filter[')))
+        if len(items) < 1:
+            return {}
+        query = self._memo.get(items)
+        if query is None:
+            query = self._parse(items)
+            self._memo.set(items, query)
+        # the cached query is never handed out, so it can't be changed
+        return {k: dict(v) if isinstance(v, dict) else v
+                for k, v in query.items()}
+
+    def _parse(self, items):
+        conditions = {}
+        for arg, value in items:
+            m = FILTER_ARG.match(arg)
+            if m is None:
+                raise ValueError("Malformed filter {}".format(arg))
+            field, op = m.group(1), m.group(2) or 'eq'
+            if field not in self.fields:
+                raise ValueError("Cannot filter on {}".format(field))
+            if op not in OPERATORS:
+                raise ValueError("Unknown filter operator {}".format(op))
+            conditions.setdefault(field, {})[OPERATORS[op]] = \
+                self._condition(field, op, value)
+
+        # plain equality is the usual form of an indexed match
+        return {f: c['$eq'] if list(c.keys()) == ['$eq'] else c
+                for f, c in conditions.items()}
+
+
+def merge(limits, filters):
+    """Combine the `access_limits` query with the client's `filters` so the
+       filters can only narrow the records the resource gives access to"""
+    if len(filters) < 1:
+        return limits
+    if len(limits) < 1:
+        return filters
+    return {'$and': [limits, filters]}
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""The media types of payloads besides JSON:
+
+ * NDJSON (`application/x-ndjson`) holds a record per line, without the
+   root envelope, so collections can be written and read a record at a
+   time.
+ * MessagePack (`application/msgpack`) has the same shape as the JSON
+   payload in a compact binary encoding. ObjectIds and UUIDs are extension
+   types holding their bytes, and datetimes are MessagePack timestamps.
+   It needs the msgpack package.
+"""
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from flask import json
+from uuid import UUID
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/msgpack'
+
+#: The MessagePack extension type codes of the mongo types
+OBJECT_ID_EXT = 1
+UUID_EXT = 2
+
+
+def available(media_types):
+    """Returns those of `media_types` that can be used"""
+    return [m for m in media_types if m != MSGPACK or msgpack is not None]
+
+
+def _pack_default(obj):
+    if isinstance(obj, ObjectId):
+        return msgpack.ExtType(OBJECT_ID_EXT, obj.binary)
+    if isinstance(obj, UUID):
+        return msgpack.ExtType(UUID_EXT, obj.bytes)
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            # mongo's datetimes are naive UTC
+            obj = obj.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(obj)
+    raise TypeError("{!r} is not MessagePack serializable".format(obj))
+
+
+def _ext_hook(code, data):
+    if code == OBJECT_ID_EXT:
+        return ObjectId(data)
+    if code == UUID_EXT:
+        return UUID(bytes=data)
+    return msgpack.ExtType(code, data)
+
+
+def pack(obj):
+    return msgpack.packb(obj, default=_pack_default, use_bin_type=True)
+
+
+def unpack(data):
+    """Returns the object in the MessagePack bytes `data`. Raises a
+       ValueError if they're malformed."""
+    try:
+        return msgpack.unpackb(data, ext_hook=_ext_hook, timestamp=3,
+                               raw=False)
+    except (msgpack.UnpackException, TypeError, ValueError) as e:
+        raise ValueError(str(e))
+
+
+def load_lines(data):
+    """Returns the list of records in the NDJSON string `data`"""
+    return [json.loads(line) for line in data.splitlines()
+            if line.strip() != ""]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from flask_slither.cors import CorsPolicy
+
+import inflect
+
+# building an engine is slow, so one is shared by all registrations
+_inflect = inflect.engine()
+
+
+class ResourceMeta(namedtuple('ResourceMeta', [
+        'name', 'plural', 'url', 'endpoint', 'payload_root',
+        'allowed_methods', 'missing_collection', 'cors_enabled', 'cors'])):
+    """The settings of a resource class that don't change between requests,
+       worked out once when it is registered:
+
+        * `name`, `plural`, `url` and `endpoint` name the resource's routes
+        * `payload_root` is the JSON root of its payloads
+        * `allowed_methods` is a frozenset of the `allowed_methods`
+        * `missing_collection` is True when `enforce_payload_collection` is
+          on but there is no `db_collection`
+        * `cors_enabled` and the compiled `cors.CorsPolicy`
+
+       Changing the class settings after registration has no effect."""
+    __slots__ = ()
+
+
+def build_meta(view, url=None, endpoint=None):
+    """Returns the `ResourceMeta` of the resource class `view`"""
+    name = view.__name__.lower()[:-8]
+    plural = _inflect.plural(name)
+    payload_root = getattr(view, 'json_root', view.db_collection)
+    return ResourceMeta(
+        name=name,
+        plural=plural,
+        url='/{}'.format((plural if url is None else url).strip('/')),
+        endpoint="{}_api".format(name) if endpoint is None else endpoint,
+        payload_root=payload_root,
+        allowed_methods=frozenset(view.allowed_methods),
+        missing_collection=bool(view.enforce_payload_collection and
+                                view.db_collection is None),
+        cors_enabled=bool(view.cors_enabled),
+        cors=CorsPolicy(view.cors_config))
+
+
+def get_meta(view):
+    """Returns the metadata the resource class `view` was registered with,
+       building it if the class wasn't registered itself"""
+    meta = view.__dict__.get('_resource_meta', None)
+    if meta is None:
+        meta = view._resource_meta = build_meta(view)
+    return meta
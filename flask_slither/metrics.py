@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+import socket
+import threading
+import time
+
+
+class _Phase():
+    """Times one phase of a request as a context manager"""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(
+            self.name, (time.perf_counter() - self.start) * 1000)
+
+
+class _NullPhase():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Timings():
+    """Collects the time spent in each phase of a request, in milliseconds.
+       Every phase is passed on to the `sink` as it ends, if there is one,
+       along with the `tags`."""
+
+    enabled = True
+
+    def __init__(self, sink=None, tags=None):
+        self.sink = sink
+        self.tags = tags or {}
+        self.phases = []
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record(self, name, ms):
+        self.phases.append((name, ms))
+        if self.sink is not None:
+            self.sink.timing(name, ms, self.tags)
+
+    def header(self):
+        """The phases as a `Server-Timing` header value. Repeated phases,
+           such as several db queries, are added up."""
+        totals = OrderedDict()
+        for name, ms in self.phases:
+            totals[name] = totals.get(name, 0) + ms
+        return ", ".join("{};dur={:.2f}".format(name, ms)
+                         for name, ms in totals.items())
+
+
+class NullTimings():
+    """Stands in for `Timings` when instrumentation is switched off, so the
+       only overhead is a call to a shared no-op context manager."""
+
+    enabled = False
+    phases = []
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def record(self, name, ms):
+        pass
+
+    def header(self):
+        return ""
+
+
+NULL_TIMINGS = NullTimings()
+
+
+class MetricsSink():
+    """Receives the timing of each request phase"""
+
+    def timing(self, name, ms, tags):
+        raise NotImplementedError
+
+
+class StatsdSink(MetricsSink):
+    """Sends the timings to a StatsD server over UDP as
+       `<prefix>.<resource>.<phase>:<ms>|ms`. Packets are fire and forget,
+       so a missing server never slows down or fails a request."""
+
+    def __init__(self, host='localhost', port=8125, prefix='slither'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def timing(self, name, ms, tags):
+        metric = "{}.{}.{}:{:.3f}|ms".format(
+            self.prefix, tags.get('resource', 'unknown'), name, ms)
+        try:
+            self.socket.sendto(metric.encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+
+class PrometheusSink(MetricsSink):
+    """Keeps a histogram of the phase timings in process, labelled with the
+       phase and tags. `expose` renders them in the Prometheus text format
+       to be returned by a scrape endpoint."""
+
+    #: The upper bounds of the histogram buckets, in seconds
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+               10)
+
+    def __init__(self, name='slither_request_phase_seconds'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def timing(self, name, ms, tags):
+        labels = tuple(sorted(tags.items())) + (('phase', name),)
+        seconds = ms / 1000
+        with self._lock:
+            histogram = self._histograms.get(labels, None)
+            if histogram is None:
+                histogram = self._histograms[labels] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def expose(self):
+        lines = ["# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for labels, histogram in histograms:
+                label = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        self.name, label, bound, count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                    self.name, label, histogram['count']))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    self.name, label, histogram['sum']))
+                lines.append('{}_count{{{}}} {}'.format(
+                    self.name, label, histogram['count']))
+        return "\n".join(lines) + "\n"
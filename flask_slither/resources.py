@@ -1,13 +1,41 @@
 # -*- coding: utf-8 -*-
-from flask import make_response, request, g, current_app, json, abort
+from flask import request, g, current_app, json, Response
 from flask.views import MethodView
-from flask_slither.decorators import endpoint, crossdomain
-from flask_slither.db import MongoDbQuery
+from flask_slither import deadlines, formats
+from flask_slither.decorators import endpoint, crossdomain, is_authorized
+from flask_slither.cache import LRUCache
+from flask_slither.compression import available_encodings, compress, \
+    compress_stream
+from flask_slither.db import MongoDbQuery, encode_position
+from flask_slither.deadlines import Deadline
+from flask_slither.filters import Filters, merge
+from flask_slither.meta import get_meta
+from collections import OrderedDict
+from flask_slither.metrics import Timings, NULL_TIMINGS
+from datetime import datetime
+from pymongo.read_preferences import ReadPreference
+from urllib.parse import urlencode
+from werkzeug.exceptions import abort
+from werkzeug.http import generate_etag, http_date, parse_date
 
+import hashlib
+import math
 import time
 
+#: The cookie holding the end of a client's `read_your_writes` window
+PRIMARY_COOKIE = 'slither_primary'
 
-class BaseResource(MethodView):
+
+def _principal_namespace(principal):
+    # tokens shouldn't end up in plain text in the cache keys
+    digest = hashlib.sha1(str(principal).encode('utf-8')).hexdigest()
+    return "auth:{}".format(digest)
+
+
+class Resource():
+    """The settings and workflow shared by `BaseResource` and
+       `aio.AsyncBaseResource`. Its helpers are given the request they
+       answer as `req`, so they work with Flask and Quart requests alike."""
 
     #: A list of HTTP methods that are open for use. Any method not on this
     #: list will return a 405 if accessed."""
@@ -39,11 +67,194 @@ class BaseResource(MethodView):
     #: successful.
     authentication = None
 
+    #: A cache for the results of `is_authenticated` and `is_authorized`, such
+    #: as `cache.LRUCache(max_size=10000)`. Results are only cached when the
+    #: auth class has a `cache_key(**kwargs)` method returning the request's
+    #: token or principal, and are dropped with `revoke_credentials`. Cached
+    #: requests skip the auth methods, so `is_authenticated` results are
+    #: only cached when the auth class also sets `side_effect_free = True`,
+    #: declaring that it doesn't set anything on `g` the request relies on.
+    auth_cache = None
+
+    #: Seconds that successful authentication/authorization results are
+    #: cached for
+    auth_cache_ttl = 60
+
+    #: Seconds that failures are cached for, so repeated requests with a bad
+    #: token don't reach the database either
+    auth_negative_ttl = 5
+
     #: If a validation class is defined, the `validate_<type>` method will be
     #: used to validate the type of request (e.g. GET, POST etc). Validation
     #: is assumed to pass if no method is defined.
     validation = None
 
+    #: Stream collection GETs to the client as records are read from the
+    #: database cursor, rather than loading the whole result set into memory
+    #: first. `transform_payload` then receives the cursor instead of a list.
+    stream_collections = False
+
+    #: The number of records fetched per database round trip when streaming
+    cursor_batch_size = 1000
+
+    #: The fields collections can be sorted on with `_sort`. Pages are found
+    #: by seeking on the sort fields, so each of these should be indexed.
+    sortable_fields = ['_id']
+
+    #: The fields collections can be filtered on with
+    #: `filter[field][op]=value`, mapped to the type the value is converted
+    #: to, e.g. `{'name': str, 'owner': ObjectId, 'created': datetime}`.
+    #: The operators are eq, ne, in, gt, lt, exists and prefix. Filters
+    #: should only be allowed on indexed fields.
+    filterable_fields = {}
+
+    #: The related records that can be embedded with the `include` query
+    #: parameter, by relationship name, e.g.
+    #:
+    #:     relationships = {'owner': {'resource': UserResource,
+    #:                                'projection': {'name': True}}}
+    #:
+    #: A relationship's `field` holds an ObjectId or a list of them, and
+    #: defaults to its name. The related records are only included if the
+    #: client could GET them from the relationship's `resource`: its
+    #: `access_limits` and `limit_fields` narrow the query, and each record
+    #: has to pass its authorization. A relationship can name a `collection`
+    #: instead, in which case nothing but the relationship's own `query`
+    #: limits which records are included. `query` and `projection` further
+    #: limit what the related records expose, and `relationships` declares
+    #: the relationships of the related records for nested includes like
+    #: `include=owner.company`.
+    relationships = {}
+
+    #: The maximum number of ids loaded per query of a relationship. All the
+    #: ids of a relationship across the page are loaded with one `$in`
+    #: query per batch.
+    include_batch_size = 1000
+
+    #: How deep includes can be nested, e.g. 2 for `include=owner.company`
+    include_max_depth = 2
+
+    #: Add the number of records matching the request, before paging, to
+    #: collection GETs as `meta.total` and an `X-Total-Count` header.
+    #: 'exact' counts the matching records, while 'fast' reads the
+    #: collection's estimated size from its metadata when no records are
+    #: filtered out. None doesn't count.
+    count_mode = None
+
+    #: Counts are cached per collection and query for `count_ttl` seconds,
+    #: and dropped when a record is saved or deleted through a resource. The
+    #: default cache is shared by all resources in the process.
+    count_cache = LRUCache(max_size=1024)
+    count_ttl = 10
+
+    #: The default number of records in a page of a collection GET. When None
+    #: the whole collection is returned unless `_limit` is in the request.
+    page_size = None
+
+    #: A field that changes whenever a record is saved, such as a version
+    #: number or an update timestamp. When set, the instance ETag is derived
+    #: from it so conditional GETs are answered before the record is fetched
+    #: and serialized. Datetime versions are also sent as Last-Modified.
+    version_field = None
+
+    #: Allow bulk requests: POST a list of records under the JSON root,
+    #: PATCH a list of records that each have an `id`, or DELETE the records
+    #: in the comma separated `_ids` query parameter. Each item is authorized,
+    #: transformed and validated on its own and the status of every item is
+    #: returned, while the writes are done in one round trip.
+    allow_bulk = False
+
+    #: The maximum number of records in a bulk request
+    bulk_max_items = 1000
+
+    #: Stop writing a bulk request at the first write error. Requests can
+    #: override this with the `_ordered` query parameter.
+    bulk_ordered = True
+
+    #: Honour the `Prefer: return=minimal` and `Prefer: return=representation`
+    #: request headers on writes. By default POST returns the new record and
+    #: PUT and PATCH return an empty 204. Either way the record in the
+    #: response comes from the write itself rather than a second query.
+    allow_prefer = True
+
+    #: A cache for serialized GET responses, such as `cache.LRUCache()` or a
+    #: `cache.RedisCache`. Responses are keyed on the `access_limits` query,
+    #: projection, limit and sort, and all responses of the collection are
+    #: dropped when a record is saved or deleted through a resource.
+    cache = None
+
+    #: Seconds that cached responses are served for. When None the cache's
+    #: default is used.
+    cache_ttl = 30
+
+    #: Coalesces identical GETs, such as `cache.SingleFlight()`. A GET that
+    #: arrives while an identical one is being answered waits for it and
+    #: shares its query and serialized payload, rather than running its own.
+    #: GETs are identical when they have the same url, host, `access_limits`
+    #: query and projection. The waiting happens in the request's thread.
+    single_flight = None
+
+    #: The media types that GET responses are negotiated into with the
+    #: `Accept` header, and that request bodies can be sent in, the first
+    #: being the default. NDJSON collections are streamed from the cursor a
+    #: record per line, without links or included records, and NDJSON
+    #: request bodies hold a record per line without the JSON root.
+    #: MessagePack needs the msgpack package.
+    media_types = [formats.JSON, formats.NDJSON, formats.MSGPACK]
+
+    #: Seconds a request has to be answered in, or None for no limit. The
+    #: budget covers the whole endpoint workflow, from authentication to the
+    #: hooks run before the response. Queries are given the time left as
+    #: their `maxTimeMS`, and a request that runs out of time fails with a
+    #: 504. Clients can ask for a shorter budget with the
+    #: `X-Request-Timeout` header, in seconds.
+    timeout = None
+
+    #: The read preference of GETs, from `pymongo.read_preferences`, e.g.
+    #: `SecondaryPreferred(max_staleness=90)`. It can also be a dict with a
+    #: preference for 'instance' and 'collection' GETs. Writes, and the
+    #: reads they make, always go to the primary. When None the client's
+    #: DB_READ_PREFERENCE is used.
+    read_preference = None
+
+    #: Seconds after a client's own write that its GETs read from the
+    #: primary, so they see the write whatever the `read_preference` or
+    #: DB_READ_PREFERENCE. The window is kept in the `slither_primary`
+    #: cookie. None turns it off.
+    read_your_writes = None
+
+    #: Compress responses with the best coding in the request's
+    #: `Accept-Encoding` out of brotli (when installed), gzip and deflate.
+    #: Set to False to never compress this resource's responses.
+    compression = True
+
+    #: Responses smaller than this many bytes aren't worth compressing.
+    #: Streamed responses are always compressed as their size isn't known.
+    compression_min_size = 1024
+
+    #: Compression levels by coding, overriding `compression.LEVELS`
+    compression_levels = {}
+
+    #: A `metrics.MetricsSink`, such as `StatsdSink` or `PrometheusSink`, that
+    #: gets the time spent in each phase of every request: authentication,
+    #: loading the instance, authorization, validation, each db query,
+    #: serialization, CORS and the total.
+    metrics_sink = None
+
+    #: Add the phase timings to responses in a `Server-Timing` header
+    server_timing = False
+
+    #: Runs the `post_save` and `post_delete` hooks, e.g. a
+    #: `tasks.ThreadPoolRunner` or `tasks.PersistentQueueRunner` to run them
+    #: in the background after the response. When None the hooks run before
+    #: the response, which hooks that must finish first depend on.
+    hook_runner = None
+
+    #: Log this resource at its own level, e.g. `logging.DEBUG` to trace one
+    #: endpoint without the overhead of debug logging everywhere. The resource
+    #: then logs to a child of the app logger named after the resource class.
+    log_level = None
+
     #: Allow CORS requests, and if True, put in extra parameters
     cors_enabled = False
     cors_config = {
@@ -54,16 +265,83 @@ class BaseResource(MethodView):
         'headers': None
     }
 
-    def __init__(self, app=None, **kwargs):
-        if app is not None:
-            self.app = app
-            self.init_app(self.app)
-        else:
-            self.app = None
-        self.db_query = self.db_query(**current_app.config)
+    #: The response class of the framework serving the resource
+    response_class = Response
 
-    def init_app(self, app):
-        app.teardown_appcontext(self.teardown)
+    #: The time budget of the request, see `timeout`
+    deadline = None
+
+    #: The `Prefer` header preference a write response applied
+    _preference_applied = None
+
+    def _init(self, app, req):
+        """Sets up the logger, database query and timings of the resource
+           for the request `req` to the `app`"""
+        self.method = req.method
+        self.logger = app.logger
+        if self.log_level is not None:
+            self.logger = self.logger.getChild(type(self).__name__)
+            if self.logger.level != self.log_level:
+                self.logger.setLevel(self.log_level)
+        self.db_query = self.db_query(logger=self.logger, **app.config)
+        self.timings = NULL_TIMINGS
+        if self.metrics_sink is not None or self.server_timing:
+            self.timings = Timings(self.metrics_sink, {
+                'resource': type(self).__name__, 'method': req.method})
+            self.db_query.timings = self.timings
+
+    def _deadline(self, req):
+        """Returns the `deadlines.Deadline` of the request, or None if it
+           doesn't have one"""
+        timeout = self.timeout
+        asked = req.headers.get('X-Request-Timeout', None)
+        if asked is not None:
+            try:
+                seconds = float(asked)
+            except ValueError:
+                seconds = None
+            if seconds is None or not math.isfinite(seconds) or seconds <= 0:
+                self.logger.warning("Ignoring X-Request-Timeout: %s", asked)
+            else:
+                timeout = seconds if timeout is None \
+                    else min(timeout, seconds)
+        return None if timeout is None else Deadline(timeout)
+
+    def _read_preference(self, req):
+        """Returns the read preference of the request's reads, or None to
+           read with the client's"""
+        if req.method != 'GET':
+            # a write builds on the record it reads, so it must be current
+            return ReadPreference.PRIMARY
+        if self.read_your_writes is not None:
+            try:
+                sticky = float(req.cookies.get(PRIMARY_COOKIE, 0))
+            except ValueError:
+                sticky = 0
+            if sticky > time.time():
+                self.logger.debug("Reading own writes from the primary")
+                return ReadPreference.PRIMARY
+        if self.read_preference is None:
+            return
+        if not isinstance(self.read_preference, dict):
+            return self.read_preference
+        which = 'instance' if 'obj_id' in (req.view_args or {}) \
+            else 'collection'
+        return self.read_preference.get(which, None)
+
+    def _timed_out(self, error):
+        """Returns the response of a request that ran out of time, or whose
+           database couldn't be reached in time"""
+        status, code = deadlines.status_of(error)
+        self.logger.error("Request failed with %s: %s", code, error)
+        errors = {'code': code, 'message': str(error)}
+        headers = []
+        if self.deadline is not None:
+            errors['timeout'] = self.deadline.seconds
+        if status == 503:
+            headers.append(('Retry-After', '1'))
+        return self._make_response(status, {'errors': errors},
+                                   headers=headers)
 
     def _exception_handler(self, e):
         """This exception handler catches should only be invoked when we need
@@ -82,53 +360,48 @@ class BaseResource(MethodView):
             return self._prep_response({'message': e.message},
                                        status=409)
 
-    def _get_instance(self, **kwargs):
-        """Loads the record specified by the `obj_id` path in the url and
-           stores it in g._resource_instance"""
-        current_app.logger.info("Getting instance")
-        current_app.logger.debug("kwargs: {}".format(kwargs))
-
-        current_app.logger.info(
-            "Loading instance: {}".format(kwargs['obj_id']))
-        rec = self.db_query.get_instance(self.db_collection, kwargs['obj_id'])
-        g._resource_instance = rec
-        current_app.logger.debug(
-            "g._resource_instance: {}".format(g._resource_instance))
-        return rec
+    @property
+    def _meta(self):
+        """The `meta.ResourceMeta` of the resource class"""
+        return get_meta(type(self))
 
     def _payload_root(self):
         """ Returns the expected json root in the payload"""
-        if hasattr(self, 'json_root'):
-            return self.json_root
-        return self.db_collection
+        return self._meta.payload_root
 
-    def _make_response(self, status, data=None, **kwargs):
+    def _build_response(self, req, status, data=None, **kwargs):
+        """Returns the response to `req` with the `status` and `data`, and
+           aborts with it if `abort` is set"""
         if kwargs.get('is_file', False):
-            current_app.logger.info("Setting response from first parameter")
+            self.logger.info("Setting response from first parameter")
             response = data
         else:
-            current_app.logger.info("Generating response and sending")
-            current_app.logger.debug("Status: {}".format(status))
-            current_app.logger.debug("Data: {}".format(data))
+            self.logger.info("Generating response and sending")
+            self.logger.debug("Status: %s", status)
+            self.logger.debug("Data: %s", data)
             has_errors = str(status)[0] in ['4', '5']
             if has_errors:
-                current_app.logger.debug("Returning errors payload")
+                self.logger.debug("Returning errors payload")
                 if isinstance(data, dict):
                     payload = data if 'errors' in list(data.keys() or '') \
                         else {'errors': data}
                 else:
                     payload = {'errors': data}
                 payload = self.db_query.serialize(None, payload)
+            elif kwargs.get('no_serialize', False):
+                payload = data
+            elif kwargs.get('stream', False):
+                payload = self.db_query.serialize_lines(data) \
+                    if kwargs.get('mimetype', None) == formats.NDJSON \
+                    else self.db_query.serialize_stream(
+                        self._payload_root(), data)
             else:
-                if kwargs.get('no_serialize', False):
-                    payload = data
-                else:
-                    payload = "" if data is None else \
-                        self.db_query.serialize(self._payload_root(), data)
-            current_app.logger.debug("Payload: {}".format(payload))
-            response = make_response(payload, status)
+                payload = "" if data is None else self._serialize(
+                    data, **kwargs.get('members', {}))
+            self.logger.debug("Payload: %s", payload)
+            response = self.response_class(payload, status)
 
-            current_app.logger.info("Adding response headers")
+            self.logger.info("Adding response headers")
             response.headers.add('Cache-Control',
                                  'max-age={},must-revalidate'.format(30))
             if data is None and kwargs.get('mimetype', None) is None:
@@ -137,15 +410,195 @@ class BaseResource(MethodView):
             response.mimetype = kwargs.get('mimetype', 'application/json')
             for h in kwargs.get('headers', []):
                 response.headers.add(h[0], h[1])
-            if request.method == 'POST' and not has_errors and status == 201:
-                location = "{}/{}".format(self._url, data['id'])
+            if req.method == 'POST' and not has_errors and \
+                    status == 201 and data is not None:
+                location = "{}/{}".format(self._meta.url, data['id'])
                 response.headers.add('location', location)
             response.expires = time.time() + 30
-            current_app.logger.debug("Headers: {}".format(response.headers))
+            if self.server_timing:
+                response.headers['Server-Timing'] = self.timings.header()
+            if self.read_your_writes is not None and not has_errors and \
+                    req.method in ['POST', 'PUT', 'PATCH', 'DELETE']:
+                window = self.read_your_writes
+                response.set_cookie(PRIMARY_COOKIE,
+                                    str(int(time.time() + window)),
+                                    max_age=window, httponly=True)
+            if self._preference_applied is not None:
+                response.headers.add('Preference-Applied',
+                                     self._preference_applied)
+            if req.method == 'GET' and status == 200 and \
+                    not kwargs.get('stream', False):
+                # without a version the ETag is a hash of the payload
+                etag = kwargs.get('etag', None)
+                if etag is None:
+                    etag = generate_etag(payload if isinstance(
+                        payload, bytes) else payload.encode('utf-8'))
+                last_modified = kwargs.get('last_modified', None)
+                not_modified = self._not_modified(req, etag, last_modified)
+                if not_modified is not None:
+                    response = not_modified
+                else:
+                    response.set_etag(etag)
+                    response.last_modified = last_modified
+            if req.method == 'GET' and \
+                    len(formats.available(self.media_types)) > 1:
+                response.vary.add('Accept')
+            self._compress(req, response)
+            self.logger.debug("Headers: %s", response.headers)
         if kwargs.get('abort', False):
             abort(response)
         return response
 
+    def _compress(self, req, response):
+        """Compress the body of `response` with the coding negotiated from
+           the request's `Accept-Encoding` header"""
+        if not self.compression:
+            return
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in [204, 304] \
+                or 'Content-Encoding' in response.headers:
+            return
+        encoding = req.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return
+        level = self.compression_levels.get(encoding, None)
+        if response.is_streamed:
+            response.response = compress_stream(
+                response.response, encoding, level)
+        else:
+            data = response.get_data()
+            if len(data) < self.compression_min_size:
+                return
+            with self.timings.phase('compress'):
+                response.set_data(compress(data, encoding, level))
+        self.logger.debug("Compressed response with %s", encoding)
+        response.headers['Content-Encoding'] = encoding
+        # the compressed body differs byte for byte, but not semantically
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+
+    def _record_validators(self, req, record):
+        """Returns the ETag and Last-Modified of `record` based on its
+           `version_field`, or None for both if the record isn't versioned.
+           With `include` the response is validated by its payload instead,
+           as the included records change without the record's version."""
+        if self.version_field is None or record in [{}, None] or \
+                record.get(self.version_field, None) is None or \
+                req.args.get('include', '') != '':
+            return None, None
+        version = record[self.version_field]
+        # the query string is included as it changes the representation
+        key = "{}:{}:{}:{}:{}".format(self.db_collection, record.get('_id'),
+                                      version, req.query_string,
+                                      self._media_type(req))
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return etag, version if isinstance(version, datetime) else None
+
+    def _not_modified(self, req, etag, last_modified):
+        """Returns a 304 response if the request's `If-None-Match` header, or
+           without one its `If-Modified-Since` header, match the given
+           validators, otherwise None"""
+        if etag is None:
+            return
+        if req.if_none_match:
+            unmodified = req.if_none_match.contains_weak(etag)
+        else:
+            # dates are compared to the second, as sent in Last-Modified
+            since = req.if_modified_since
+            unmodified = since is not None and last_modified is not None \
+                and parse_date(http_date(last_modified)) <= since
+        if not unmodified:
+            return
+        self.logger.info("Record not modified")
+        response = self.response_class("", 304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers.add('Cache-Control',
+                             'max-age={},must-revalidate'.format(30))
+        response.expires = time.time() + 30
+        return response
+
+    def _return_representation(self, req, default):
+        """Whether a write response should contain the saved record, as
+           asked for by the request's `Prefer` header"""
+        prefer = req.headers.get('Prefer', '') \
+            if self.allow_prefer else ''
+        for preference in ['return=minimal', 'return=representation']:
+            if preference in prefer:
+                self._preference_applied = preference
+                return preference == 'return=representation'
+        return default
+
+    def _written(self, req, record, created=False):
+        """Returns the response of a POST (`created`), PUT or PATCH that
+           saved `record`, with the record if the request prefers it"""
+        if created:
+            if self._return_representation(req, True):
+                return self._build_response(req, 201, record)
+            location = "{}/{}".format(self._meta.url, record['_id'])
+            return self._build_response(req, 201,
+                                        headers=[('location', location)])
+        if record is not None and self._return_representation(req, False):
+            return self._build_response(req, 200, record)
+        return self._build_response(req, 204)
+
+    def _auth_instance(self, name):
+        """Returns the instance of the `authentication` or `authorization`
+           class, which is built once per resource class"""
+        auth_class = getattr(self, name, None)
+        if auth_class is None:
+            return
+        cls = type(self)
+        if '_auth_instances' not in cls.__dict__:
+            cls._auth_instances = {}
+        a = cls._auth_instances.get(auth_class, None)
+        if a is None:
+            a = cls._auth_instances[auth_class] = auth_class()
+        return a
+
+    def _auth_key(self, a, *parts, **kwargs):
+        """Returns the auth cache key of `parts` for the principal of the
+           request, or None if results of the auth class `a` aren't cached"""
+        if self.auth_cache is None or not hasattr(a, 'cache_key'):
+            return
+        principal = a.cache_key(**kwargs)
+        if principal is None:
+            return
+        return self.auth_cache.key(
+            _principal_namespace(principal),
+            self.auth_cache.generation('auth'), type(self).__name__, *parts)
+
+    def _authentication_key(self, a, **kwargs):
+        """Returns the auth cache key of the authentication of the request,
+           or None if it isn't cached. A cached result skips
+           `is_authenticated`, so it must not set anything on `g`."""
+        if not getattr(a, 'side_effect_free', False):
+            return
+        return self._auth_key(a, 'authentication', **kwargs)
+
+    def _auth_cached(self, key):
+        """Returns the cached auth error of `key`, which is empty for a
+           success, or None if there is no cached result"""
+        if key is None:
+            return
+        error = self.auth_cache.lookup(key)
+        return error.decode('utf-8') if isinstance(error, bytes) else error
+
+    def _auth_store(self, key, error):
+        if key is not None:
+            self.auth_cache.set(key, error, self.auth_negative_ttl
+                                if error else self.auth_cache_ttl)
+
+    @classmethod
+    def revoke_credentials(cls, principal=None):
+        """Drops the cached auth results of `principal` in all resources
+           sharing the auth cache, or every cached result if it is None"""
+        if cls.auth_cache is None:
+            return
+        cls.auth_cache.invalidate(
+            'auth' if principal is None else _principal_namespace(principal))
+
     def fiddle_id(self, obj_id):
         """In some cases the `obj_id` in the url doesn't exactly match the
            record id. This method allows for the fiddling of the id to match
@@ -162,6 +615,157 @@ class BaseResource(MethodView):
            back to the client."""
         return payload
 
+    def _get_params(self, req, **kwargs):
+        """Returns the query, projection and limit of a GET from the resource
+           settings and the request's `_limit` and `_fields` arguments"""
+        params = {'query': self.access_limits(**kwargs), 'projection': {}}
+        if self.page_size is not None:
+            params['limit'] = self.page_size
+        if '_limit' in req.args:
+            try:
+                params['limit'] = int(req.args.get('_limit'))
+            except ValueError:
+                self.logger.debug("No record limit override")
+                pass
+        if '_fields' in req.args:
+            params['projection'] = \
+                {r: True for r in req.args.get('_fields', '').split(',')}
+        params['projection'].update(self.limit_fields(**kwargs))
+        return params
+
+    def _cache_key(self, req, params, **kwargs):
+        """Returns the response cache key for a GET with the query `params`,
+           or None if the resource isn't cached"""
+        if self.cache is None or 'include' in req.args:
+            # the related records aren't invalidated with the collection
+            return
+        # the host is part of the links in the payload
+        return self.cache.key(self.db_collection, req.host,
+                              kwargs.get('obj_id', None), params,
+                              self._media_type(req))
+
+    def _media_type(self, req):
+        """Returns the media type of the GET response, negotiated from the
+           request's `Accept` header"""
+        offered = formats.available(self.media_types)
+        return req.accept_mimetypes.best_match(offered, default=offered[0])
+
+    def _serialize(self, data, cache_key=None, media_type=formats.JSON,
+                   **members):
+        """Serializes the payload `data` into `media_type`, and caches it
+           under `cache_key`"""
+        with self.timings.phase('serialize'):
+            if media_type == formats.MSGPACK:
+                payload = self.db_query.pack(self._payload_root(), data,
+                                             **members)
+            elif media_type == formats.NDJSON:
+                payload = ''.join(self.db_query.serialize_lines(
+                    [data] if isinstance(data, dict) else data))
+            else:
+                payload = self.db_query.serialize(self._payload_root(), data,
+                                                  **members)
+        if cache_key is not None:
+            self.cache.set(cache_key, payload, self.cache_ttl)
+        return payload
+
+    def _flight_key(self, req, params, **kwargs):
+        """Returns the key that identical GETs with the query `params` share
+           in `single_flight`, or None if they aren't coalesced"""
+        if self.single_flight is None:
+            return
+        # a client reading its own writes mustn't wait on a stale read
+        preference = self.db_query.read_preference
+        return self.single_flight.key(
+            self.db_collection, req.host, kwargs.get('obj_id', None),
+            params, req.args.get('include', ''), self._media_type(req),
+            None if preference is None else preference.document)
+
+    def _coalesce(self, key, fetch):
+        """Returns the payload made by `fetch`, or the one being made by the
+           identical GET in flight"""
+        if key is None:
+            return fetch()
+        return self.single_flight.do(key, fetch, self.deadline)
+
+    def _cached(self, key):
+        if key is None:
+            return
+        payload = self.cache.lookup(key)
+        self.logger.debug("Response cache %s: %s",
+                          'miss' if payload is None else 'hit', key)
+        return payload
+
+    def _cached_total(self, key):
+        """Returns the cached payload of a collection GET and the count it
+           was serialized with, or None for both if either isn't cached"""
+        payload = self._cached(key)
+        if payload is None or self.count_mode is None:
+            return payload, None
+        # the count is cached next to the payload so the X-Total-Count
+        # header matches its `meta.total`
+        total = self.cache.get(key + ':total')
+        if total is None:
+            return None, None
+        return payload, int(total)
+
+    def _invalidate_cache(self):
+        if self.cache is not None:
+            self.logger.debug("Invalidating response cache")
+            self.cache.invalidate(self.db_collection)
+        if self.count_cache is not None:
+            self.count_cache.invalidate('count:{}'.format(self.db_collection))
+
+    def _count_key(self, query):
+        """Returns whether the count of `query` can be estimated, its count
+           cache key and its cached count, or None if it isn't cached"""
+        estimated = self.count_mode == 'fast' and len(query) < 1
+        if self.count_cache is None:
+            return estimated, None, None
+        key = self.count_cache.key(
+            'count:{}'.format(self.db_collection), query, estimated)
+        return estimated, key, self.count_cache.get(key)
+
+    def _counted(self, key, total):
+        """Caches the `total` counted for the count cache `key`"""
+        if key is not None:
+            self.count_cache.set(key, total, self.count_ttl)
+        return int(total)
+
+    def _total(self, query):
+        """Returns the number of records matching `query`, or None if the
+           resource doesn't count"""
+        if self.count_mode is None:
+            return
+        estimated, key, total = self._count_key(query)
+        if total is None:
+            total = self._counted(key, self.db_query.count(
+                self.db_collection, query, estimated=estimated))
+        return int(total)
+
+    def _count_members(self, total):
+        """Returns the `meta` member and headers of the `total` count"""
+        if total is None:
+            return None, []
+        return {'total': total}, [('X-Total-Count', str(total))]
+
+    def _run_hook(self, hook, record):
+        if self.hook_runner is None:
+            return getattr(self, hook)(record)
+        else:
+            self.hook_runner.submit(self, hook, record)
+
+    def _saved(self, record):
+        """Drops the cached responses of the collection once a record has
+           been saved and runs the `post_save` hook"""
+        self._invalidate_cache()
+        return self._run_hook('post_save', record)
+
+    def _deleted(self, record):
+        """Drops the cached responses of the collection once a record has
+           been deleted and runs the `post_delete` hook"""
+        self._invalidate_cache()
+        return self._run_hook('post_delete', record)
+
     def post_save(self, record):
         """Hook called after a record is saved."""
         pass
@@ -175,14 +779,14 @@ class BaseResource(MethodView):
            data is lost. In addition, it is also a hook for other fields to
            be overwritten, to ensure immutable fields aren't changed by a
            request."""
-        current_app.logger.info("Merging request data with db record")
-        current_app.logger.debug("orig_record: {}".format(orig_record))
-        current_app.logger.debug("Changes".format(changes))
+        self.logger.info("Merging request data with db record")
+        self.logger.debug("orig_record: %s", orig_record)
+        self.logger.debug("Changes: %s", changes)
         final_record = changes
-        if request.method == 'PATCH':
+        if self.method == 'PATCH':
             final_record = dict(orig_record)
             final_record.update(changes)
-        elif request.method == 'PUT':
+        elif self.method == 'PUT':
             if '_id' in orig_record:
                 final_record['_id'] = orig_record['_id']
         return final_record
@@ -195,80 +799,428 @@ class BaseResource(MethodView):
         """This method returns the projections for this resource"""
         return {}
 
+    def _page_params(self, req, params):
+        """Adds the sort order and the `_after`/`_before` continuation tokens
+           in the request to the query `params`. Raises a ValueError if the
+           sort isn't allowed."""
+        sort = []
+        for f in req.args.get('_sort', '').split(','):
+            field = f.strip().lstrip('-+')
+            if field == '':
+                continue
+            if field not in self.sortable_fields:
+                raise ValueError("Cannot sort on {}".format(field))
+            sort.append((field, -1 if f.strip().startswith('-') else 1))
+
+        paged = params.get('limit', 0) > 0 or '_after' in req.args or \
+            '_before' in req.args
+        if paged and (len(sort) < 1 or sort[-1][0] != '_id'):
+            # _id breaks ties so every record has a unique position
+            sort.append(('_id', sort[0][1] if len(sort) > 0 else 1))
+        if len(sort) > 0:
+            params['sort'] = sort
+        for arg in ['_after', '_before']:
+            if arg in req.args:
+                params[arg[1:]] = req.args[arg]
+                break
+
+        # the sort values are needed for the continuation tokens
+        projection = params['projection']
+        if any(projection.values()):
+            projection.update({f: True for f, d in sort})
+        return params
+
+    def _include_tree(self, include):
+        """Parses the comma separated, dotted relationship paths of the
+           `include` query parameter into a tree of relationship names.
+           Raises a ValueError for unknown or too deeply nested paths."""
+        tree = {}
+        for path in include.split(','):
+            if path.strip() == '':
+                continue
+            names = path.strip().split('.')
+            if len(names) > self.include_max_depth:
+                raise ValueError("Cannot include {} levels deep".format(
+                    len(names)))
+            node, relationships = tree, self.relationships
+            for name in names:
+                if name not in relationships:
+                    raise ValueError("Cannot include {}".format(path.strip()))
+                node = node.setdefault(name, {})
+                relationships = relationships[name].get('relationships', {})
+        return tree
+
+    def _related_ids(self, records, field):
+        """Returns the unique ids in `field` across `records`, in order"""
+        ids = OrderedDict()
+        for r in records:
+            value = r.get(field, None)
+            for obj_id in value if isinstance(value, list) else [value]:
+                if obj_id is not None:
+                    ids[str(obj_id)] = True
+        return list(ids.keys())
+
+    def _include_levels(self, records, tree):
+        """Walks the include `tree` a level at a time. The `load` sent back
+           into the generator for each relationship is the list of related
+           records, which are included and become the records of the next
+           level. The complete `included` list is returned at the end."""
+        included, seen = [], set()
+        level = [(self.relationships, records, tree)]
+        while len(level) > 0:
+            next_level = []
+            for relationships, parents, subtree in level:
+                for name, children in subtree.items():
+                    relationship = relationships[name]
+                    collection = self._related_collection(relationship)
+                    ids = self._related_ids(
+                        parents, relationship.get('field', name))
+                    related = yield relationship, ids
+                    for r in related:
+                        if (collection, str(r['_id'])) in seen:
+                            continue
+                        seen.add((collection, str(r['_id'])))
+                        record = dict(r)
+                        record['id'] = record.pop('_id')
+                        record['type'] = collection
+                        included.append(record)
+                    if len(children) > 0:
+                        next_level.append((
+                            relationship.get('relationships', {}), related,
+                            children))
+            level = next_level
+        return included
+
+    def _related_collection(self, relationship):
+        if 'collection' in relationship:
+            return relationship['collection']
+        return relationship['resource'].db_collection
+
+    def _related_query(self, relationship, resources):
+        """Returns the related resource of `relationship`, or None if it
+           names a collection, along with the collection, query and
+           projection its records are loaded with. The resources are built
+           once per request in `resources`."""
+        query = relationship.get('query', {})
+        projection = dict(relationship.get('projection', {}))
+        resource = None
+        if 'resource' in relationship:
+            cls = relationship['resource']
+            if cls not in resources:
+                resources[cls] = cls()
+            resource = resources[cls]
+            query = merge(resource.access_limits(), query)
+            projection.update(resource.limit_fields())
+        return (resource, self._related_collection(relationship), query,
+                projection)
+
+    def _include_batches(self, records, tree):
+        """Walks the include `tree` with `_include_levels`, yielding the
+           related resource, collection, ids and query arguments of each
+           batched `$in` query. The records found, keyed by id and authorized
+           by the related resource, are sent back into the generator. The
+           `included` list is returned at the end."""
+        levels = self._include_levels(records, tree)
+        resources = {}
+        try:
+            relationship, ids = next(levels)
+            while True:
+                resource, collection, query, projection = \
+                    self._related_query(relationship, resources)
+                related = []
+                for i in range(0, len(ids), self.include_batch_size):
+                    batch = ids[i:i + self.include_batch_size]
+                    found = yield resource, collection, batch, {
+                        'query': query, 'projection': projection}
+                    related.extend(found[obj_id] for obj_id in batch
+                                   if obj_id in found)
+                relationship, ids = levels.send(related)
+        except StopIteration as e:
+            return e.value
+
+    def _included(self, records, tree):
+        """Returns the records related to `records` through the include
+           `tree`, loading each relationship with batched `$in` queries"""
+        if len(tree) < 1:
+            return
+        batches = self._include_batches(records, tree)
+        try:
+            resource, collection, batch, kwargs = next(batches)
+            while True:
+                found = self.db_query.get_instances(collection, batch,
+                                                    **kwargs)
+                if resource is not None:
+                    found = {k: r for k, r in found.items()
+                             if is_authorized(resource, r)}
+                resource, collection, batch, kwargs = batches.send(found)
+        except StopIteration as e:
+            return e.value
+
+    def _filter_query(self, query, args):
+        """Narrows the `access_limits` query with the filters in the query
+           string `args`. Raises a ValueError if a filter isn't allowed."""
+        cls = type(self)
+        if '_filters' not in cls.__dict__:
+            cls._filters = Filters(cls.filterable_fields)
+        return merge(query, cls._filters.parse(args))
+
+    def _page_url(self, req, arg, token):
+        args = req.args.copy()
+        args.pop('_after', None)
+        args.pop('_before', None)
+        args[arg] = token
+        return "{}?{}".format(req.base_url,
+                              urlencode(list(args.items(multi=True))))
+
+    def _look_ahead(self, params):
+        """Returns the page size of the query `params`, which then ask for
+           an extra record to check for a next page"""
+        limit = params.get('limit', 0)
+        if limit > 0:
+            params['limit'] = limit + 1
+        return limit
+
+    def _page_links(self, req, records, limit, params):
+        """Trims the extra record fetched to look past the page, and returns
+           the `next` and `prev` links of the page, or None if it isn't
+           paged"""
+        if limit < 1:
+            return
+        more = len(records) > limit
+        if 'before' in params:
+            if more:
+                del records[0]
+            has_prev, has_next = more, True
+        else:
+            if more:
+                del records[limit:]
+            has_prev, has_next = 'after' in params, more
+
+        links = {}
+        if len(records) > 0 and has_next:
+            links['next'] = self._page_url(
+                req, '_after', encode_position(records[-1], params['sort']))
+        if len(records) > 0 and has_prev:
+            links['prev'] = self._page_url(
+                req, '_before', encode_position(records[0], params['sort']))
+        return links
+
+    def _collection_payload(self, records, key, media_type, total,
+                            **members):
+        """Serializes the page `records` and their `total` count, caching
+           both under `key`, and returns the payload and the count"""
+        meta, headers = self._count_members(total)
+        payload = self._serialize(self.transform_payload(records), key,
+                                  media_type, meta=meta, **members)
+        if key is not None and total is not None:
+            self.cache.set(key + ':total', total, self.cache_ttl)
+        return payload, total
+
+
+class BaseResource(MethodView, Resource):
+    """A `Resource` served by Flask"""
+
+    def __init__(self, app=None, **kwargs):
+        if app is not None:
+            self.app = app
+            self.init_app(self.app)
+        else:
+            self.app = None
+        self._init(current_app, request)
+        self.deadline = self._deadline(request)
+        self.db_query.deadline = self.deadline
+        self.db_query.read_preference = self._read_preference(request)
+
+    def init_app(self, app):
+        app.teardown_appcontext(self.teardown)
+
+    def _get_instance(self, **kwargs):
+        """Loads the record specified by the `obj_id` path in the url and
+           stores it in g._resource_instance"""
+        self.logger.info("Getting instance")
+        self.logger.debug("kwargs: %s", kwargs)
+
+        self.logger.info("Loading instance: %s", kwargs['obj_id'])
+        rec = self.db_query.get_instance(self.db_collection, kwargs['obj_id'])
+        g._resource_instance = rec
+        self.logger.debug("g._resource_instance: %s", g._resource_instance)
+        return rec
+
+    def _make_response(self, status, data=None, **kwargs):
+        return self._build_response(request, status, data, **kwargs)
+
     @crossdomain
     @endpoint
     def get(self, **kwargs):
-        current_app.logger.info("GETting record(s) from database")
-        records = []
-
-        # generate meta information
-        params = {'query': self.access_limits(**kwargs), 'projection': {}}
-        if '_limit' in request.args:
-            try:
-                params['limit'] = int(request.args.get('_limit'))
-            except ValueError:
-                current_app.logger.debug("No record limit override")
-                pass
-        if '_fields' in request.args:
-            params['projection'] = \
-                {r: True for r in request.args.get('_fields', '').split(',')}
-        params['projection'].update(self.limit_fields(**kwargs))
+        self.logger.info("GETting record(s) from database")
+        params = self._get_params(request, **kwargs)
+        media_type = self._media_type(request)
+        try:
+            include = self._include_tree(request.args.get('include', ''))
+            if len(include) > 0 and media_type == formats.NDJSON:
+                raise ValueError("Cannot include records in NDJSON")
+        except ValueError as e:
+            return self._make_response(400, str(e))
 
         if 'obj_id' in kwargs:
-            records = self.db_query.get_instance(
-                self.db_collection, kwargs['obj_id'], **params)
-            if records in [{}, None]:
+            etag, last_modified = \
+                self._record_validators(request, g._resource_instance)
+            response = self._not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+            key = self._cache_key(request, params, **kwargs)
+            cached = self._cached(key)
+            if cached is not None:
+                return self._make_response(200, cached, no_serialize=True,
+                                           etag=etag,
+                                           last_modified=last_modified,
+                                           mimetype=media_type)
+
+            def fetch():
+                record = self.db_query.get_instance(
+                    self.db_collection, kwargs['obj_id'], **params)
+                if record in [{}, None]:
+                    return
+                included = self._included([record], include)
+                return self._serialize(self.transform_payload(record), key,
+                                       media_type, included=included)
+            payload = self._coalesce(
+                self._flight_key(request, params, **kwargs), fetch)
+            if payload is None:
                 return self._make_response(404)
+            return self._make_response(200, payload, no_serialize=True,
+                                       etag=etag, last_modified=last_modified,
+                                       mimetype=media_type)
+
+        try:
+            params['query'] = self._filter_query(params['query'], request.args)
+            self._page_params(request, params)
+            if self.stream_collections or media_type == formats.NDJSON:
+                if 'before' in params:
+                    raise ValueError("Cannot page backwards when streaming")
+                if len(include) > 0:
+                    raise ValueError("Cannot include records when streaming")
+                params.update({'stream': True,
+                               'batch_size': self.cursor_batch_size})
+                meta, headers = \
+                    self._count_members(self._total(params['query']))
+                records = \
+                    self.db_query.get_collection(self.db_collection, **params)
+                return self._make_response(
+                    200, self.transform_payload(records), stream=True,
+                    headers=headers, mimetype=media_type)
+
+            key = self._cache_key(request, params, **kwargs)
+            cached, total = self._cached_total(key)
+            if cached is not None:
+                meta, headers = self._count_members(total)
+                return self._make_response(200, cached, no_serialize=True,
+                                           headers=headers,
+                                           mimetype=media_type)
+
+            def fetch():
+                total = self._total(params['query'])
+                limit = self._look_ahead(params)
+                records = \
+                    self.db_query.get_collection(self.db_collection, **params)
+                links = self._page_links(request, records, limit, params)
+                return self._collection_payload(
+                    records, key, media_type, total, links=links,
+                    included=self._included(records, include))
+            payload, total = self._coalesce(
+                self._flight_key(request, params, **kwargs), fetch)
+            meta, headers = self._count_members(total)
+        except ValueError as e:
+            return self._make_response(400, str(e))
+
+        return self._make_response(200, payload, no_serialize=True,
+                                   headers=headers, mimetype=media_type)
+
+    def _bulk_write(self):
+        """Writes the records of the bulk request items that passed the
+           endpoint workflow in one round trip, runs the hooks for those that
+           were saved and returns the status of every item"""
+        ordered = request.args.get('_ordered', str(self.bulk_ordered))
+        ordered = ordered.lower() not in ['false', '0']
+        items = [i for i in g._bulk if 'record' in i]
+        records = [i.pop('record') for i in items]
+        if request.method == 'POST':
+            status, hook = 201, 'post_save'
+            errors = self.db_query.create_many(
+                self.db_collection, records, ordered=ordered)
+        elif request.method == 'PATCH':
+            status, hook = 204, 'post_save'
+            errors = self.db_query.update_many(
+                self.db_collection, records, ordered=ordered)
         else:
-            records = \
-                self.db_query.get_collection(self.db_collection, **params)
+            status, hook = 204, 'post_delete'
+            errors = self.db_query.delete_many(
+                self.db_collection, records, ordered=ordered)
 
-        return self._make_response(200, self.transform_payload(records))
+        if None in errors:
+            self._invalidate_cache()
+        for item, record, error in zip(items, records, errors):
+            if error is None:
+                item.update({'status': status, 'id': record['_id']})
+                self._run_hook(hook, record)
+            else:
+                item.update({'status': 424 if error['code'] is None else 409,
+                             'errors': error['message']})
+        return self._make_response(200, g._bulk)
 
     @crossdomain
     @endpoint
     def post(self, **kwargs):
-        current_app.logger.info("POSTing record to database")
-        current_app.logger.debug(g._saveable_record)
-        record_id = self.db_query.create(self.db_collection,
-                                         g._saveable_record)
-        record = self.db_query.get_instance(self.db_collection, record_id)
-        self.post_save(record)
-        return self._make_response(201, record)
+        if getattr(g, '_bulk', None) is not None:
+            return self._bulk_write()
+        self.logger.info("POSTing record to database")
+        self.logger.debug(g._saveable_record)
+        # the response is built from the saved record instead of a re-read
+        record = g._saveable_record
+        record['_id'] = self.db_query.create(self.db_collection, record)
+        self._saved(record)
+        return self._written(request, record, created=True)
 
     @crossdomain
     @endpoint
     def put(self, **kwargs):
-        current_app.logger.info("PUTting record to database")
-        current_app.logger.debug(g._saveable_record)
+        self.logger.info("PUTting record to database")
+        self.logger.debug(g._saveable_record)
         record = self.db_query.update(self.db_collection, g._saveable_record,
                                       orig_record=g._resource_instance,
                                       full_update=True)
-        self.post_save(record)
-        return self._make_response(204)
+        self._saved(record)
+        return self._written(request, record)
 
     @crossdomain
     @endpoint
     def patch(self, **kwargs):
-        current_app.logger.info("PATCHing record to database")
-        current_app.logger.debug(g._saveable_record)
+        if getattr(g, '_bulk', None) is not None:
+            return self._bulk_write()
+        self.logger.info("PATCHing record to database")
+        self.logger.debug(g._saveable_record)
         record = self.db_query.update(self.db_collection, g._saveable_record,
                                       orig_record=g._resource_instance)
-        self.post_save(record)
-        return self._make_response(204)
+        self._saved(record)
+        return self._written(request, record)
 
     @crossdomain
     @endpoint
     def delete(self, **kwargs):
-        current_app.logger.info("DELETEing record from database")
+        if getattr(g, '_bulk', None) is not None:
+            return self._bulk_write()
+        self.logger.info("DELETEing record from database")
         self.db_query.delete(self.db_collection, g._resource_instance)
-        self.post_delete(g._resource_instance)
+        self._deleted(g._resource_instance)
         return self._make_response(204)
 
     @crossdomain
     def options(self, **kwargs):
         """This method has been implemented as per the CORS spec, however is
         not accessible by default. To included it make `cors_enabled` = True"""
-        if self.cors_enabled:
+        if self._meta.cors_enabled:
             return self._make_response(200)
         return self._make_response(405, "CORS request rejected")
+
+    # registered resources answer OPTIONS with `cors.preflight` instead
+    options.answers_preflight = True
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from bson.objectid import ObjectId
+from collections import OrderedDict
+from uuid import UUID
+from datetime import datetime
+
+import json
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+
+#: The conversions of the mongo types which JSON doesn't know about
+CONVERTERS = {
+    ObjectId: str,
+    UUID: lambda obj: obj.hex,
+    datetime: lambda obj: int(obj.timestamp()),
+}
+
+
+def to_json_type(obj):
+    """Convert a mongo object into a standard JSON type. The exact type is
+       looked up first so the common case is a single dict lookup."""
+    converter = CONVERTERS.get(type(obj), None)
+    if converter is None:
+        for t, c in CONVERTERS.items():
+            if isinstance(obj, t):
+                converter = c
+                break
+        else:
+            raise TypeError("{!r} is not JSON serializable".format(obj))
+    return converter(obj)
+
+
+class JSONEncoder(json.JSONEncoder):
+    """Encode all fancy mongo objects into normal strings. While it is useful
+       in some cases to use the mongo json_util class, generally we want to
+       hide complexity for the API client, and so don't return types. It is
+       up to the API to convert incoming types, and up to this class to
+       serialize all complex objects to standard JSON types"""
+
+    def default(self, obj):
+        try:
+            return to_json_type(obj)
+        except TypeError:
+            return json.JSONEncoder.default(self, obj)
+
+
+#: The separators of the serialized JSON. rapidjson always writes compact
+#: JSON, so the other backends do too and the payloads and their ETags don't
+#: depend on the installed backend.
+SEPARATORS = (',', ':')
+
+
+class StdlibSerializer():
+    """Serializes with the standard library `json` module. It is always
+       available and is the reference output for the other backends."""
+    name = 'json'
+
+    def __init__(self):
+        self.encoder = JSONEncoder(separators=SEPARATORS)
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+
+class RapidJSONSerializer():
+    """Serializes with python-rapidjson. Its own UUID and datetime handling
+       is switched off so those go through `to_json_type` as well, and
+       number keys are written as strings like the standard library does."""
+    name = 'rapidjson'
+
+    def dumps(self, obj):
+        return rapidjson.dumps(
+            obj, default=to_json_type, uuid_mode=rapidjson.UM_NONE,
+            datetime_mode=rapidjson.DM_NONE,
+            mapping_mode=rapidjson.MM_COERCE_KEYS_TO_STRINGS)
+
+
+#: The serializers in order of preference, along with whether they can be used
+SERIALIZERS = OrderedDict([
+    ('rapidjson', (RapidJSONSerializer, rapidjson is not None)),
+    ('json', (StdlibSerializer, True)),
+])
+
+_serializers = {}
+
+
+def get_serializer(name='auto'):
+    """Return the serializer called `name`. With 'auto' the fastest installed
+       backend is picked, falling back to the standard library."""
+    if name not in _serializers:
+        backend = name
+        if name == 'auto':
+            backend = [n for n, (c, ok) in SERIALIZERS.items() if ok][0]
+        elif name not in SERIALIZERS:
+            raise ValueError("Unknown JSON serializer: {}".format(name))
+        elif not SERIALIZERS[name][1]:
+            raise ValueError("JSON serializer {} is not installed"
+                             .format(name))
+        _serializers[name] = SERIALIZERS[backend][0]()
+    return _serializers[name]
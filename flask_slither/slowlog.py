@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""A log of the database operations that take longer than the app's
+DB_SLOW_QUERY_MS. Each slow operation is logged as a warning with its
+collection, the shape of its query and its projection, and kept in an
+in-process ring buffer, which `slow_queries()` and `summary()` read.
+
+With DB_SLOW_QUERY_EXPLAIN the slow reads are explained too, showing
+whether they scanned the collection or used an index, and how many keys and
+documents were examined for the documents returned. Explaining runs the
+query again, so each query shape is explained at most once a minute.
+
+Operations that fail after the threshold are kept with their error, and so
+are those that time out however long they took, e.g. a query exceeding the
+`maxTimeMS` of a request deadline.
+"""
+from bson import json_util
+from collections import deque
+from flask_slither.cache import LRUCache
+from pymongo.errors import ExecutionTimeout, NetworkTimeout
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: The errors of operations that are logged whatever their duration
+TIMEOUTS = (ExecutionTimeout, NetworkTimeout)
+
+
+def query_shape(query):
+    """Returns `query` with its values replaced by '?', so it can be logged
+       without the data it matches and grouped with the same queries for
+       other values"""
+    if isinstance(query, dict):
+        return {k: query_shape(v) for k, v in query.items()}
+    if isinstance(query, (list, tuple)) and \
+            all(isinstance(q, dict) for q in query) and len(query) > 0:
+        # the branches of $and, $or and $nor
+        return [query_shape(q) for q in query]
+    return '?'
+
+
+def _stages(plan):
+    yield plan
+    for child in [plan.get('inputStage', None)] + \
+            list(plan.get('inputStages', [])):
+        if child is not None:
+            yield from _stages(child)
+
+
+def summarize_plan(explain):
+    """Returns the stages and indexes of the winning plan of an `explain()`
+       output, and the keys and documents it examined for those returned"""
+    plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    stages = list(_stages(plan))
+    stats = explain.get('executionStats', {})
+    return {
+        'stages': [s.get('stage', None) for s in stages],
+        'indexes': [s['indexName'] for s in stages if 'indexName' in s],
+        'collscan': any(s.get('stage', None) == 'COLLSCAN' for s in stages),
+        'keys_examined': stats.get('totalKeysExamined', None),
+        'docs_examined': stats.get('totalDocsExamined', None),
+        'returned': stats.get('nReturned', None),
+    }
+
+
+class SlowQueryLog():
+    """Keeps the last `max_size` slow operations in memory. The plans of
+       explained query shapes are reused for `explain_interval` seconds."""
+
+    def __init__(self, max_size=500, explain_interval=60):
+        self.explain_interval = explain_interval
+        self._entries = deque(maxlen=max_size)
+        self._plans = LRUCache(max_size=1024, ttl=explain_interval)
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._plans.clear()
+
+    def entries(self, collection=None, op=None):
+        """Returns the slow operations, the most recent first, optionally
+           only those on `collection` or of the `op` kind"""
+        with self._lock:
+            entries = list(self._entries)
+        return [e for e in reversed(entries)
+                if (collection is None or e['collection'] == collection) and
+                (op is None or e['op'] == op)]
+
+    def summary(self):
+        """Returns the slow operations grouped by collection, op, query shape
+           and projection, the slowest in total first"""
+        groups = {}
+        for e in self.entries():
+            key = json_util.dumps([e['collection'], e['op'], e['query'],
+                                   e['projection']], sort_keys=True)
+            group = groups.get(key, None)
+            if group is None:
+                # entries are newest first, so this has the latest plan
+                group = groups[key] = {
+                    'collection': e['collection'], 'op': e['op'],
+                    'query': e['query'], 'projection': e['projection'],
+                    'count': 0, 'total_ms': 0, 'max_ms': 0,
+                    'plan': e.get('plan', None)}
+            group['count'] += 1
+            group['total_ms'] += e['ms']
+            group['max_ms'] = max(group['max_ms'], e['ms'])
+        return sorted(groups.values(), key=lambda g: -g['total_ms'])
+
+    def plan(self, entry, explain):
+        """Returns the summarized plan of the `entry`, from the `explain`
+           callable unless its shape was explained recently"""
+        key = json_util.dumps([entry['collection'], entry['op'],
+                               entry['query'], entry['projection']],
+                              sort_keys=True)
+        plan = self._plans.get(key)
+        if plan is None:
+            try:
+                plan = summarize_plan(explain())
+            except Exception as e:
+                logger.warning("Couldn't explain slow query: %s", e)
+                return
+            self._plans.set(key, plan)
+        return plan
+
+
+#: The slow operations of the process
+SLOW_QUERIES = SlowQueryLog()
+
+
+def slow_queries(collection=None, op=None):
+    """Returns the recent slow operations of the process, the most recent
+       first"""
+    return SLOW_QUERIES.entries(collection, op)
+
+
+def summary():
+    return SLOW_QUERIES.summary()
+
+
+class Watch():
+    """Times the database operation in its `with` block, and records it in
+       `log` if it takes `threshold` ms or more or times out. Successful
+       reads are explained with the `explain` callable, if there is one."""
+
+    def __init__(self, log, threshold, log_to, op, collection, query=None,
+                 projection=None, explain=None):
+        self.log = log
+        self.threshold = threshold
+        self.logger = log_to
+        self.op = op
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.explain = explain
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        ms = (time.perf_counter() - self.start) * 1000
+        timed_out = exc_type is not None and issubclass(exc_type, TIMEOUTS)
+        if ms < self.threshold and not timed_out:
+            return
+        entry = {
+            'at': time.time(),
+            'op': self.op,
+            'collection': self.collection,
+            'ms': ms,
+            'query': query_shape(self.query or {}),
+            'projection': sorted(self.projection or []),
+        }
+        if exc_type is not None:
+            # a failed query isn't run again to be explained
+            entry['error'] = exc_type.__name__
+        elif self.explain is not None:
+            entry['plan'] = self.log.plan(entry, self.explain)
+        self.logger.warning("Slow %s on %s took %.1fms: query %s, "
+                            "projection %s, plan %s, error %s", self.op,
+                            self.collection, ms, entry['query'],
+                            entry['projection'], entry.get('plan', None),
+                            entry.get('error', None))
+        self.log.add(entry)
+
+
+class _NullWatch():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_WATCH = _NullWatch()
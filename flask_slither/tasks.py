@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Runners for the `post_save` and `post_delete` hooks of a resource, set
+with its `hook_runner`. Hooks run synchronously before the response unless a
+background runner is set:
+
+ * `ThreadPoolRunner` runs hooks on a bounded pool of threads in process.
+ * `PersistentQueueRunner` keeps hooks in a local sqlite queue, so those
+   that haven't run survive a restart.
+
+Failed hooks are retried with an exponential backoff, and once the retries
+are used up they are kept in a dead letter store for inspection.
+"""
+from bson import json_util
+from flask import current_app, copy_current_request_context
+from collections import deque
+from importlib import import_module
+
+import atexit
+import copy
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDeadLetters():
+    """Keeps the last `max_size` failed hooks in memory"""
+
+    def __init__(self, max_size=1000):
+        self._letters = deque(maxlen=max_size)
+
+    def add(self, hook, record, error):
+        self._letters.append({'hook': hook, 'record': record,
+                              'error': error, 'failed_at': time.time()})
+
+    def all(self):
+        return list(self._letters)
+
+
+class SyncRunner():
+    """Runs hooks before the response, as if there were no runner"""
+
+    def submit(self, resource, hook, record):
+        getattr(resource, hook)(record)
+
+    def shutdown(self, timeout=None):
+        pass
+
+
+class _BackgroundRunner():
+
+    def __init__(self, retries=3, backoff=0.5, dead_letters=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.dead_letters = MemoryDeadLetters() if dead_letters is None \
+            else dead_letters
+        self._stopping = False
+        atexit.register(self.shutdown)
+
+    def _delay(self, attempts):
+        return self.backoff * 2 ** (attempts - 1)
+
+    def _failed(self, name, record, attempts):
+        """Logs a failed hook and returns whether it is out of retries"""
+        error = traceback.format_exc()
+        logger.warning("Hook %s failed, attempt %s of %s", name, attempts,
+                       self.retries + 1)
+        if attempts > self.retries:
+            logger.error("Hook %s failed for good: %s", name, error)
+            self.dead_letters.add(name, record, error)
+            return True
+        return False
+
+
+def _without_deadline(resource):
+    """Returns a copy of `resource` whose queries aren't bound by the time
+       budget of the request, which a hook can outlive"""
+    resource = copy.copy(resource)
+    resource.deadline = None
+    resource.db_query = copy.copy(resource.db_query)
+    resource.db_query.deadline = None
+    return resource
+
+
+class ThreadPoolRunner(_BackgroundRunner):
+    """Runs hooks on `workers` threads, in the app and request context of the
+       request that submitted them but without its deadline. At most
+       `max_queued` hooks wait for a thread. When the queue is full the hook
+       runs before the response, so a burst of writes slows down rather than
+       piling up work in memory."""
+
+    def __init__(self, workers=4, max_queued=1000, **kwargs):
+        _BackgroundRunner.__init__(self, **kwargs)
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, resource, hook, record):
+        # the response may change the record while the hook runs
+        record = copy.deepcopy(record)
+        run = copy_current_request_context(
+            getattr(_without_deadline(resource), hook))
+        name = "{}.{}".format(type(resource).__name__, hook)
+        try:
+            if self._stopping:
+                raise queue.Full
+            self._queue.put_nowait((run, name, record))
+        except queue.Full:
+            logger.warning("Hook queue full, running %s now", name)
+            getattr(resource, hook)(record)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                return
+            run, name, record = task
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    run(record)
+                    break
+                except Exception:
+                    if self._failed(name, record, attempts):
+                        break
+                    time.sleep(self._delay(attempts))
+            self._queue.task_done()
+
+    def shutdown(self, timeout=None):
+        """Stop taking hooks and wait for the queued ones to finish"""
+        if self._stopping:
+            return
+        self._stopping = True
+        for t in self._threads:
+            self._queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for t in self._threads:
+            t.join(None if deadline is None
+                   else max(0, deadline - time.monotonic()))
+
+
+class SqliteDeadLetters():
+    """Keeps failed hooks in the `dead_letters` table of a sqlite database"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters (id INTEGER PRIMARY "
+                "KEY, hook TEXT, record TEXT, error TEXT, failed_at REAL)")
+
+    def add(self, hook, record, error):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO dead_letters (hook, record, error, failed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (hook, json_util.dumps(record), error, time.time()))
+
+    def all(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hook, record, error, failed_at FROM dead_letters "
+                "ORDER BY id").fetchall()
+        return [{'hook': h, 'record': json_util.loads(r), 'error': e,
+                 'failed_at': f} for h, r, e, f in rows]
+
+
+class PersistentQueueRunner(_BackgroundRunner):
+    """Queues hooks in the sqlite database at `path` and runs them on
+       `workers` threads. Hooks are run at least once: a hook that was
+       running when the process died is run again after `lease` seconds.
+
+       The hook runs on a new instance of the resource, in a test request
+       context of the app, so it shouldn't rely on the original request.
+       The resource class must be importable from its module."""
+
+    def __init__(self, path, workers=1, lease=60, poll_interval=1,
+                 **kwargs):
+        kwargs.setdefault('dead_letters', SqliteDeadLetters(path))
+        _BackgroundRunner.__init__(self, **kwargs)
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.app = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, "
+                "resource TEXT, hook TEXT, record TEXT, attempts INTEGER, "
+                "available_at REAL)")
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def init_app(self, app):
+        """Start running the tasks queued for `app`, including those left
+           over from a previous run"""
+        self.app = app
+        self._wakeup.set()
+
+    def submit(self, resource, hook, record):
+        if self.app is None:
+            self.init_app(current_app._get_current_object())
+        cls = type(resource)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO tasks (resource, hook, record, attempts, "
+                "available_at) VALUES (?, ?, ?, 0, ?)",
+                ("{}:{}".format(cls.__module__, cls.__qualname__), hook,
+                 json_util.dumps(record), time.time()))
+        self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def _claim(self):
+        """Takes the next available task for the length of the lease"""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id, resource, hook, record, attempts FROM tasks "
+                "WHERE available_at <= ? ORDER BY id LIMIT 1",
+                (now,)).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE tasks SET available_at = ?, attempts = ? "
+                    "WHERE id = ?", (now + self.lease, row[4] + 1, row[0]))
+        return row
+
+    def _run(self, resource, hook, record):
+        module, name = resource.split(':')
+        cls = import_module(module)
+        for part in name.split('.'):
+            cls = getattr(cls, part)
+        with self.app.test_request_context():
+            getattr(cls(), hook)(record)
+
+    def _work(self):
+        while True:
+            task = self._claim() if self.app is not None else None
+            if task is None:
+                if self._stopping:
+                    return
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            task_id, resource, hook, record, attempts = task
+            record = json_util.loads(record)
+            name = "{}.{}".format(resource, hook)
+            try:
+                self._run(resource, hook, record)
+                done = True
+            except Exception:
+                done = self._failed(name, record, attempts + 1)
+            with self._lock, self._db:
+                if done:
+                    self._db.execute("DELETE FROM tasks WHERE id = ?",
+                                     (task_id,))
+                else:
+                    self._db.execute(
+                        "UPDATE tasks SET available_at = ? WHERE id = ?",
+                        (time.time() + self._delay(attempts + 1), task_id))
+
+    def shutdown(self, timeout=None):
+        """Stop the workers once the available tasks have run. Tasks waiting
+           for a retry stay queued for the next start."""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for t in self._threads:
+            t.join(None if deadline is None
+                   else max(0, deadline - time.monotonic()))
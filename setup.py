@@ -23,14 +23,22 @@ setup(
     include_package_data=True,
     platforms='any',
     install_requires=[
-        'Flask==0.10.1',
-        'pymongo==2.6',
+        'Flask>=3.0',
+        'pymongo>=3.12,<5',
         'inflect==0.2.5'
     ],
+    extras_require={
+        'rapidjson': ['python-rapidjson'],
+        # motor 2 doesn't import on python 3.11, and motor 3 needs pymongo 4.
+        # quart 0.19 is the first built on Flask 3
+        'async': ['motor>=3.0,<4', 'quart>=0.19'],
+        'brotli': ['brotli'],
+        'msgpack': ['msgpack>=1.0']
+    },
     tests_require=[
-        'Flask==0.10.1',
+        'Flask>=3.0',
         'inflect==0.2.5',
-        'pymongo==2.6',
+        'pymongo>=3.12,<5',
         'nose==1.3.3'
     ],
     classifiers=[
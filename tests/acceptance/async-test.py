@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# The async test runs the basic requests, authentication, validation and
+# hooks through an async resource on a Quart app.
+
+from flask_slither import register_resource
+from flask_slither.aio import AsyncBaseResource
+from flask_slither.cache import LRUCache
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from quart import Quart
+from werkzeug.http import http_date
+
+import asyncio
+import json
+import unittest
+
+
+class AsyncAuth:
+    def is_authenticated(self, **kwargs):
+        return True
+
+    async def is_authorized(self, record):
+        await asyncio.sleep(0)
+        return record.get('name', None) != 'Locked'
+
+
+class AsyncValidation:
+    async def validate_post(self, data):
+        if 'name' not in data:
+            return {'name': "Required"}
+
+
+class AsyncsResource(AsyncBaseResource):
+    db_collection = 'asyncs'
+    authentication = AsyncAuth
+    validation = AsyncValidation
+    saved = []
+
+    async def post_save(self, record):
+        self.saved.append(record['name'])
+
+
+class CorsAsyncsResource(AsyncBaseResource):
+    db_collection = 'asyncs'
+    cors_enabled = True
+    cors_config = dict(AsyncBaseResource.cors_config,
+                       allowed=['*.example.com'], blacklist=[r'^bad\..+'])
+
+
+class BytesCache(LRUCache):
+    """Hands payloads back as bytes, like a `RedisCache`"""
+
+    def set(self, key, value, ttl=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        LRUCache.set(self, key, value, ttl)
+
+
+class CachedAsyncsResource(AsyncBaseResource):
+    db_collection = 'asyncs'
+    cache = BytesCache()
+
+
+class VersionedAsyncsResource(AsyncBaseResource):
+    db_collection = 'asyncs'
+    version_field = 'updated'
+
+
+class AsyncTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.app = Quart('Async')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, AsyncsResource, url="asyncs")
+        register_resource(self.app, CorsAsyncsResource, url="cors")
+        register_resource(self.app, CachedAsyncsResource, url="cached")
+        register_resource(self.app, VersionedAsyncsResource, url="versioned")
+        AsyncsResource.saved = []
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        self.updated = datetime(2020, 1, 2, 3, 4, 5)
+        self.db['asyncs'].insert_many([
+            {'name': name, 'updated': self.updated}
+            for name in ['Async1', 'Async2', 'Locked']])
+
+    def tearDown(self):
+        self.db['asyncs'].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    async def _json(self, r):
+        return json.loads((await r.get_data()).decode('utf-8'))
+
+    async def test_get(self):
+        """Get the collection and an instance"""
+        r = await self.client.get('/asyncs')
+        self.assertEquals(r.status_code, 200)
+        records = (await self._json(r))['asyncs']
+        self.assertEquals([a['name'] for a in records],
+                          ['Async1', 'Async2', 'Locked'])
+
+        r = await self.client.get('/asyncs/{}'.format(records[0]['id']))
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals((await self._json(r))['asyncs']['name'], 'Async1')
+        r = await self.client.get('/asyncs/{}'.format(records[0]['id']),
+                                  headers={'If-None-Match': r.headers['ETag']})
+        self.assertEquals(r.status_code, 304)
+
+    async def test_if_modified_since(self):
+        """Versioned records answer `If-Modified-Since` with a 304"""
+        url = '/versioned/{}'.format(self.db['asyncs'].find_one()['_id'])
+        r = await self.client.get(url)
+        self.assertEquals(r.headers['Last-Modified'], http_date(self.updated))
+        r = await self.client.get(url, headers={
+            'If-Modified-Since': r.headers['Last-Modified']})
+        self.assertEquals(r.status_code, 304)
+        r = await self.client.get(url, headers={
+            'If-Modified-Since': http_date(self.updated - timedelta(1))})
+        self.assertEquals(r.status_code, 200)
+
+    async def test_cached(self):
+        """Payloads cached as bytes are returned as they are"""
+        for url in ['/cached', '/cached/{}'.format(
+                self.db['asyncs'].find_one()['_id'])]:
+            r = await self.client.get(url)
+            self.assertEquals(r.status_code, 200)
+            body = await r.get_data()
+            r = await self.client.get(url)
+            self.assertEquals(r.status_code, 200)
+            self.assertEquals(await r.get_data(), body)
+            r = await self.client.get(url, headers={
+                'If-None-Match': r.headers['ETag']})
+            self.assertEquals(r.status_code, 304)
+
+    async def test_paged(self):
+        """Collections are paged with continuation links"""
+        r = await self.client.get('/asyncs?_limit=2')
+        body = await self._json(r)
+        self.assertEquals(len(body['asyncs']), 2)
+        r = await self.client.get(body['links']['next'])
+        body = await self._json(r)
+        self.assertEquals([a['name'] for a in body['asyncs']], ['Locked'])
+
+    async def test_post(self):
+        """Create a record and run the hooks, after validation"""
+        r = await self.client.post('/asyncs',
+                                   json={'asyncs': {'title': "No name"}})
+        self.assertEquals(r.status_code, 400)
+        r = await self.client.post('/asyncs',
+                                   json={'asyncs': {'name': "Async3"}})
+        self.assertEquals(r.status_code, 201)
+        record = self.db['asyncs'].find_one({'name': "Async3"})
+        self.assertEquals(r.headers['location'],
+                          '/asyncs/{}'.format(record['_id']))
+        self.assertEquals(AsyncsResource.saved, ['Async3'])
+
+    async def test_patch_delete(self):
+        """Update and delete records the request is authorized for"""
+        ids = {a['name']: a['_id'] for a in self.db['asyncs'].find()}
+        r = await self.client.patch('/asyncs/{}'.format(ids['Async1']),
+                                    json={'asyncs': {'name': "Patched"}})
+        self.assertEquals(r.status_code, 204)
+        self.assertEquals(self.db['asyncs'].find_one(ids['Async1'])['name'],
+                          "Patched")
+
+        r = await self.client.delete('/asyncs/{}'.format(ids['Locked']))
+        self.assertEquals(r.status_code, 403)
+        r = await self.client.delete('/asyncs/{}'.format(ids['Async2']))
+        self.assertEquals(r.status_code, 204)
+        self.assertEquals(self.db['asyncs'].count_documents({}), 2)
+
+    async def test_concurrent(self):
+        """Requests are served concurrently on one event loop"""
+        rs = await asyncio.gather(
+            *[self.client.get('/asyncs') for i in range(20)])
+        self.assertEquals([r.status_code for r in rs], [200] * 20)
+
+    async def test_cors(self):
+        """Origins are matched with the compiled CORS policy"""
+        origin = 'https://api.example.com'
+        r = await self.client.get('/cors', headers={'Origin': origin})
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.headers['Access-Control-Allow-Origin'], origin)
+        for origin in ['https://other.org', 'https://bad.example.com']:
+            r = await self.client.get('/cors', headers={'Origin': origin})
+            self.assertEquals(r.status_code, 405, origin)
+
+        r = await self.client.get('/asyncs', headers={'Origin': origin})
+        self.assertEquals(r.status_code, 405)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# The bulk test ensures that lists of records can be created, updated and
+# deleted in a single request, with a status for every record.
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.resources import BaseResource
+from pymongo import MongoClient
+
+import json
+import unittest
+
+
+class BulkValidation:
+    def validate_post(self, data):
+        if 'name' not in data:
+            return {'name': "Required"}
+
+    def validate_patch(self, data):
+        return self.validate_post(data)
+
+
+class BulkAuth:
+    def is_authorized(self, record):
+        return record.get('name', None) != 'Locked'
+
+
+class BulkResource(BaseResource):
+    db_collection = 'bulks'
+    allow_bulk = True
+    validation = BulkValidation
+    authentication = BulkAuth
+
+
+class SingleResource(BaseResource):
+    db_collection = 'bulks'
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Bulk')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, BulkResource)
+        register_resource(self.app, SingleResource, url="singles")
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        for name in ['Bulk1', 'Bulk2', 'Locked']:
+            self.db['bulks'].insert_one({'name': name})
+
+    def tearDown(self):
+        self.db['bulks'].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    def _statuses(self, r):
+        self.assertEquals(r.status_code, 200)
+        items = json.loads(r.data.decode('utf-8'))['bulks']
+        return [i['status'] for i in items], items
+
+    def test_post(self):
+        """Create records, skipping those that fail validation"""
+        data = [{'name': "New1"}, {'title': "No name"}, {'name': "New2"}]
+        r = self.client.post('/bulks', data=json.dumps({'bulks': data}),
+                             content_type="application/json")
+        statuses, items = self._statuses(r)
+        self.assertEquals(statuses, [201, 400, 201])
+        self.assertEquals(items[1]['errors'], {'name': "Required"})
+        self.assertEquals(self.db['bulks'].count_documents({}), 5)
+        for i in [0, 2]:
+            record = self.db['bulks'].find_one({'name': data[i]['name']})
+            self.assertEquals(items[i]['id'], str(record['_id']))
+
+    def test_patch(self):
+        """Update records, skipping missing and unauthorized ones"""
+        ids = {r['name']: str(r['_id']) for r in self.db['bulks'].find()}
+        data = [{'id': ids['Bulk1'], 'name': "Patched"},
+                {'id': ids['Locked'], 'name': "Unlocked"},
+                {'id': '55a4e1c9d4c6ab1b3cb36b1f', 'name': "Missing"}]
+        r = self.client.patch('/bulks', data=json.dumps({'bulks': data}),
+                              content_type="application/json")
+        statuses, items = self._statuses(r)
+        self.assertEquals(statuses, [204, 403, 404])
+        names = sorted(r['name'] for r in self.db['bulks'].find())
+        self.assertEquals(names, ['Bulk2', 'Locked', 'Patched'])
+
+    def test_delete(self):
+        """Delete the listed records"""
+        ids = {r['name']: str(r['_id']) for r in self.db['bulks'].find()}
+        r = self.client.delete('/bulks?_ids={},{}'.format(
+            ids['Bulk1'], ids['Bulk2']))
+        statuses, items = self._statuses(r)
+        self.assertEquals(statuses, [204, 204])
+        self.assertEquals(self.db['bulks'].count_documents({}), 1)
+
+    def test_unavailable(self):
+        """Bulk requests are rejected unless they are allowed"""
+        r = self.client.post('/singles',
+                             data=json.dumps({'bulks': [{'name': "New"}]}),
+                             content_type="application/json")
+        self.assertEquals(r.status_code, 400)
+        r = self.client.delete('/singles')
+        self.assertEquals(r.status_code, 405)
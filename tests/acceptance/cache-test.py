@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# The cache test ensures GET responses are served from the response cache
+# and that writes invalidate them.
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.cache import LRUCache
+from flask_slither.resources import BaseResource
+from pymongo import MongoClient
+
+import json
+import unittest
+
+
+class CachedResource(BaseResource):
+    db_collection = 'caches'
+    cache = LRUCache(max_size=10)
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Cache')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, CachedResource, url="caches")
+        CachedResource.cache = LRUCache(max_size=10)
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        self.db['caches'].insert_one({'name': "Cache1"})
+
+    def tearDown(self):
+        self.db['caches'].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    def _names(self, url='/caches'):
+        r = self.client.get(url)
+        self.assertEquals(r.status_code, 200)
+        records = json.loads(r.data.decode('utf-8'))['caches']
+        return [c['name'] for c in records]
+
+    def test_hit(self):
+        """Identical GETs are served from the cache"""
+        self.assertEquals(self._names(), ['Cache1'])
+        self.db['caches'].insert_one({'name': "Behind the cache"})
+        self.assertEquals(self._names(), ['Cache1'])
+        self.assertEquals(self._names('/caches?_fields=name'),
+                          ['Cache1', 'Behind the cache'])
+        stats = CachedResource.cache.stats()
+        self.assertEquals((stats['hits'], stats['misses']), (1, 2))
+
+    def test_invalidate(self):
+        """Writes drop the cached responses of the collection"""
+        self.assertEquals(self._names(), ['Cache1'])
+        r = self.client.post('/caches',
+                             data=json.dumps({'caches': {'name': "Cache2"}}),
+                             content_type="application/json")
+        self.assertEquals(r.status_code, 201)
+        self.assertEquals(self._names(), ['Cache1', 'Cache2'])
+
+        obj = self.db['caches'].find_one({'name': "Cache1"})
+        url = '/caches/{}'.format(obj['_id'])
+        self.assertEquals(json.loads(self.client.get(url).data.decode(
+            'utf-8'))['caches']['name'], "Cache1")
+        self.client.patch(url, data=json.dumps({'caches': {'name': "New"}}),
+                          content_type="application/json")
+        self.assertEquals(json.loads(self.client.get(url).data.decode(
+            'utf-8'))['caches']['name'], "New")
@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 # The cors test ensures that the CORS functionality is working for resources.
 
-from bson.objectid import ObjectId
 from flask import Flask
 from flask_slither import register_resource
+from flask_slither.cors import ALLOWED, BLACKLISTED, REFUSED, CorsPolicy
 from flask_slither.resources import BaseResource
 from pymongo import MongoClient
 
-import json
 import unittest
 
 
@@ -16,6 +15,22 @@ class CorsResource(BaseResource):
     cors_enabled = True
 
 
+class PolicyResource(BaseResource):
+    db_collection = 'cors'
+    cors_enabled = True
+    cors_config = {
+        'methods': ["GET"],
+        'allowed': ['localhost', '*.example.com', r'^api\d+\.test$'],
+        'blacklist': ['bad.example.com'],
+        'headers': ['Authorization', 'Content-Type'],
+    }
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        PolicyResource.instances += 1
+        BaseResource.__init__(self, *args, **kwargs)
+
+
 class CorsTest(unittest.TestCase):
 
     def setUp(self):
@@ -23,6 +38,8 @@ class CorsTest(unittest.TestCase):
         self.app.config['TESTING'] = True
         self.client = self.app.test_client()
         register_resource(self.app, CorsResource, url="cors")
+        register_resource(self.app, PolicyResource, url="policies")
+        PolicyResource.instances = 0
 
         self.db_client = MongoClient('localhost', 27017)
         self.db = self.db_client['test_slither']
@@ -39,7 +56,7 @@ class CorsTest(unittest.TestCase):
             {'name': "Cors single record"},
         ]
         for f in fixtures:
-            self.db['cors'].insert(f)
+            self.db['cors'].insert_one(f)
 
     def test_basic_check(self):
         """Check header of get response to ensure it matches CORS spec"""
@@ -66,3 +83,41 @@ class CorsTest(unittest.TestCase):
             self.assertEquals(r.status_code, 200)
             self.assertEquals(r.headers['access-control-allow-headers'],
                               'Authorization')
+
+    def test_origin_patterns(self):
+        """Origins are matched exactly, by wildcard or by regex"""
+        for origin, status in [('http://www.example.com', 200),
+                               ('https://api2.test', 200),
+                               ('http://bad.example.com', 405),
+                               ('http://example.org', 405)]:
+            r = self.client.open('/policies', method='OPTIONS',
+                                 headers={'origin': origin})
+            self.assertEquals(r.status_code, status, origin)
+            if status == 200:
+                self.assertEquals(r.headers['access-control-allow-origin'],
+                                  origin)
+
+    def test_suffixed_hosts(self):
+        """Regular expressions match the whole hostname, not a prefix"""
+        policy = CorsPolicy({'allowed': [r'^api\.example\.com', '*.test'],
+                             'blacklist': [r'^bad\.example\.test']})
+        for origin, decision in [
+                ('https://api.example.com', ALLOWED),
+                ('https://api.example.com.evil.io', REFUSED),
+                ('https://bad.example.test', BLACKLISTED),
+                # another host under the allowed wildcard
+                ('https://bad.example.test.other.test', ALLOWED)]:
+            self.assertEquals(policy.check_origin(origin), decision, origin)
+
+    def test_preflight(self):
+        """Preflights are answered without instantiating the resource"""
+        headers = {'origin': 'http://www.example.com',
+                   'access-control-request-headers':
+                   "authorization, X-Custom, Content-Type"}
+        r = self.client.open('/policies', method='OPTIONS', headers=headers)
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.headers['access-control-allow-methods'],
+                          "GET, OPTIONS")
+        self.assertEquals(r.headers['access-control-allow-headers'],
+                          "Authorization, Content-Type")
+        self.assertEquals(PolicyResource.instances, 0)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# The filter test ensures collections can be filtered from the query string
+# on the whitelisted fields, within the resource's access limits.
+
+from bson.objectid import ObjectId
+from datetime import datetime
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.cache import LRUCache
+from flask_slither.resources import BaseResource
+from pymongo import MongoClient
+
+import json
+import unittest
+
+OWNER = ObjectId()
+
+
+class FilteredResource(BaseResource):
+    db_collection = 'filters'
+    filterable_fields = {'name': str, 'count': int, 'owner': ObjectId,
+                         'created': datetime, 'tag': str}
+
+    def access_limits(self, **kwargs):
+        return {'hidden': {'$ne': True}}
+
+
+class CountedResource(FilteredResource):
+    count_mode = 'exact'
+
+
+class CachedCountResource(FilteredResource):
+    count_mode = 'exact'
+    count_cache = None
+    cache = LRUCache()
+
+
+class EstimatedResource(BaseResource):
+    db_collection = 'filters'
+    count_mode = 'fast'
+
+
+class FilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Filter')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, FilteredResource, url="filters")
+        register_resource(self.app, CountedResource, url="counted")
+        register_resource(self.app, EstimatedResource, url="estimated")
+        register_resource(self.app, CachedCountResource, url="cached")
+        CachedCountResource.cache.invalidate('filters')
+        BaseResource.count_cache.invalidate('count:filters')
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        fixtures = [
+            {'name': "Apple", 'count': 1, 'owner': OWNER, 'tag': 'a',
+             'created': datetime(2015, 1, 1)},
+            {'name': "Apricot", 'count': 5, 'owner': ObjectId(),
+             'created': datetime(2015, 6, 1)},
+            {'name': "Banana", 'count': 10, 'owner': OWNER,
+             'created': datetime(2015, 12, 1)},
+            {'name': "Avocado", 'count': 3, 'owner': OWNER, 'hidden': True,
+             'created': datetime(2015, 3, 1)},
+        ]
+        for f in fixtures:
+            self.db['filters'].insert_one(f)
+
+    def tearDown(self):
+        self.db['filters'].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    def _names(self, query):
+        r = self.client.get('/filters?{}'.format(query))
+        self.assertEquals(r.status_code, 200, query)
+        records = json.loads(r.data.decode('utf-8'))['filters']
+        return sorted(f['name'] for f in records)
+
+    def test_operators(self):
+        """Each operator narrows the collection"""
+        self.assertEquals(self._names('filter[name]=Apple'), ['Apple'])
+        self.assertEquals(self._names('filter[name][ne]=Apple'),
+                          ['Apricot', 'Banana'])
+        self.assertEquals(self._names('filter[count][in]=1,10'),
+                          ['Apple', 'Banana'])
+        self.assertEquals(
+            self._names('filter[count][gt]=1&filter[count][lt]=10'),
+            ['Apricot'])
+        self.assertEquals(self._names('filter[tag][exists]=true'), ['Apple'])
+        self.assertEquals(self._names('filter[name][prefix]=Ap'),
+                          ['Apple', 'Apricot'])
+
+    def test_coercion(self):
+        """Values are converted to the field type"""
+        self.assertEquals(self._names('filter[owner]={}'.format(OWNER)),
+                          ['Apple', 'Banana'])
+        self.assertEquals(
+            self._names('filter[created][gt]=2015-05-01T00:00:00'),
+            ['Apricot', 'Banana'])
+
+    def test_access_limits(self):
+        """Filters can't reach records outside the access limits"""
+        self.assertEquals(self._names('filter[name]=Avocado'), [])
+
+    def test_invalid(self):
+        """Unknown fields, operators and bad values are rejected"""
+        for query in ['filter[hidden]=true', 'filter[name][regex]=.*',
+                      'filter[count]=many', 'filter[owner]=1',
+                      'filter[count][prefix]=1', 'filter[name]]=x',
+                      'filter[created][gt]=99999999999999999',
+                      'filter[created][lt]=-99999999999999999']:
+            r = self.client.get('/filters?{}'.format(query))
+            self.assertEquals(r.status_code, 400, query)
+
+    def _total(self, url):
+        r = self.client.get(url)
+        self.assertEquals(r.status_code, 200, url)
+        meta = json.loads(r.data.decode('utf-8'))['meta']
+        self.assertEquals(r.headers['X-Total-Count'], str(meta['total']))
+        return meta['total']
+
+    def test_count(self):
+        """The total counts the filtered records across all pages"""
+        self.assertEquals(self._total('/counted'), 3)
+        self.assertEquals(self._total('/counted?filter[owner]={}&_limit=1'
+                                      .format(OWNER)), 2)
+        r = self.client.get('/filters')
+        self.assertNotIn('meta', json.loads(r.data.decode('utf-8')))
+        self.assertNotIn('X-Total-Count', r.headers)
+
+    def test_count_estimated(self):
+        """Unfiltered collections are counted from the metadata"""
+        self.assertEquals(self._total('/estimated'), 4)
+
+    def test_count_cache(self):
+        """Cached counts are dropped by writes"""
+        self.assertEquals(self._total('/counted'), 3)
+        self.db['filters'].insert_one({'name': "Cherry"})
+        self.assertEquals(self._total('/counted'), 3)
+        r = self.client.post('/counted',
+                             data=json.dumps({'filters': {'name': "Date"}}),
+                             content_type="application/json")
+        self.assertEquals(r.status_code, 201)
+        self.assertEquals(self._total('/counted'), 5)
+
+    def test_count_cached_response(self):
+        """Cached responses aren't counted again, and keep the count they
+           were serialized with"""
+        self.assertEquals(self._total('/cached'), 3)
+        self.db['filters'].insert_one({'name': "Cherry"})
+        self.assertEquals(self._total('/cached'), 3)
+        self.assertEquals(self._total('/cached?_limit=1'), 4)
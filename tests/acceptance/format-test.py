@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# The format test ensures GET responses are negotiated into NDJSON and
+# MessagePack with the Accept header, and that request bodies are accepted
+# in those formats.
+
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.formats import NDJSON, MSGPACK, pack, unpack
+from flask_slither.resources import BaseResource
+from pymongo import MongoClient
+
+import json
+import unittest
+
+
+class FormatResource(BaseResource):
+    db_collection = 'formats'
+    allow_bulk = True
+
+
+class FormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Format')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, FormatResource)
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        self.created = datetime(2015, 6, 1, 12, 0, 0)
+        for name in ['Format1', 'Format2', 'Format3']:
+            self.db['formats'].insert_one({'name': name,
+                                           'created': self.created})
+
+    def tearDown(self):
+        self.db['formats'].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    def test_get_json(self):
+        """JSON stays the default"""
+        r = self.client.get('/formats', headers={'Accept': '*/*'})
+        self.assertEquals(r.mimetype, 'application/json')
+        self.assertEquals(len(json.loads(r.data.decode('utf-8'))['formats']),
+                          3)
+        self.assertIn('Accept', r.headers['Vary'])
+
+    def test_get_ndjson(self):
+        """Collections are streamed a record per line"""
+        r = self.client.get('/formats', headers={'Accept': NDJSON})
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.mimetype, NDJSON)
+        lines = r.data.decode('utf-8').splitlines()
+        self.assertEquals([json.loads(line)['name'] for line in lines],
+                          ['Format1', 'Format2', 'Format3'])
+
+        r = self.client.get('/formats?include=owner',
+                            headers={'Accept': NDJSON})
+        self.assertEquals(r.status_code, 400)
+
+    def test_get_msgpack(self):
+        """ObjectIds and datetimes keep their types in MessagePack"""
+        record = self.db['formats'].find_one({'name': 'Format1'})
+        r = self.client.get('/formats/{}'.format(record['_id']),
+                            headers={'Accept': MSGPACK})
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.mimetype, MSGPACK)
+        payload = unpack(r.data)['formats']
+        self.assertEquals(payload['id'], record['_id'])
+        self.assertEquals(payload['created'],
+                          self.created.replace(tzinfo=timezone.utc))
+
+        r = self.client.get('/formats', headers={'Accept': MSGPACK})
+        self.assertEquals(len(unpack(r.data)['formats']), 3)
+
+    def test_post_msgpack(self):
+        owner = ObjectId()
+        r = self.client.post('/formats', content_type=MSGPACK,
+                             data=pack({'formats': {'name': "New",
+                                                    'owner': owner}}))
+        self.assertEquals(r.status_code, 201)
+        record = self.db['formats'].find_one({'name': "New"})
+        self.assertEquals(record['owner'], owner)
+
+        r = self.client.post('/formats', content_type=MSGPACK, data=b'\xc1')
+        self.assertEquals(r.status_code, 400)
+
+    def test_post_ndjson(self):
+        """Each line is a record, so several lines are a bulk import"""
+        r = self.client.post('/formats', content_type=NDJSON,
+                             data='{"name": "New1"}\n')
+        self.assertEquals(r.status_code, 201)
+
+        r = self.client.post('/formats', content_type=NDJSON,
+                             data='{"name": "New2"}\n{"name": "New3"}\n')
+        self.assertEquals(r.status_code, 200)
+        statuses = [i['status'] for i in
+                    json.loads(r.data.decode('utf-8'))['formats']]
+        self.assertEquals(statuses, [201, 201])
+        self.assertEquals(self.db['formats'].count_documents({}), 6)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# The include test ensures related records are embedded in the `included`
+# member with one query per relationship rather than one per record.
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.db import MongoDbQuery
+from flask_slither.resources import BaseResource
+from datetime import datetime
+from pymongo import MongoClient
+
+import json
+import unittest
+
+
+class CountingQuery(MongoDbQuery):
+    queries = []
+
+    def get_instances(self, collection, obj_ids, **kwargs):
+        CountingQuery.queries.append((collection, len(obj_ids)))
+        return MongoDbQuery.get_instances(self, collection, obj_ids, **kwargs)
+
+
+class ReviewerAuth:
+
+    def is_authorized(self, record):
+        return record.get('name', None) != "Bob"
+
+
+class UserResource(BaseResource):
+    db_collection = 'users'
+    authorization = ReviewerAuth
+
+    def access_limits(self, **kwargs):
+        return {'hidden': {'$ne': True}}
+
+    def limit_fields(self, **kwargs):
+        return {'password': False}
+
+
+class PostResource(BaseResource):
+    db_collection = 'posts'
+    db_query = CountingQuery
+    relationships = {
+        'author': {
+            'collection': 'users',
+            'projection': {'name': True, 'company': True},
+            'relationships': {'company': {'collection': 'companies'}},
+        },
+        'tags': {'collection': 'tags'},
+        'reviewer': {'resource': UserResource},
+        'checker': {'collection': 'users', 'field': 'reviewer'},
+    }
+
+
+class VersionedPostResource(PostResource):
+    db_collection = 'posts'
+    version_field = 'updated'
+
+
+class IncludeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Include')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, PostResource)
+        register_resource(self.app, VersionedPostResource, url="versioned")
+        PostResource.include_batch_size = 1000
+        CountingQuery.queries = []
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        company = self.db['companies'].insert_one(
+            {'name': "Acme"}).inserted_id
+        users = self.db['users'].insert_many([
+            {'name': n, 'company': company, 'password': "secret"}
+            for n in ["Ann", "Bob"]] + [
+            {'name': "Eve", 'hidden': True, 'password': "secret"}]
+        ).inserted_ids
+        tags = self.db['tags'].insert_many(
+            [{'name': n} for n in ["a", "b"]]).inserted_ids
+        for i, user in enumerate([users[0], users[1], users[0]]):
+            self.db['posts'].insert_one({'title': "Post{}".format(i),
+                                         'author': user, 'tags': tags[:i],
+                                         'reviewer': users[i],
+                                         'updated': datetime(2020, 1, 2)})
+
+    def tearDown(self):
+        for c in ['posts', 'users', 'companies', 'tags']:
+            self.db[c].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    def _included(self, url):
+        r = self.client.get(url)
+        self.assertEquals(r.status_code, 200)
+        included = json.loads(r.data.decode('utf-8')).get('included', [])
+        return sorted((i['type'], i['name']) for i in included), included
+
+    def test_include(self):
+        """Related records are loaded with one query per relationship"""
+        names, included = self._included('/posts?include=author,tags')
+        self.assertEquals(names, [('tags', 'a'), ('tags', 'b'),
+                                  ('users', 'Ann'), ('users', 'Bob')])
+        self.assertEquals(sorted(CountingQuery.queries),
+                          [('tags', 2), ('users', 2)])
+        self.assertTrue(all('password' not in i for i in included))
+
+    def test_nested(self):
+        """Relationships of related records can be included"""
+        names, included = self._included('/posts?include=author.company')
+        self.assertEquals(names, [('companies', 'Acme'), ('users', 'Ann'),
+                                  ('users', 'Bob')])
+        self.assertEquals(len(CountingQuery.queries), 2)
+
+    def test_instance(self):
+        """Instances include their related records"""
+        post = self.db['posts'].find_one({'title': "Post0"})
+        names, included = self._included(
+            '/posts/{}?include=author'.format(post['_id']))
+        self.assertEquals(names, [('users', 'Ann')])
+
+    def test_batches(self):
+        """Relationships are loaded in batches"""
+        PostResource.include_batch_size = 1
+        self._included('/posts?include=author')
+        self.assertEquals(CountingQuery.queries, [('users', 1)] * 2)
+
+    def test_invalid(self):
+        """Unknown and too deeply nested relationships are rejected"""
+        for include in ['editor', 'author.company.owner', 'tags.company']:
+            r = self.client.get('/posts?include={}'.format(include))
+            self.assertEquals(r.status_code, 400, include)
+
+    def test_resource(self):
+        """Records related through a resource are limited to those the
+           client could GET from it"""
+        names, included = self._included('/posts?include=reviewer')
+        # Bob isn't authorized, and Eve is outside the access limits
+        self.assertEquals(names, [('users', 'Ann')])
+        self.assertTrue(all('password' not in i for i in included))
+
+    def test_collection(self):
+        """Records related through a collection are only limited by the
+           relationship's query"""
+        names, included = self._included('/posts?include=checker')
+        self.assertEquals(names, [('users', 'Ann'), ('users', 'Bob'),
+                                  ('users', 'Eve')])
+
+    def test_conditional(self):
+        """Conditional GETs with included records aren't answered from the
+           record's version alone"""
+        post = self.db['posts'].find_one({'title': "Post0"})
+        url = '/versioned/{}'.format(post['_id'])
+        r = self.client.get(url + '?include=author')
+        self.db['users'].update_one({'_id': post['author']},
+                                    {'$set': {'name': "Anne"}})
+        r = self.client.get(url + '?include=author',
+                            headers={'If-None-Match': r.headers['ETag']})
+        self.assertEquals(r.status_code, 200)
+        included = json.loads(r.data.decode('utf-8'))['included']
+        self.assertEquals(included[0]['name'], "Anne")
+
+        r = self.client.get(url)
+        r = self.client.get(url, headers={'If-None-Match': r.headers['ETag']})
+        self.assertEquals(r.status_code, 304)
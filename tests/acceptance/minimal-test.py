@@ -5,11 +5,15 @@
 # ensure that works as expected.
 
 from bson.objectid import ObjectId
+from datetime import datetime, timedelta
 from flask import Flask
 from flask_slither import register_resource
 from flask_slither.resources import BaseResource
 from pymongo import MongoClient
+from werkzeug.http import http_date
 
+import base64
+import gzip
 import json
 import unittest
 
@@ -18,6 +22,17 @@ class MinimalResource(BaseResource):
     db_collection = 'minimals'
 
 
+class StreamedResource(BaseResource):
+    db_collection = 'minimals'
+    stream_collections = True
+    cursor_batch_size = 2
+
+
+class VersionedResource(BaseResource):
+    db_collection = 'versioneds'
+    version_field = 'updated'
+
+
 class MinimalTest(unittest.TestCase):
 
     def setUp(self):
@@ -26,6 +41,7 @@ class MinimalTest(unittest.TestCase):
         self.app.config['DB_NAME'] = 'testing_slither'
         self.client = self.app.test_client()
         register_resource(self.app, MinimalResource)
+        register_resource(self.app, StreamedResource, url="streamed")
 
         self.db_client = MongoClient('localhost', 27017)
         self.db = self.db_client[self.app.config['DB_NAME']]
@@ -44,7 +60,7 @@ class MinimalTest(unittest.TestCase):
             {'name': "Min3", 'references': {'Min1': None, 'Min2': 'numbers'}},
         ]
         for f in fixtures:
-            self.db['minimals'].insert(f)
+            self.db['minimals'].insert_one(f)
 
     def test_get_collection(self):
         """Get basic collection"""
@@ -59,8 +75,44 @@ class MinimalTest(unittest.TestCase):
         r = self.client.get('/minimals?_limit=2')
         self.assertEquals(r.status_code, 200)
         records = json.loads(r.data.decode('utf-8'))
-        self.assertEquals(list(records.keys()), ['minimals'])
+        self.assertEquals(sorted(records.keys()), ['links', 'minimals'])
         self.assertEquals(len(records['minimals']), 2)
+        self.assertEquals(list(records['links'].keys()), ['next'])
+
+    def test_get_collection_paged(self):
+        """Page through the sorted collection with the continuation links"""
+        r = self.client.get('/minimals?_limit=2&_sort=-_id')
+        first = json.loads(r.data.decode('utf-8'))
+        self.assertEquals(len(first['minimals']), 2)
+
+        r = self.client.get(first['links']['next'])
+        self.assertEquals(r.status_code, 200)
+        second = json.loads(r.data.decode('utf-8'))
+        self.assertEquals([m['name'] for m in second['minimals']], ['Min1'])
+        self.assertEquals(list(second['links'].keys()), ['prev'])
+
+        r = self.client.get(second['links']['prev'])
+        self.assertEquals(json.loads(r.data.decode('utf-8'))['minimals'],
+                          first['minimals'])
+
+    def test_get_collection_bad_sort(self):
+        """Sorting on fields that aren't sortable is rejected"""
+        r = self.client.get('/minimals?_sort=name')
+        self.assertEquals(r.status_code, 400)
+        r = self.client.get('/minimals?_limit=1&_after=bogus')
+        self.assertEquals(r.status_code, 400)
+
+    def test_get_collection_forged_token(self):
+        """Continuation tokens with values that don't load are rejected"""
+        for value in ['{"$oid": "zz"}', '{"$date": "x"}',
+                      '{"$numberDecimal": "x"}', '{"$date": 1e400}']:
+            token = base64.urlsafe_b64encode(
+                '[["_id"], [{}]]'.format(value).encode('utf-8'))
+            r = self.client.get('/minimals?_limit=1&_after={}'.format(
+                token.decode('ascii')))
+            self.assertEquals(r.status_code, 400, value)
+            self.assertIn("Malformed continuation token",
+                          r.data.decode('utf-8'))
 
     def test_get_collection_projection(self):
         """Get basic collection with a projection"""
@@ -81,6 +133,26 @@ class MinimalTest(unittest.TestCase):
             self.assertTrue('references' not in k,
                             "References not in {}".format(r['name']))
 
+    def test_get_collection_streamed(self):
+        """Streamed collection matches the buffered collection"""
+        r = self.client.get('/streamed')
+        self.assertEquals(r.status_code, 200)
+        self.assertTrue(r.is_streamed)
+        records = json.loads(r.data.decode('utf-8'))
+        expected = json.loads(
+            self.client.get('/minimals').data.decode('utf-8'))
+        self.assertEquals(records, expected)
+
+    def test_get_collection_streamed_gzip(self):
+        """Streamed collections are compressed as they are streamed"""
+        r = self.client.get('/streamed', headers={'Accept-Encoding': 'gzip'})
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.headers['Content-Encoding'], 'gzip')
+        records = json.loads(gzip.decompress(r.data).decode('utf-8'))
+        expected = json.loads(
+            self.client.get('/minimals').data.decode('utf-8'))
+        self.assertEquals(records, expected)
+
     def test_get_instance(self):
         """Get instance"""
         obj = self.db['minimals'].find_one({})
@@ -92,6 +164,23 @@ class MinimalTest(unittest.TestCase):
         obj['id'] = str(obj.pop('_id'))
         self.assertEquals(records['minimals'], obj)
 
+    def test_get_instance_not_modified(self):
+        """Conditional GET of an unchanged instance"""
+        obj = self.db['minimals'].find_one({})
+        url = '/minimals/{}'.format(obj['_id'])
+
+        r = self.client.get(url)
+        self.assertEquals(r.status_code, 200)
+        etag = r.headers['etag']
+        r = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEquals(r.status_code, 304)
+        self.assertEquals(r.data, b'')
+
+        self.db['minimals'].update_one({'_id': obj['_id']},
+                                       {'$set': {'name': 'Changed'}})
+        r = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEquals(r.status_code, 200)
+
     def test_get_instance_missing(self):
         """Get instance which doesn't exist"""
         r = self.client.get('/minimals/1')
@@ -103,14 +192,14 @@ class MinimalTest(unittest.TestCase):
 
         r = self.client.delete('/minimals/{}'.format(obj['_id']))
         self.assertEquals(r.status_code, 204)
-        self.assertEquals(self.db['minimals'].find().count(), 2)
+        self.assertEquals(self.db['minimals'].count_documents({}), 2)
         self.assertIsNone(self.db['minimals'].find_one({'_id': obj['_id']}))
 
     def test_delete_instance_missing(self):
         """Delete instance which doesn't exist"""
         r = self.client.get('/minimals/1')
         self.assertEquals(r.status_code, 404)
-        self.assertEquals(self.db['minimals'].find().count(), 3)
+        self.assertEquals(self.db['minimals'].count_documents({}), 3)
 
     def test_post(self):
         """Add new record"""
@@ -118,7 +207,7 @@ class MinimalTest(unittest.TestCase):
         r = self.client.post('/minimals', data=json.dumps({'minimals': data}),
                              content_type="application/json")
         self.assertEquals(r.status_code, 201)
-        self.assertEquals(self.db['minimals'].find().count(), 4)
+        self.assertEquals(self.db['minimals'].count_documents({}), 4)
 
         response_record = json.loads(r.data.decode('utf-8'))['minimals']
         self.assertEquals(
@@ -151,12 +240,38 @@ class MinimalTest(unittest.TestCase):
                               data=json.dumps({'minimals': data}),
                               content_type="application/json")
         self.assertEquals(r.status_code, 204)
-        self.assertEquals(self.db['minimals'].find().count(), 3)
+        self.assertEquals(self.db['minimals'].count_documents({}), 3)
 
         obj = self.db['minimals'].find_one({'_id': obj['_id']})
         self.assertEquals(obj['name'], data['name'])
         self.assertTrue('references' in obj)
 
+    def test_patch_representation(self):
+        """Update record with PATCH and get the updated record back"""
+        obj = self.db['minimals'].find_one({'name': 'Min3'})
+        r = self.client.patch('/minimals/{}'.format(obj['_id']),
+                              data=json.dumps({'minimals': {'name': "Rep"}}),
+                              content_type="application/json",
+                              headers={'Prefer': 'return=representation'})
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.headers['preference-applied'],
+                          'return=representation')
+        record = json.loads(r.data.decode('utf-8'))['minimals']
+        self.assertEquals(record['name'], "Rep")
+        self.assertEquals(record['references'], obj['references'])
+
+    def test_post_minimal(self):
+        """Add new record without getting it back"""
+        r = self.client.post('/minimals',
+                             data=json.dumps({'minimals': {'name': "Min"}}),
+                             content_type="application/json",
+                             headers={'Prefer': 'return=minimal'})
+        self.assertEquals(r.status_code, 201)
+        self.assertEquals(r.data, b'')
+        obj_id = r.location.split('/')[-1]
+        self.assertIsNotNone(
+            self.db['minimals'].find_one({'_id': ObjectId(obj_id)}))
+
     def test_put(self):
         """Update record with PUT"""
         obj = self.db['minimals'].find_one({'name': 'Min3'})
@@ -167,7 +282,7 @@ class MinimalTest(unittest.TestCase):
                             data=json.dumps({'minimals': data}),
                             content_type="application/json")
         self.assertEquals(r.status_code, 204)
-        self.assertEquals(self.db['minimals'].find().count(), 3)
+        self.assertEquals(self.db['minimals'].count_documents({}), 3)
 
         obj = self.db['minimals'].find_one({'_id': obj['_id']})
         self.assertEquals(obj['name'], data['name'])
@@ -175,3 +290,75 @@ class MinimalTest(unittest.TestCase):
         print('references' in obj)
         self.assertFalse('references' in obj)
         self.assertEquals(obj['extra'], data['extra'])
+
+
+class VersionedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Versioned')
+        self.app.config['TESTING'] = True
+        self.app.config['DB_NAME'] = 'testing_slither'
+        self.client = self.app.test_client()
+        register_resource(self.app, VersionedResource)
+
+        self.db_client = MongoClient('localhost', 27017)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        self.updated = datetime(2015, 7, 14, 12, 30)
+        _id = self.db['versioneds'].insert_one(
+            {'name': "Versioned1", 'updated': self.updated}).inserted_id
+        self.url = '/versioneds/{}'.format(_id)
+
+    def tearDown(self):
+        self.db['versioneds'].drop()
+        self.db_client.close()
+        self.client = None
+        self.app = None
+
+    def test_validators(self):
+        """The ETag and Last-Modified come from the version field"""
+        r = self.client.get(self.url)
+        self.assertEquals(r.status_code, 200)
+        self.assertEquals(r.headers['Last-Modified'], http_date(self.updated))
+        etag = r.headers['ETag']
+
+        # the ETag only changes with the version
+        self.db['versioneds'].update_one({}, {'$set': {'name': "Changed"}})
+        r = self.client.get(self.url)
+        self.assertEquals(r.headers['ETag'], etag)
+        self.db['versioneds'].update_one(
+            {}, {'$set': {'updated': self.updated + timedelta(seconds=1)}})
+        r = self.client.get(self.url)
+        self.assertNotEquals(r.headers['ETag'], etag)
+
+    def test_if_none_match(self):
+        r = self.client.get(self.url)
+        r = self.client.get(self.url,
+                            headers={'If-None-Match': r.headers['ETag']})
+        self.assertEquals(r.status_code, 304)
+        self.assertEquals(r.data, b'')
+
+    def test_if_modified_since(self):
+        r = self.client.get(self.url, headers={
+            'If-Modified-Since': http_date(self.updated)})
+        self.assertEquals(r.status_code, 304)
+
+        r = self.client.get(self.url, headers={
+            'If-Modified-Since': http_date(self.updated -
+                                           timedelta(seconds=1))})
+        self.assertEquals(r.status_code, 200)
+        records = json.loads(r.data.decode('utf-8'))
+        self.assertEquals(records['versioneds']['name'], "Versioned1")
+
+    def test_representation(self):
+        """The ETag changes with the query string and the media type"""
+        etag = self.client.get(self.url).headers['ETag']
+        fields = self.client.get(self.url + '?_fields=name')
+        self.assertNotEquals(fields.headers['ETag'], etag)
+        lines = self.client.get(self.url,
+                                headers={'Accept': 'application/x-ndjson'})
+        self.assertNotEquals(lines.headers['ETag'], etag)
+
+        # each representation only matches its own ETag
+        r = self.client.get(self.url, headers={
+            'If-None-Match': etag, 'Accept': 'application/x-ndjson'})
+        self.assertEquals(r.status_code, 200)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# The replica test ensures GETs are routed to the secondaries of a replica
+# set, and back to the primary after a client's own writes. It needs a local
+# replica set, given with the SLITHER_REPLICA_SET (its name) and
+# SLITHER_REPLICA_HOSTS (comma separated host:port) environment variables,
+# and is skipped without one.
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.db import MongoDbQuery, get_client
+from flask_slither.resources import BaseResource
+from pymongo.read_preferences import Secondary
+
+import json
+import os
+import unittest
+
+REPLICA_SET = os.environ.get('SLITHER_REPLICA_SET', None)
+HOSTS = os.environ.get('SLITHER_REPLICA_HOSTS', 'localhost:27017')
+
+
+class AddressQuery(MongoDbQuery):
+    """Records the address of the member that answered each collection
+       read"""
+    addresses = []
+
+    def get_collection(self, collection, **kwargs):
+        cursor = self._find(collection, **kwargs)
+        records = list(cursor)
+        AddressQuery.addresses.append(cursor.address)
+        return records
+
+
+class ReplicaResource(BaseResource):
+    db_collection = 'replicas'
+    db_query = AddressQuery
+    read_preference = Secondary(max_staleness=90)
+    read_your_writes = 5
+
+
+@unittest.skipIf(REPLICA_SET is None, "No replica set configured")
+class ReplicaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('Replica')
+        self.app.config.update({
+            'TESTING': True,
+            'DB_NAME': 'testing_slither',
+            'DB_HOST': HOSTS.split(','),
+            'DB_REPLICA_SET': REPLICA_SET,
+        })
+        self.client = self.app.test_client()
+        register_resource(self.app, ReplicaResource)
+        self.db_client = get_client(**self.app.config)
+        self.db = self.db_client[self.app.config['DB_NAME']]
+        AddressQuery.addresses = []
+
+    def tearDown(self):
+        self.db['replicas'].drop()
+
+    def test_secondary(self):
+        r = self.client.get('/replicas')
+        self.assertEquals(r.status_code, 200)
+        self.assertIn(AddressQuery.addresses[0], self.db_client.secondaries)
+
+    def test_read_your_writes(self):
+        r = self.client.post('/replicas', data=json.dumps(
+            {'replicas': {'name': "Replica1"}}),
+            content_type="application/json")
+        self.assertEquals(r.status_code, 201)
+        r = self.client.get('/replicas')
+        self.assertEquals(len(json.loads(r.data.decode('utf-8'))['replicas']),
+                          1)
+        self.assertEquals(AddressQuery.addresses[-1],
+                          self.db_client.primary)
+
+        # other clients still read from the secondaries
+        self.app.test_client().get('/replicas')
+        self.assertIn(AddressQuery.addresses[-1], self.db_client.secondaries)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Tests the negotiation and compression of response bodies
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.compression import compress, compress_stream
+from flask_slither.resources import BaseResource
+import gzip
+import json
+import unittest
+import zlib
+
+
+class ErrorsValidation:
+    def validate_delete(self, **kwargs):
+        return {'field{}'.format(i): "Invalid" for i in range(100)}
+
+
+class CompressTest(unittest.TestCase):
+
+    def test_codings(self):
+        """gzip and deflate bodies decode with the standard decoders"""
+        data = b"slither " * 100
+        self.assertEquals(gzip.decompress(compress(data, 'gzip')), data)
+        self.assertEquals(zlib.decompress(compress(data, 'deflate')), data)
+
+    def test_stream(self):
+        """Each streamed chunk is decodable as it arrives"""
+        chunks = list(compress_stream(['{"a": [', '1, 2', ']}'], 'gzip'))
+        d = zlib.decompressobj(31)
+        self.assertEquals(d.decompress(chunks[0]), b'{"a": [')
+        self.assertEquals(d.decompress(b''.join(chunks[1:])), b'1, 2]}')
+
+
+class NegotiationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('compression')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+    def _register(self, **attrs):
+        attrs.update({'db_collection': 'None', 'allowed_methods': ['DELETE'],
+                      'validation': ErrorsValidation})
+        resource = type('CompressedResource', (BaseResource,), attrs)
+        register_resource(self.app, resource, url="compressed")
+
+    def test_negotiate(self):
+        """The preferred coding the client accepts is used"""
+        self._register()
+        r = self.client.delete('/compressed/1', headers={
+            'Accept-Encoding': 'br;q=0, deflate;q=0.5, gzip'})
+        self.assertEquals(r.status_code, 400)
+        self.assertEquals(r.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', r.headers['Vary'])
+        errors = json.loads(gzip.decompress(r.data).decode('utf-8'))
+        self.assertEquals(len(errors['errors']), 100)
+
+        r = self.client.delete('/compressed/1')
+        self.assertNotIn('Content-Encoding', r.headers)
+        self.assertEquals(len(json.loads(r.data.decode('utf-8'))['errors']),
+                          100)
+
+    def test_min_size(self):
+        """Small responses aren't compressed"""
+        self._register(compression_min_size=100000)
+        r = self.client.delete('/compressed/1',
+                               headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', r.headers)
+
+    def test_opt_out(self):
+        """Resources can switch compression off"""
+        self._register(compression=False)
+        r = self.client.delete('/compressed/1',
+                               headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', r.headers)
+        self.assertNotIn('Vary', r.headers)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Tests the request time budget and how running out of time is answered
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.db import MongoDbQuery
+from flask_slither.deadlines import Deadline, DeadlineExceeded
+from flask_slither.resources import BaseResource
+from pymongo.errors import ExecutionTimeout, ServerSelectionTimeoutError
+import json
+import time
+import unittest
+
+
+class BudgetQuery(MongoDbQuery):
+    """Records the maxTimeMS of each query instead of running it"""
+    error = None
+    max_times = []
+
+    def get_collection(self, collection, **kwargs):
+        BudgetQuery.max_times.append(self._max_time_ms())
+        if BudgetQuery.error is not None:
+            raise BudgetQuery.error
+        return []
+
+
+class SlowAuth:
+    delay = 0
+
+    def is_authenticated(self, **kwargs):
+        time.sleep(SlowAuth.delay)
+        return True
+
+
+class BudgetResource(BaseResource):
+    db_collection = 'budgets'
+    db_query = BudgetQuery
+    authentication = SlowAuth
+    timeout = 2
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('deadlines')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        register_resource(self.app, BudgetResource)
+        BudgetQuery.error = None
+        BudgetQuery.max_times = []
+        SlowAuth.delay = 0
+
+    def _errors(self, r):
+        return json.loads(r.data.decode('utf-8'))['errors']
+
+    def test_max_time(self):
+        """Queries get the time left of the budget"""
+        r = self.client.get('/budgets')
+        self.assertEquals(r.status_code, 200)
+        self.assertTrue(1900 < BudgetQuery.max_times[0] <= 2000)
+
+    def test_header(self):
+        """Clients can shorten the budget, but not lengthen it"""
+        self.client.get('/budgets', headers={'X-Request-Timeout': '0.5'})
+        self.client.get('/budgets', headers={'X-Request-Timeout': '10'})
+        self.client.get('/budgets', headers={'X-Request-Timeout': 'soon'})
+        self.assertTrue(BudgetQuery.max_times[0] <= 500)
+        self.assertTrue(1900 < BudgetQuery.max_times[1] <= 2000)
+        self.assertTrue(1900 < BudgetQuery.max_times[2] <= 2000)
+
+    def test_bad_header(self):
+        """Timeouts that aren't finite and positive are ignored"""
+        for asked in ['inf', '1e400', 'nan', '0', '-1']:
+            r = self.client.get('/budgets',
+                                headers={'X-Request-Timeout': asked})
+            self.assertEquals(r.status_code, 200)
+        self.assertEquals(len(BudgetQuery.max_times), 5)
+        for max_time in BudgetQuery.max_times:
+            self.assertTrue(1900 < max_time <= 2000)
+
+    def test_spent(self):
+        """A budget spent on authentication fails before querying"""
+        SlowAuth.delay = 0.2
+        r = self.client.get('/budgets', headers={'X-Request-Timeout': '0.1'})
+        self.assertEquals(r.status_code, 504)
+        self.assertEquals(self._errors(r)['code'], 'deadline_exceeded')
+        self.assertEquals(self._errors(r)['timeout'], 0.1)
+        self.assertEquals(BudgetQuery.max_times, [])
+
+    def test_query_timeout(self):
+        BudgetQuery.error = ExecutionTimeout("operation exceeded time limit")
+        r = self.client.get('/budgets')
+        self.assertEquals(r.status_code, 504)
+        self.assertEquals(self._errors(r)['code'], 'deadline_exceeded')
+
+    def test_unavailable(self):
+        BudgetQuery.error = ServerSelectionTimeoutError("No servers")
+        r = self.client.get('/budgets')
+        self.assertEquals(r.status_code, 503)
+        self.assertEquals(self._errors(r)['code'], 'database_unavailable')
+        self.assertEquals(r.headers['Retry-After'], '1')
+
+    def test_deadline(self):
+        deadline = Deadline(0.05)
+        self.assertTrue(0 < deadline.max_time_ms() <= 50)
+        time.sleep(0.06)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.max_time_ms()
+
+    def test_not_finite(self):
+        self.assertIsNone(Deadline(float('inf')).max_time_ms())
+        self.assertIsNone(Deadline(float('nan')).max_time_ms())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Tests the request timings and the metrics sinks they are reported to
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.metrics import Timings, StatsdSink, PrometheusSink
+from flask_slither.resources import BaseResource
+import socket
+import unittest
+
+
+class TimingsTest(unittest.TestCase):
+
+    def test_header(self):
+        """Repeated phases are added up in the Server-Timing header"""
+        t = Timings()
+        t.record('db.find', 1.5)
+        t.record('serialize', 0.25)
+        t.record('db.find', 2)
+        self.assertEquals(t.header(), "db.find;dur=3.50, serialize;dur=0.25")
+
+    def test_statsd(self):
+        """Each phase is sent to statsd as a timer"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(1)
+        sink = StatsdSink(*server.getsockname(), prefix='api')
+        Timings(sink, {'resource': 'Users'}).record('total', 12)
+        self.assertEquals(server.recv(1024), b"api.Users.total:12.000|ms")
+        server.close()
+
+    def test_prometheus(self):
+        """Phases are kept as labelled histograms"""
+        sink = PrometheusSink()
+        Timings(sink, {'resource': 'Users'}).record('total', 20)
+        text = sink.expose()
+        labels = 'resource="Users",phase="total"'
+        self.assertIn(
+            'slither_request_phase_seconds_bucket{{{},le="0.025"}} 1'.format(
+                labels), text)
+        self.assertIn(
+            'slither_request_phase_seconds_bucket{{{},le="0.01"}} 0'.format(
+                labels), text)
+        self.assertIn(
+            'slither_request_phase_seconds_count{{{}}} 1'.format(labels), text)
+
+
+class ServerTimingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('timing')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+    def test_header(self):
+        """Resources with `server_timing` report their phases"""
+
+        class TimedResource(BaseResource):
+            db_collection = 'None'
+            allowed_methods = ['DELETE']
+            server_timing = True
+
+        register_resource(self.app, TimedResource, url="timed")
+        r = self.client.delete('/timed/1')
+        self.assertEquals(r.status_code, 204)
+        phases = [p.split(';')[0]
+                  for p in r.headers['Server-Timing'].split(', ')]
+        for phase in ['authentication', 'instance', 'total']:
+            self.assertIn(phase, phases)
+
+    def test_off(self):
+        """Timings are off by default"""
+
+        class UntimedResource(BaseResource):
+            db_collection = 'None'
+            allowed_methods = ['DELETE']
+
+        register_resource(self.app, UntimedResource, url="untimed")
+        r = self.client.delete('/untimed/1')
+        self.assertEquals(r.status_code, 204)
+        self.assertNotIn('Server-Timing', r.headers)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Tests the process wide MongoClient registry and its pool counters. The
+# clients are created with connect=False, so no database is needed.
+
+from flask_slither import db
+from flask_slither.db import PoolStats, close_clients, get_client, \
+    pool_stats
+from unittest import mock
+import os
+import unittest
+
+
+class ClientPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        close_clients()
+
+    def tearDown(self):
+        close_clients()
+
+    def test_shared(self):
+        """Settings with the same host, port and pool options share a
+           client"""
+        client = get_client(DB_HOST='localhost', DB_MAX_POOL_SIZE=10,
+                            DB_NAME='one')
+        self.assertIs(get_client(DB_HOST='localhost', DB_MAX_POOL_SIZE=10,
+                                 DB_NAME='two'), client)
+        self.assertIsNot(get_client(DB_HOST='localhost',
+                                    DB_MAX_POOL_SIZE=20), client)
+        self.assertIsNot(get_client(DB_HOST='localhost', DB_PORT=27018),
+                         client)
+        self.assertEquals(len(pool_stats()), 3)
+
+    def test_options(self):
+        """The DB_* settings are passed on as the client's pool options"""
+        client = get_client(DB_MAX_POOL_SIZE=10, DB_MIN_POOL_SIZE=2,
+                            DB_MAX_IDLE_TIME_MS=5000,
+                            DB_WAIT_QUEUE_TIMEOUT_MS=1000,
+                            DB_CONNECT_TIMEOUT_MS=2000)
+        options = client.options.pool_options
+        self.assertEquals(options.max_pool_size, 10)
+        self.assertEquals(options.min_pool_size, 2)
+        self.assertEquals(options.max_idle_time_seconds, 5)
+        self.assertEquals(options.wait_queue_timeout, 1)
+        self.assertEquals(options.connect_timeout, 2)
+        self.assertEquals(pool_stats()[0]['options'], {
+            'maxPoolSize': 10, 'minPoolSize': 2, 'maxIdleTimeMS': 5000,
+            'waitQueueTimeoutMS': 1000, 'connectTimeoutMS': 2000})
+
+    def test_unset_options(self):
+        """Settings that aren't given are left to the pymongo defaults"""
+        self.assertEquals(db._client_key({'DB_MAX_POOL_SIZE': None}),
+                          ('localhost', 27017, ()))
+
+    def test_fork(self):
+        """A forked child builds its own clients without closing the
+           parent's"""
+        client = get_client()
+        with mock.patch.object(client, 'close') as close, \
+                mock.patch.object(db.os, 'getpid',
+                                  return_value=os.getpid() + 1):
+            child = get_client()
+            self.assertIsNot(child, client)
+            self.assertIs(get_client(), child)
+            self.assertEquals(len(pool_stats()), 1)
+        self.assertFalse(close.called)
+
+    def test_close(self):
+        get_client()
+        close_clients()
+        self.assertEquals(pool_stats(), [])
+
+    def test_counters(self):
+        stats = PoolStats()
+        stats.connection_created(None)
+        stats.connection_created(None)
+        stats.connection_checked_out(None)
+        stats.connection_checked_out(None)
+        stats.connection_checked_in(None)
+        stats.connection_check_out_failed(None)
+        stats.connection_closed(None)
+        stats.pool_cleared(None)
+        self.assertEquals(stats.stats(), {
+            'created': 2, 'closed': 1, 'open': 1, 'checked_out': 2,
+            'checked_in': 1, 'in_use': 1, 'checkout_failed': 1,
+            'cleared': 1})
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Tests routing the reads of GETs with read preferences
+
+from bson.objectid import ObjectId
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.db import MongoDbQuery, _client_key
+from flask_slither.resources import BaseResource, PRIMARY_COOKIE
+from pymongo.read_preferences import Nearest, ReadPreference, \
+    SecondaryPreferred
+import unittest
+
+
+class RoutedQuery(MongoDbQuery):
+    """Records the read preference of each read instead of running it"""
+    reads = []
+
+    def get_instance(self, collection, obj_id, **kwargs):
+        RoutedQuery.reads.append(self.read_preference)
+        return {'_id': ObjectId(obj_id)}
+
+    def get_collection(self, collection, **kwargs):
+        RoutedQuery.reads.append(self.read_preference)
+        return []
+
+    def delete(self, collection, record):
+        pass
+
+
+ROUTES = {'instance': Nearest(),
+          'collection': SecondaryPreferred(max_staleness=90)}
+
+
+class RoutedResource(BaseResource):
+    db_collection = 'routes'
+    db_query = RoutedQuery
+    allowed_methods = ['GET', 'DELETE']
+    read_preference = ROUTES
+
+
+class ReadPreferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('readpref')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        register_resource(self.app, RoutedResource, url='routes')
+        RoutedQuery.reads = []
+        RoutedResource.read_preference = ROUTES
+        RoutedResource.read_your_writes = None
+        self.url = '/routes/{}'.format(ObjectId())
+
+    def test_per_method(self):
+        self.client.get('/routes')
+        self.client.get(self.url)
+        self.client.delete(self.url)
+        self.assertEquals(RoutedQuery.reads, [
+            SecondaryPreferred(max_staleness=90),
+            # the record is loaded before the GET itself reads it
+            Nearest(), Nearest(),
+            # writes read from the primary
+            ReadPreference.PRIMARY])
+
+    def test_default_preference(self):
+        """Without a resource read_preference, writes and GETs in the
+           read your writes window still read from the primary rather than
+           the client's DB_READ_PREFERENCE"""
+        RoutedResource.read_preference = None
+        RoutedResource.read_your_writes = 5
+        self.client.get('/routes')
+        self.client.delete(self.url)
+        self.client.get('/routes')
+        self.assertEquals(RoutedQuery.reads, [
+            None, ReadPreference.PRIMARY, ReadPreference.PRIMARY])
+
+    def test_read_your_writes(self):
+        """GETs after a client's write read from the primary"""
+        RoutedResource.read_your_writes = 5
+        r = self.client.delete(self.url)
+        self.assertIn(PRIMARY_COOKIE, r.headers['Set-Cookie'])
+        self.client.get('/routes')
+        self.assertEquals(RoutedQuery.reads[-1], ReadPreference.PRIMARY)
+
+        # other clients still read from the secondaries
+        self.app.test_client().get('/routes')
+        self.assertEquals(RoutedQuery.reads[-1],
+                          SecondaryPreferred(max_staleness=90))
+
+    def test_reads(self):
+        with self.app.test_request_context('/routes'):
+            query = MongoDbQuery(**self.app.config)
+            self.assertEquals(query._reads('routes').read_preference,
+                              ReadPreference.PRIMARY)
+            query.read_preference = ReadPreference.SECONDARY
+            self.assertEquals(query._reads('routes').read_preference,
+                              ReadPreference.SECONDARY)
+
+    def test_replica_set_key(self):
+        key = _client_key({'DB_HOST': ['db1:27017', 'db2:27017'],
+                           'DB_REPLICA_SET': 'rs0'})
+        self.assertEquals(key, (('db1:27017', 'db2:27017'), 27017,
+                                (('replicaSet', 'rs0'),)))
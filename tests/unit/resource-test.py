@@ -2,9 +2,11 @@
 # Tests the various class variables on a resource to ensure they behave as
 # expected
 
-from flask import Flask, g
+from flask import Flask, g, request
 from flask_slither import register_resource
+from flask_slither.cache import LRUCache
 from flask_slither.resources import BaseResource
+import logging
 import unittest
 
 
@@ -200,3 +202,161 @@ class AuthorizationTest(unittest.TestCase):
         register_resource(self.app, BaseResource, url="authorizations")
         r = self.client.delete('/authorizations/1')
         self.assertEquals(r.status_code, 204, "Successful authorization")
+
+
+class LoggingTest(unittest.TestCase):
+    """Ensure resources can log at their own level"""
+
+    def setUp(self):
+        self.app = Flask('logging')
+        self.app.config['TESTING'] = True
+        self.app.logger.setLevel(logging.WARNING)
+        self.client = self.app.test_client()
+
+    def test_resource_level(self):
+        """A resource log level doesn't change the app logger"""
+
+        class TracedResource(BaseResource):
+            db_collection = 'None'
+            allowed_methods = ['DELETE']
+            log_level = logging.DEBUG
+
+        register_resource(self.app, TracedResource, url="traced")
+        with self.assertLogs(self.app.logger, logging.DEBUG) as logs:
+            r = self.client.delete('/traced/1')
+        self.assertEquals(r.status_code, 204)
+        self.assertTrue(len([rec for rec in logs.records
+                             if rec.levelno == logging.DEBUG]) > 0)
+        self.assertTrue(all(rec.name.endswith('.TracedResource')
+                            for rec in logs.records))
+        self.assertEquals(self.app.logger.level, logging.WARNING)
+
+
+class AuthCacheTest(unittest.TestCase):
+    """Ensure auth results are cached per principal"""
+
+    def setUp(self):
+        self.app = Flask('authcache')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+        class TokenAuth:
+            instances = 0
+            calls = []
+            side_effect_free = True
+
+            def __init__(self):
+                TokenAuth.instances += 1
+
+            def cache_key(self, **kwargs):
+                return request.headers.get('Authorization', None)
+
+            def is_authenticated(self, **kwargs):
+                TokenAuth.calls.append('authenticated')
+                return request.headers.get('Authorization') == 'good'
+
+            def is_authorized(self, record):
+                TokenAuth.calls.append('authorized')
+                return True
+
+        class UserAuth(TokenAuth):
+            side_effect_free = False
+
+            def is_authenticated(self, **kwargs):
+                g.user = request.headers.get('Authorization')
+                return TokenAuth.is_authenticated(self, **kwargs)
+
+        class CachedAuthResource(BaseResource):
+            db_collection = 'None'
+            allowed_methods = ['DELETE']
+            authentication = TokenAuth
+            auth_cache = LRUCache(max_size=10)
+            users = []
+
+            def post_delete(self, record):
+                CachedAuthResource.users.append(getattr(g, 'user', None))
+
+        class UserAuthResource(CachedAuthResource):
+            authentication = UserAuth
+            auth_cache = LRUCache(max_size=10)
+
+        self.auth = TokenAuth
+        self.resource = CachedAuthResource
+        register_resource(self.app, CachedAuthResource, url="authcache")
+        register_resource(self.app, UserAuthResource, url="userauth")
+
+    def _delete(self, token):
+        return self.client.delete('/authcache/1',
+                                  headers={'Authorization': token})
+
+    def test_cached(self):
+        """Repeated requests with a token skip the auth methods"""
+        for i in range(3):
+            self.assertEquals(self._delete('good').status_code, 204)
+        self.assertEquals(self.auth.calls, ['authenticated', 'authorized'])
+        self.assertEquals(self.auth.instances, 1)
+
+    def test_side_effects(self):
+        """Authentication that sets attributes on g isn't cached"""
+        for i in range(3):
+            r = self.client.delete('/userauth/1',
+                                   headers={'Authorization': 'good'})
+            self.assertEquals(r.status_code, 204)
+        self.assertEquals(self.resource.users, ['good'] * 3)
+        self.assertEquals(self.auth.calls,
+                          ['authenticated', 'authorized', 'authenticated',
+                           'authenticated'])
+
+    def test_negative(self):
+        """Failures are cached too"""
+        for i in range(3):
+            self.assertEquals(self._delete('bad').status_code, 401)
+        self.assertEquals(self.auth.calls, ['authenticated'])
+
+    def test_revoke(self):
+        """Revoked principals are authenticated again"""
+        self._delete('good')
+        self.resource.revoke_credentials('good')
+        self._delete('good')
+        self.assertEquals(self.auth.calls, ['authenticated', 'authorized'] * 2)
+
+
+class MetaTest(unittest.TestCase):
+    """Ensure the resource settings are worked out at registration"""
+
+    def setUp(self):
+        self.app = Flask('meta')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+        class WidgetResource(BaseResource):
+            db_collection = 'None'
+            allowed_methods = ['DELETE']
+
+        self.resource = WidgetResource
+        register_resource(self.app, WidgetResource)
+
+    def test_registered(self):
+        meta = self.resource._resource_meta
+        self.assertEquals(meta.name, 'widget')
+        self.assertEquals(meta.url, '/widgets')
+        self.assertEquals(meta.endpoint, 'widget_api')
+        self.assertEquals(meta.payload_root, 'None')
+        self.assertEquals(meta.allowed_methods, frozenset(['DELETE']))
+        with self.assertRaises(AttributeError):
+            meta.url = '/gadgets'
+
+    def test_frozen(self):
+        """Class settings changed after registration are ignored"""
+        self.resource.allowed_methods = ['GET']
+        self.assertEquals(self.client.delete('/widgets/1').status_code, 204)
+        self.assertEquals(self.client.get('/widgets').status_code, 405)
+
+    def test_subclass(self):
+        """Subclasses don't share the metadata of their parent"""
+
+        class GadgetResource(self.resource):
+            json_root = 'gadget'
+
+        with self.app.test_request_context('/gadgets'):
+            self.assertEquals(GadgetResource()._payload_root(), 'gadget')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Tests the JSON serializer backends to ensure they all encode mongo types
+# the same way as the standard library encoder
+
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from flask_slither.db import MongoDbQuery
+from flask_slither.serializers import SERIALIZERS, get_serializer
+from uuid import UUID
+
+import json
+import unittest
+
+
+class SerializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.record = {
+            '_id': ObjectId('55a4e1c9d4c6ab1b3cb36b1f'),
+            'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+            'created': datetime(2015, 7, 14, tzinfo=timezone.utc),
+            'nested': {'ids': [ObjectId('55a4e1c9d4c6ab1b3cb36b20')]},
+            'name': "Slither", 'count': 3, 'ratio': 0.5, 'none': None,
+        }
+        self.expected = {
+            '_id': '55a4e1c9d4c6ab1b3cb36b1f',
+            'uuid': '12345678123456781234567812345678',
+            'created': 1436832000,
+            'nested': {'ids': ['55a4e1c9d4c6ab1b3cb36b20']},
+            'name': "Slither", 'count': 3, 'ratio': 0.5, 'none': None,
+        }
+
+    def test_backends(self):
+        """Every installed backend encodes to the same JSON"""
+        for name, (cls, available) in SERIALIZERS.items():
+            if not available:
+                continue
+            payload = get_serializer(name).dumps(self.record)
+            self.assertEquals(json.loads(payload), self.expected,
+                              "Backend {}".format(name))
+
+    def test_bytes(self):
+        """Every installed backend writes the same bytes, so ETags don't
+           depend on the backend"""
+        payloads = set(get_serializer(name).dumps(self.record)
+                       for name, (cls, available) in SERIALIZERS.items()
+                       if available)
+        self.assertEquals(len(payloads), 1)
+        self.assertNotIn(': ', payloads.pop())
+
+    def test_number_keys(self):
+        """Number keys, e.g. in validation errors by position, are written
+           as strings by every backend"""
+        errors = {'errors': {0: "Required", 1: {2: "Too long"}, 0.5: None}}
+        payloads = set(get_serializer(name).dumps(errors)
+                       for name, (cls, available) in SERIALIZERS.items()
+                       if available)
+        self.assertEquals(len(payloads), 1)
+        self.assertEquals(json.loads(payloads.pop()), {'errors': {
+            '0': "Required", '1': {'2': "Too long"}, '0.5': None}})
+
+    def test_stream(self):
+        """Streamed collections are the same as serialized ones"""
+        query = MongoDbQuery()
+        records = [{'_id': i, 'name': "Record {}".format(i)}
+                   for i in range(3)]
+        payload = query.serialize('records', [dict(r) for r in records])
+        self.assertEquals(''.join(query.serialize_stream(
+            'records', [dict(r) for r in records])), payload)
+
+    def test_auto(self):
+        """The auto serializer is one of the installed backends"""
+        available = [n for n, (c, ok) in SERIALIZERS.items() if ok]
+        self.assertTrue(get_serializer('auto').name in available)
+        self.assertEquals(get_serializer('json').name, 'json')
+
+    def test_unknown_type(self):
+        """Types without a JSON representation are rejected"""
+        for name, (cls, available) in SERIALIZERS.items():
+            if available:
+                with self.assertRaises(TypeError):
+                    get_serializer(name).dumps({'value': object()})
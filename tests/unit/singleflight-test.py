@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Tests coalescing identical concurrent GETs into one query
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.cache import SingleFlight
+from flask_slither.db import MongoDbQuery
+from flask_slither.deadlines import Deadline, DeadlineExceeded
+from flask_slither.resources import BaseResource
+import json
+import threading
+import time
+import unittest
+
+REQUESTS = 8
+
+
+class CountingQuery(MongoDbQuery):
+    """Answers collection queries without a database. The first query is
+       held until the other requests are waiting on it."""
+    queries = 0
+
+    def get_collection(self, collection, **kwargs):
+        CountingQuery.queries += 1
+        flight = FlightResource.single_flight
+        deadline = time.monotonic() + 5
+        while flight.shared < REQUESTS - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return [{'name': "Flight {}".format(i)} for i in range(3)]
+
+
+class FlightResource(BaseResource):
+    db_collection = 'flights'
+    db_query = CountingQuery
+    single_flight = SingleFlight()
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('singleflight')
+        self.app.config['TESTING'] = True
+        register_resource(self.app, FlightResource)
+        CountingQuery.queries = 0
+        FlightResource.single_flight = SingleFlight()
+
+    def _get_concurrently(self, urls):
+        responses = []
+
+        def get(url):
+            responses.append(self.app.test_client().get(url))
+        threads = [threading.Thread(target=get, args=(url,)) for url in urls]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return responses
+
+    def test_coalesced(self):
+        """Identical GETs share one query and payload"""
+        responses = self._get_concurrently(['/flights'] * REQUESTS)
+        self.assertEquals(CountingQuery.queries, 1)
+        self.assertEquals(FlightResource.single_flight.stats(),
+                          {'calls': 1, 'shared': REQUESTS - 1})
+        for r in responses:
+            self.assertEquals(r.status_code, 200)
+            self.assertEquals(r.data, responses[0].data)
+        self.assertEquals(
+            len(json.loads(responses[0].data.decode('utf-8'))['flights']), 3)
+
+    def test_different(self):
+        """GETs with different queries aren't coalesced"""
+        FlightResource.single_flight.shared = REQUESTS
+        self._get_concurrently(['/flights', '/flights?_fields=name'])
+        self.assertEquals(CountingQuery.queries, 2)
+
+    def test_sequential(self):
+        """The result isn't kept once the flight lands"""
+        FlightResource.single_flight.shared = REQUESTS
+        client = self.app.test_client()
+        client.get('/flights')
+        client.get('/flights')
+        self.assertEquals(CountingQuery.queries, 2)
+
+    def test_error(self):
+        """Waiting callers get the error of the call in flight"""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("Failed")
+
+        def call():
+            try:
+                flight.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        while flight.shared < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEquals(len(errors), 2)
+        self.assertEquals(flight.stats(), {'calls': 1, 'shared': 1})
+
+    def _lead(self, flight, f):
+        """Starts the call of 'key' with `f` in a thread, and returns the
+           thread once `f` is running"""
+        started = threading.Event()
+
+        def call():
+            try:
+                flight.do('key', lambda: started.set() or f())
+            except DeadlineExceeded:
+                pass
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        return leader
+
+    def test_deadline(self):
+        """Callers stop waiting once their own deadline is spent"""
+        flight = SingleFlight()
+        release = threading.Event()
+        leader = self._lead(flight, lambda: release.wait(5))
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            flight.do('key', lambda: "Follower", Deadline(0.05))
+        self.assertTrue(time.monotonic() - start < 1)
+        release.set()
+        leader.join()
+
+    def test_leader_deadline(self):
+        """A call that ran out of its own time is made again by the callers
+           waiting on it"""
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def expire():
+            release.wait(5)
+            raise DeadlineExceeded("Request took longer than 0.1s")
+        leader = self._lead(flight, expire)
+        results = []
+        follower = threading.Thread(target=lambda: results.append(
+            flight.do('key', lambda: "Follower", Deadline(5))))
+        follower.start()
+        while flight.shared < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEquals(results, ["Follower"])
+        self.assertEquals(flight.calls, 2)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Tests logging slow queries with their shape and explained plan
+
+from bson.objectid import ObjectId
+from flask_slither.db import MongoDbQuery
+from flask_slither.slowlog import SlowQueryLog, query_shape, summarize_plan
+from pymongo.errors import ExecutionTimeout
+import unittest
+
+EXPLAIN = {
+    'queryPlanner': {'winningPlan': {
+        'stage': 'FETCH',
+        'inputStage': {'stage': 'IXSCAN', 'indexName': 'name_1'}}},
+    'executionStats': {'nReturned': 2, 'totalKeysExamined': 40,
+                       'totalDocsExamined': 40}}
+
+
+class SlowQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.query = MongoDbQuery(DB_SLOW_QUERY_MS=0,
+                                  DB_SLOW_QUERY_EXPLAIN=True)
+        self.query.slow_queries = SlowQueryLog(max_size=3)
+        self.explained = 0
+
+    def _explain(self):
+        self.explained += 1
+        return EXPLAIN
+
+    def test_shape(self):
+        query = {'$and': [{'owner': ObjectId()},
+                          {'$or': [{'name': {'$in': ["a", "b"]}},
+                                   {'age': {'$gt': 3}}]}]}
+        self.assertEquals(query_shape(query), {'$and': [
+            {'owner': '?'},
+            {'$or': [{'name': {'$in': '?'}}, {'age': {'$gt': '?'}}]}]})
+
+    def test_plan(self):
+        self.assertEquals(summarize_plan(EXPLAIN), {
+            'stages': ['FETCH', 'IXSCAN'], 'indexes': ['name_1'],
+            'collscan': False, 'keys_examined': 40, 'docs_examined': 40,
+            'returned': 2})
+        plan = summarize_plan({'queryPlanner': {
+            'winningPlan': {'stage': 'COLLSCAN'}}})
+        self.assertTrue(plan['collscan'])
+
+    def test_slow(self):
+        for name in ["a", "b"]:
+            with self.query._watch('find', 'slows', {'name': name},
+                                   {'name': 1}, self._explain):
+                pass
+        entries = self.query.slow_queries.entries()
+        self.assertEquals(len(entries), 2)
+        self.assertEquals(entries[0]['query'], {'name': '?'})
+        self.assertEquals(entries[0]['projection'], ['name'])
+        self.assertEquals(entries[0]['plan']['indexes'], ['name_1'])
+        # the shape is only explained once
+        self.assertEquals(self.explained, 1)
+
+        summary = self.query.slow_queries.summary()
+        self.assertEquals(len(summary), 1)
+        self.assertEquals(summary[0]['count'], 2)
+
+    def test_fast(self):
+        self.query.slow_query_ms = 1000
+        with self.query._watch('find', 'slows', {}, None, self._explain):
+            pass
+        self.assertEquals(self.query.slow_queries.entries(), [])
+        self.assertEquals(self.explained, 0)
+
+    def test_failed(self):
+        """Slow operations that raise are recorded with their error, without
+           being explained"""
+        with self.assertRaises(ValueError):
+            with self.query._watch('find', 'slows', {}, None, self._explain):
+                raise ValueError()
+        entries = self.query.slow_queries.entries()
+        self.assertEquals(len(entries), 1)
+        self.assertEquals(entries[0]['error'], 'ValueError')
+        self.assertNotIn('plan', entries[0])
+        self.assertEquals(self.explained, 0)
+
+    def test_timeout(self):
+        """Timeouts are recorded however long they took"""
+        self.query.slow_query_ms = 1000
+        with self.assertRaises(ExecutionTimeout):
+            with self.query._watch('find', 'slows', {}, None, self._explain):
+                raise ExecutionTimeout("operation exceeded time limit")
+        with self.assertRaises(ValueError):
+            with self.query._watch('find', 'slows'):
+                raise ValueError()
+        entries = self.query.slow_queries.entries()
+        self.assertEquals([e['error'] for e in entries], ['ExecutionTimeout'])
+
+    def test_ring(self):
+        for op in ['find', 'count', 'insert', 'delete']:
+            with self.query._watch(op, 'slows'):
+                pass
+        self.assertEquals([e['op'] for e in
+                           self.query.slow_queries.entries()],
+                          ['delete', 'insert', 'count'])
+        self.assertEquals(len(self.query.slow_queries.entries(op='count')),
+                          1)
+
+    def test_off(self):
+        query = MongoDbQuery()
+        query.slow_queries = SlowQueryLog()
+        with query._watch('find', 'slows'):
+            pass
+        self.assertEquals(query.slow_queries.entries(), [])
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Tests running the post_save/post_delete hooks in the background
+
+from flask import Flask
+from flask_slither import register_resource
+from flask_slither.db import MongoDbQuery
+from flask_slither.resources import BaseResource
+from flask_slither.tasks import ThreadPoolRunner, PersistentQueueRunner
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+class HookedResource(BaseResource):
+    db_collection = 'None'
+    allowed_methods = ['DELETE']
+    calls = []
+    failures = 0
+
+    def post_delete(self, record):
+        if HookedResource.failures > 0:
+            HookedResource.failures -= 1
+            raise RuntimeError("Hook failed")
+        HookedResource.calls.append(threading.current_thread())
+
+
+class BudgetQuery(MongoDbQuery):
+    """Records the maxTimeMS of each query instead of running it"""
+    max_times = []
+
+    def get_collection(self, collection, **kwargs):
+        BudgetQuery.max_times.append(self._max_time_ms())
+        return []
+
+
+class LateResource(HookedResource):
+    db_query = BudgetQuery
+    timeout = 0.05
+
+    def post_delete(self, record):
+        time.sleep(0.1)  # outlive the request's budget
+        self.db_query.get_collection(self.db_collection)
+        HookedResource.calls.append(threading.current_thread())
+
+
+class RunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('tasks')
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        HookedResource.calls = []
+        HookedResource.failures = 0
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        HookedResource.hook_runner = None
+        LateResource.hook_runner = None
+        self.dir.cleanup()
+
+    def _delete(self, runner):
+        HookedResource.hook_runner = runner
+        register_resource(self.app, HookedResource, url="hooked")
+        r = self.client.delete('/hooked/1')
+        self.assertEquals(r.status_code, 204)
+
+    def test_thread_pool(self):
+        """Hooks run on the pool and are drained on shutdown"""
+        runner = ThreadPoolRunner(workers=2, backoff=0)
+        self._delete(runner)
+        runner.shutdown()
+        self.assertEquals(len(HookedResource.calls), 1)
+        self.assertNotEqual(HookedResource.calls[0],
+                            threading.current_thread())
+
+    def test_after_deadline(self):
+        """Hooks on the pool can query once the request is out of time"""
+        BudgetQuery.max_times = []
+        LateResource.hook_runner = runner = ThreadPoolRunner(backoff=0)
+        register_resource(self.app, LateResource, url="late")
+        r = self.client.delete('/late/1')
+        self.assertEquals(r.status_code, 204)
+        runner.shutdown()
+        self.assertEquals(len(HookedResource.calls), 1)
+        self.assertEquals(BudgetQuery.max_times, [None])
+        self.assertEquals(runner.dead_letters.all(), [])
+
+    def test_dead_letters(self):
+        """Hooks that keep failing end up in the dead letters"""
+        HookedResource.failures = 3
+        runner = ThreadPoolRunner(workers=1, retries=1, backoff=0)
+        self._delete(runner)
+        runner.shutdown()
+        self.assertEquals(HookedResource.calls, [])
+        letters = runner.dead_letters.all()
+        self.assertEquals([d['hook'] for d in letters],
+                          ['HookedResource.post_delete'])
+
+    def test_persistent(self):
+        """Queued hooks are retried and survive a restart"""
+        path = os.path.join(self.dir.name, 'hooks.db')
+        HookedResource.failures = 1
+        runner = PersistentQueueRunner(path, backoff=0, poll_interval=0.01)
+        runner.shutdown()  # queue the hook without running it
+        self._delete(runner)
+        self.assertEquals(runner.pending(), 1)
+
+        runner = PersistentQueueRunner(path, backoff=0, poll_interval=0.01)
+        runner.init_app(self.app)
+        while runner.pending() > 0:
+            threading.Event().wait(0.01)
+        runner.shutdown()
+        self.assertEquals(len(HookedResource.calls), 1)
+        self.assertEquals(runner.dead_letters.all(), [])